@@ -0,0 +1,64 @@
+'''
+Equaliser bands: the linear pixel to bin gather and equal slice bars the
+equalisers used, against log and mel bands from the precomputed band
+matrix (one matrix-vector product per chunk, shared by both equalisers).
+
+Shows how many of the 160 columns fall below 250Hz and 2kHz on each
+scale, the cost of building the matrix and the per chunk time. Checks
+each band is the weighted mean of the spectrum it claims to be.
+
+    uv run python -m benchmarks.bands
+'''
+import time
+
+import numpy as np
+
+from dabble import rasteriser
+from dabble.spectrum import BandScale, SpectrumAnalyzer
+from benchmarks.common import WIDTH, synthetic_signal, time_frames, report
+
+SAMPLE_RATE = 48000
+NUM_BARS    = 32
+
+
+def centre_hz(analyzer:SpectrumAnalyzer, matrix:np.ndarray) -> np.ndarray:
+    ''' Weighted centre frequency of each band '''
+    hz_per_bin = analyzer.sample_rate / analyzer.chunk_size
+    return matrix @ (np.arange(matrix.shape[1]) * hz_per_bin)
+
+
+def main(frames:int=200):
+    signals  = [synthetic_signal(sample_rate=SAMPLE_RATE, seed=i) for i in range(frames)]
+    analyzer = SpectrumAnalyzer(sample_rate=SAMPLE_RATE)
+    analyzer.analyse(signals[0])
+
+    linear = analyzer.bin_map(WIDTH) * SAMPLE_RATE / analyzer.chunk_size
+    print(f'linear columns below 250Hz: {np.sum(linear < 250):3d}  below 2kHz: {np.sum(linear < 2000):3d}')
+    for scale in BandScale:
+        t1 = time.perf_counter()
+        matrix = analyzer.band_matrix(WIDTH, scale)
+        built = (time.perf_counter() - t1) * 1000
+        hz = centre_hz(analyzer, matrix)
+        print(f'{scale:<6} columns below 250Hz: {np.sum(hz < 250):3d}  below 2kHz: {np.sum(hz < 2000):3d}  '
+              f'matrix {matrix.shape} built in {built:.1f}ms')
+        bands = analyzer.bands(WIDTH, scale)
+        assert np.allclose(bands, matrix.astype(np.float64) @ analyzer.spectrum, rtol=1e-4), "Bands differ"
+
+    def before(s):
+        analyzer.analyse(s)
+        analyzer.columns(WIDTH)
+        rasteriser.band_values(analyzer.spectrum, NUM_BARS)
+
+    def after(scale):
+        def bands(s):
+            analyzer.analyse(s)
+            rasteriser.band_values(analyzer.bands(WIDTH, scale), NUM_BARS)
+        return bands
+
+    report("linear gather + slices", time_frames(before, signals))
+    for scale in BandScale:
+        report(f'{scale} band matrix', time_frames(after(scale), signals))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+'''
+Helpers shared by the benchmarks. Run benchmarks from the repo root e.g.
+
+    uv run python -m benchmarks.graphic_equaliser
+'''
+import time
+import numpy as np
+
+from dabble.spectrum import SpectrumAnalyzer
+
+WIDTH  = 160
+HEIGHT = 80
+
+
+def synthetic_signal(frames:int=2048, sample_rate:int=48000, seed:int=0) -> np.ndarray:
+    '''
+    Interleaved stereo int32 signal, a few tones plus noise, the same
+    shape as AudioProcessing.signal()
+    '''
+    rng = np.random.default_rng(seed)
+    t = np.arange(frames) / sample_rate
+    tones = sum(a * np.sin(2 * np.pi * f * t + rng.uniform(0, np.pi))
+                for f, a in ((60, 1.0), (440, 0.5), (2500, 0.25), (9000, 0.1)))
+    mono = tones * (2**28) * rng.uniform(0.2, 1.0) + rng.normal(0, 2**24, frames)
+    stereo = np.empty(frames * 2, dtype=np.int32)
+    stereo[0::2] = mono
+    stereo[1::2] = mono * 0.9
+    return stereo
+
+
+def spectra(signals:list) -> list[tuple[float, np.ndarray]]:
+    '''
+    (max magnitude, spectrum) for each signal, as LCDUI.fft returns them
+    '''
+    analyzer = SpectrumAnalyzer()
+    result = []
+    for s in signals:
+        (max_magnitude, spectrum) = analyzer.analyse(s)
+        result.append((max_magnitude, spectrum.copy()))
+    return result
+
+
+def time_frames(render, inputs:list, repeat:int=3) -> dict:
+    '''
+    Call render(i) for each input, repeat times. Returns frame time stats in ms
+    '''
+    times = []
+    for _ in range(repeat):
+        for i in inputs:
+            t1 = time.perf_counter_ns()
+            render(i)
+            times.append((time.perf_counter_ns() - t1) / 1e6)
+    t = np.array(times)
+    return {
+        "frames": len(t),
+        "mean":   float(t.mean()),
+        "p50":    float(np.percentile(t, 50)),
+        "p99":    float(np.percentile(t, 99)),
+    }
+
+
+def report(name:str, stats:dict):
+    print(f'{name:<32} frames:{stats["frames"]:5d} mean:{stats["mean"]:7.3f}ms '
+          f'p50:{stats["p50"]:7.3f}ms p99:{stats["p99"]:7.3f}ms')
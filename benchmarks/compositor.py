@@ -0,0 +1,77 @@
+'''
+Frame time with a menu open over a dimmed screen, and dimming in
+standby. "Before" dims with Image.eval and a lambda every frame then
+draws the menu on the copy, as LCDUI used to. "After" uses the
+Compositor: the dimmed screen is kept while the menu is open and only
+the menu is redrawn. Every frame is checked to be pixel identical.
+
+    uv run python -m benchmarks.compositor
+'''
+import numpy as np
+from PIL import Image, ImageDraw
+
+from dabble.compositor import Compositor, Overlay
+from dabble.text_cache import TextCache
+from benchmarks.common import WIDTH, HEIGHT, time_frames, report
+from benchmarks.text_cache import FONTS, STATION, ENSEMBLE
+
+MENU = ("Equaliser/Full: On", "Equaliser/Bars: Off", "Waveform: Off", "Levels: On",
+        "Visualiser: On", "Station Name: On", "Exit")
+
+
+def screen(seed:int=0) -> Image.Image:
+    ''' Something busy to dim, noise where the visualiser would be '''
+    rng = np.random.default_rng(seed)
+    a = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+    a[26:63] = rng.integers(0, 255, size=(37, WIDTH, 3), dtype=np.uint8)
+    img = Image.fromarray(a, mode="RGB")
+    ImageDraw.Draw(img).text((0, HEIGHT), "D1 National", font=FONTS["ensemble"], fill=ENSEMBLE, anchor="ld")
+    return img
+
+
+class Menu():
+    def __init__(self):
+        self.cache = TextCache()
+        self.i     = 0
+
+    def draw(self, img) -> list:
+        (prev, sel, nxt) = (MENU[self.i-1], MENU[self.i], MENU[(self.i+1) % len(MENU)])
+        ImageDraw.Draw(img).line((0, 0, 0, HEIGHT), width=1, fill="#023047")
+        return [(0, 0, 0, HEIGHT),
+                self.cache.draw(img, (5, HEIGHT//2 - 18), prev, FONTS["menu_sml"], ENSEMBLE, "lm"),
+                self.cache.draw(img, (5, HEIGHT//2), sel, FONTS["menu"], STATION, "lm"),
+                self.cache.draw(img, (5, HEIGHT//2 + 18), nxt, FONTS["menu_sml"], ENSEMBLE, "lm")]
+
+
+def main():
+    base  = screen()
+    menu  = Menu()
+    steps = list(range(len(MENU))) * 40
+
+    def before(i):
+        menu.i = i
+        dimmed = Image.eval(base, lambda x: x/5)
+        menu.draw(dimmed)
+        return dimmed
+
+    comp = Compositor(base)
+    comp.push(Overlay("menu", menu.draw))
+
+    def after(i):
+        menu.i = i
+        return comp.compose()[0]
+
+    for i in steps[:len(MENU)*2]:
+        assert before(i).tobytes() == after(i).tobytes(), "Menu frames differ"
+    report("menu, Image.eval", time_frames(before, steps))
+    report("menu, Compositor", time_frames(after, steps))
+    print(f'Compositor dimmed the screen {comp.dims} times')
+
+    standby = Compositor(base)
+    assert Image.eval(base, lambda x: x/5).tobytes() == standby.dim().tobytes(), "Standby frames differ"
+    report("standby, Image.eval", time_frames(lambda _: Image.eval(base, lambda x: x/5), range(100)))
+    report("standby, Compositor.dim", time_frames(lambda _: standby.dim(), range(100)))
+
+
+if __name__ == "__main__":
+    main()
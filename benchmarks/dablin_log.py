@@ -0,0 +1,164 @@
+'''
+Replay a recorded dablin stderr capture through DablinLogParser.
+
+Measures parse throughput (lines/s) with the queue pre-filled and the
+latency from a PAD line being queued to the update handler firing, with
+lines arriving at a steady rate as they would from dablin. The old
+parser (one line per 50ms poll) is run for comparison.
+
+    uv run python -m benchmarks.dablin_log
+'''
+import re
+import time
+from pathlib import Path
+from queue import Empty, Queue
+from threading import Event, Thread
+
+import numpy as np
+
+from dabble.radio_player import DABLIN_KEYS, DablinLogParser, MsgUpdates
+
+CAPTURE = Path(__file__).parent / "data" / "dablin-stderr.log"
+SID     = "0xC0C6"
+
+
+def capture(repeat:int=1) -> list[str]:
+    '''
+    Lines of the capture, repeat times. PAD labels get a suffix so every
+    repeat is a fresh update
+    '''
+    lines = CAPTURE.read_text().splitlines()
+    result = []
+    for r in range(repeat):
+        for l in lines:
+            if l.startswith("PADChangeDynamicLabel"):
+                l = l[:-1] + f" #{r}'"
+            result.append(l)
+    return result
+
+
+def old_lookups(sid:str) -> dict:
+    '''
+    The regexs as they were, one per key for the tuned SId only
+    '''
+    return {
+        "dab_type":  re.compile(rf"^FICDecoder: SId {sid}: audio service \(SubChId\s+\d+, (?P<v>.*), primary\)", re.IGNORECASE),
+        "prog_type": re.compile(rf"^FICDecoder: SId {sid}: programme type \(static\): '(?P<v>.*)'", re.IGNORECASE),
+        "pad_label": re.compile(rf"PADChangeDynamicLabel SId {sid} Label:'(?P<v>.+)'", re.IGNORECASE),
+        "media_fmt": re.compile(rf"^EnsemblePlayer: format: (?P<v>.*)", re.IGNORECASE),
+        "no_signal": re.compile(rf"^There does not seem to be a DAB signal here", re.IGNORECASE)
+    }
+
+
+def old_parse_line(l:str, lookups:dict):
+    '''
+    Strip codes then try each regex in turn, as the parser used to
+    '''
+    l = re.sub(u'\x1b\[.*?[@-~]', '', l)
+    l = re.sub(r'\(\d+\)', '', l)
+    for lu in lookups:
+        r=lookups[lu].search(l)
+        if r:
+            return ( lu, r.groupdict()['v'] if 'v' in r.groupdict() else "no_data" )
+    return (None, None)
+
+
+class OldDablinLogParser(DablinLogParser):
+    '''
+    The parser as it was: poll the queue for one line every 50ms
+    '''
+    def _get_line_from_q(self, recd_threshold:int=200):
+        s=""
+        recd=0
+        line = self._q.get_nowait()
+        if line is None:
+            return None
+        for c in line:
+            s+=c
+            recd+=1
+            if c=="\n" or recd>recd_threshold:
+                break
+        return s
+
+    def run(self, sid:str):
+        lookups = old_lookups(sid)
+        self._updates = MsgUpdates(DABLIN_KEYS)
+        while not self._end_task.is_set():
+            k = None
+            try:
+                l = self._get_line_from_q()
+                if l is None:
+                    break
+                (k, v) = old_parse_line(l, lookups)
+                self.lines_parsed += 1
+            except Empty:
+                pass
+            if k is not None and self._updates.update(k, v) and self.pad_update_handler is not None:
+                self.pad_update_handler(self.updates())
+            time.sleep(0.05)
+
+
+def throughput(parser_class, lines:list) -> float:
+    '''
+    Lines/s with everything already queued
+    '''
+    q = Queue()
+    for l in lines:
+        q.put(l)
+    q.put(None)
+    parser = parser_class(q, Event())
+    t1 = time.perf_counter()
+    parser.run(SID)
+    return parser.lines_parsed / (time.perf_counter() - t1)
+
+
+def latency(parser_class, lines:list, interval:float=0.002) -> np.ndarray:
+    '''
+    ms from a PAD line being queued to its update reaching the handler,
+    with a line queued every interval seconds
+    '''
+    q = Queue()
+    e = Event()
+    parser = parser_class(q, e)
+    put_times = dict()
+    latencies = []
+
+    def handler(updates):
+        t = time.perf_counter()
+        pad = updates.get("pad_label")
+        if pad.value in put_times:
+            latencies.append((t - put_times.pop(pad.value)) * 1000)
+    parser.pad_update_handler = handler
+
+    t = Thread(target=parser.run, args=(SID,))
+    t.start()
+    for l in lines:
+        if l.startswith("PADChangeDynamicLabel"):
+            put_times[l.split("Label:'", 1)[1][:-1]] = time.perf_counter()
+        q.put(l)
+        time.sleep(interval)
+    # Let the old parser drain what is left
+    deadline = time.perf_counter() + len(lines) * 0.06
+    while put_times and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    parser.stop()
+    t.join()
+    return np.array(latencies)
+
+
+def report(name:str, lines_per_sec:float, lat:np.ndarray):
+    print(f'{name:<8} {lines_per_sec:10.0f} lines/s  update latency '
+          f'p50:{np.percentile(lat, 50):7.2f}ms p99:{np.percentile(lat, 99):7.2f}ms ({len(lat)} updates)')
+
+
+def main():
+    lines = capture(repeat=1000)
+    report("new", throughput(DablinLogParser, lines), latency(DablinLogParser, capture(repeat=10)))
+
+    # The old parser takes 50ms a line so use a much smaller sample
+    lines = capture(repeat=1)
+    report("old", throughput(OldDablinLogParser, lines), latency(OldDablinLogParser, lines))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+'''
+Lines/s matching dablin stderr lines: the old one regex per key loop
+against the prefix dispatch in parse_dablin_line. Uses a synthetic log of
+100k lines with the mix of FIC, PAD, format and error lines dablin
+produces for a multi-service ensemble.
+
+    uv run python -m benchmarks.dablin_parse
+'''
+import time
+
+import numpy as np
+
+from dabble.radio_player import ANSI_CODES, parse_dablin_line
+
+from .dablin_log import SID, old_lookups, old_parse_line
+
+SIDS = ("0xC0C6", "0xC4CD", "0xCFE8", "0xC1D8", "0xC7D1", "0xC2A5")
+
+
+def synthetic_log(lines:int=100_000, seed:int=0) -> list[str]:
+    rng = np.random.default_rng(seed)
+    templates = (
+        (0.30, "FICDecoder: SId {sid}: audio service (SubChId {n:2d}, DAB+, primary)"),
+        (0.15, "FICDecoder: SId {sid}: programme type (static): 'Pop Music'"),
+        (0.15, "FICDecoder: SId {sid}: programme service label 'Station {n}' ('Stn {n}')"),
+        (0.10, "FICDecoder: SId {sid}, SCIdS  0: MSC service component (SubChId {n:2d})"),
+        (0.20, "PADChangeDynamicLabel SId {sid} Label:'Now playing: Track {n}'"),
+        (0.03, "EnsemblePlayer: format: HE-AAC v2, 48 kHz Stereo @ 80 kBit/s"),
+        (0.07, "\x1b[31m(AU) \x1b[0m\x1b[31m({n})\x1b[0m"),
+    )
+    (weights, formats) = zip(*templates)
+    choice = rng.choice(len(formats), size=lines, p=weights)
+    sids   = rng.choice(SIDS, size=lines)
+    nums   = rng.integers(0, 64, size=lines)
+    return [formats[c].format(sid=s, n=n) for c, s, n in zip(choice, sids, nums)]
+
+
+def lines_per_sec(parse, lines:list, repeat:int=3) -> float:
+    best = 0.0
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        for l in lines:
+            parse(l)
+        best = max(best, len(lines) / (time.perf_counter() - t1))
+    return best
+
+
+def main():
+    lines = synthetic_log()
+    lookups = old_lookups(SID)
+    # What the old approach would cost to hear about every SId
+    all_lookups = [old_lookups(s) for s in SIDS]
+
+    old     = lines_per_sec(lambda l: old_parse_line(l, lookups), lines)
+    old_all = lines_per_sec(lambda l: [old_parse_line(l, lu) for lu in all_lookups], lines)
+    new     = lines_per_sec(lambda l: parse_dablin_line(ANSI_CODES.sub('', l)), lines)
+
+    print(f'{len(lines)} lines')
+    print(f'old (per key regexs, tuned SId only) {old:10.0f} lines/s')
+    print(f'old (per key regexs, every SId)      {old_all:10.0f} lines/s')
+    print(f'new (prefix dispatch, every SId)     {new:10.0f} lines/s  x{new/old:.1f}')
+
+
+if __name__ == "__main__":
+    main()
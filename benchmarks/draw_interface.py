@@ -0,0 +1,262 @@
+'''
+Frame time for LCDUI.draw_interface, the whole render path, on a headless
+LCDUI (in-memory panel, no shairport-sync) fed synthetic audio.
+
+Runs through every visualiser, the visualiser off, both menus and standby.
+Reports p50/p99 frame time for each and the time spent in each draw
+primitive and pushing to the panel. Checks the panel ends up showing the
+last frame.
+
+Always fails if any p99 is over the fixed frame budget for its render
+mode. No baseline is committed, timings depend too much on the machine,
+so until one is saved with --save only the frame budgets are checked.
+Once saved it also fails if p50/p99 are slower than the baseline by more
+than the tolerance. Save it on the machine you compare on:
+
+    uv run python -m benchmarks.draw_interface --save
+    uv run python -m benchmarks.draw_interface
+
+Neither the LCD driver (st7735) nor dbus-python are needed. pyaudio and
+alsaaudio are, for dabble.audio_processing.
+'''
+import argparse
+import collections
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+
+from dabble import exceptions, frame_rate, lcd_ui, menus, timer_wheel
+from dabble.audio_processing import Analysis
+from dabble.envelope import Envelope
+from dabble.lcd_ui import GraphicState
+from dabble.spectrum import SpectrumAnalyzer
+from benchmarks.common import WIDTH, synthetic_signal, report
+from benchmarks.text_cache import font
+
+BASELINE   = Path(__file__).parent / "data" / "draw_interface.json"
+PRIMITIVES = ("draw_viz", "graphic_equaliser", "graphic_equaliser_bars", "waveform",
+              "draw_station_name", "draw_volume_bar", "draw_mode", "draw_ensemble",
+              "draw_dab_type", "draw_levels", "clear_levels", "draw_menu",
+              "clear_screen", "draw_clock", "update")
+
+
+class SyntheticAudio():
+    '''
+    Enough of AudioProcessing for the UI: a new analysis of a synthetic
+    chunk every frame
+    '''
+    def __init__(self, chunks:int=32):
+        analyzer = SpectrumAnalyzer()
+        envelope = Envelope(columns=WIDTH)
+        self.analyses = []
+        for seed in range(chunks):
+            signal = synthetic_signal(seed=seed)
+            a = Analysis(seq=seed+1)
+            mono = analyzer.mix(signal)
+            (lo, hi) = envelope.decimate(signal, mono)
+            a.store("envelope_lo", lo)
+            a.store("envelope_hi", hi)
+            a.max_amplitude = envelope.amplitude
+            (a.max_magnitude, spectrum) = analyzer.transform()
+            a.store("spectrum", spectrum)
+            a.store("columns", analyzer.columns(WIDTH))
+            a.store("bands", analyzer.bands(WIDTH))
+            a.peak_l = int(abs(int(signal[0::2].max()))/2**31*100)
+            a.peak_r = int(abs(int(signal[1::2].max()))/2**31*100)
+            self.analyses.append(a)
+        self.frame         = 0
+        self.analysis_time = 0.0
+
+    def next(self):
+        self.frame += 1
+
+    def analysis(self) -> Analysis:
+        return self.analyses[self.frame % len(self.analyses)]
+
+    @property
+    def peak_l(self) -> int:
+        return self.analysis().peak_l
+
+    @property
+    def peak_r(self) -> int:
+        return self.analysis().peak_r
+
+
+class Primitives():
+    '''
+    Time calls to the LCDUI draw methods and the panel push
+    '''
+    def __init__(self, ui:lcd_ui.LCDUI):
+        self.times = collections.defaultdict(list)
+        for name in PRIMITIVES:
+            setattr(ui, name, self._timed(name, getattr(ui, name)))
+        ui.panel.update = self._timed("panel push", ui.panel.update)
+
+    def _timed(self, name:str, fn):
+        times = self.times[name]
+        def timed(*args, **kwargs):
+            t1 = time.perf_counter_ns()
+            r = fn(*args, **kwargs)
+            times.append((time.perf_counter_ns() - t1) / 1e6)
+            return r
+        return timed
+
+    def report(self):
+        print("Primitives (all scenarios)")
+        for (name, times) in sorted(self.times.items(), key=lambda kv: -sum(kv[1])):
+            if times:
+                t = np.array(times)
+                print(f'  {name:<24} calls:{len(t):5d} total:{t.sum():8.1f}ms '
+                      f'p50:{np.percentile(t, 50):7.3f}ms p99:{np.percentile(t, 99):7.3f}ms')
+
+
+def headless_ui(audio:SyntheticAudio) -> lcd_ui.LCDUI:
+    ui = lcd_ui.LCDUI(headless=True)
+    try:
+        ui.init_fonts()
+    except exceptions.FontException:
+        # Theme fonts are only installed on the radio
+        (ui.station_font, ui.ensemble_font, ui.menu_sel_font, ui.menu_sml_font, ui.clock_font) = \
+            (font(20), font(13), font(18), font(15), font(24))
+    ui.text_cache_report = 0
+
+    state = ui.state
+    state.audio_processor = audio
+    state.radio_state     = menus.RadioMachine()
+    state.station_name    = "Magic Radio"
+    state.ensemble        = "D1 National"
+    state.dab_type        = "DAB+"
+    state.last_pad_message = "Now playing: Queen - Don't Stop Me Now. Call us on 0344 1 059 059"
+    state.awaiting_signal = False
+
+    state.lm = menus.Menu()
+    for item in ("Equaliser/Full", "Equaliser/Bars", "Waveform", "Levels", "Visualiser", "Station Name"):
+        state.lm.add_menu(item, init_state="On")
+    state.lm.add_menu("Exit")
+    state.rm = menus.Menu()
+    for item in ("Radio Mode", "Airplay Mode"):
+        state.rm.add_menu(item, init_state="Off")
+    for item in ("Scan Channels", "Standby", "Exit"):
+        state.rm.add_menu(item)
+    return ui
+
+
+def scenarios(ui:lcd_ui.LCDUI):
+    '''
+    (name, render mode, setup, per frame) for each scenario, run in order
+    '''
+    state = ui.state
+    rs    = state.radio_state
+
+    def visualiser(v):
+        def setup():
+            state.visualiser_enabled = True
+            state.visualiser = v
+        return setup
+
+    def open_menu(menu, activate):
+        def setup():
+            activate()
+            state.current_menu_item = menu.get_first_menu_item()
+        return setup
+
+    def next_item(menu):
+        def step(i):
+            if i % 4 == 0:
+                state.current_menu_item = menu.get_next_menu()
+        return step
+
+    def standby():
+        rs.right_menu_selection()
+        rs.activate_standby()
+
+    VIZ = frame_rate.RenderMode.VISUALISER
+    return [
+        ("graphic_equaliser", VIZ, visualiser(GraphicState.GRAPHIC_EQUALISER), None),
+        ("graphic_equaliser_bars", VIZ, visualiser(GraphicState.GRAPHIC_EQUALISER_BARS), None),
+        ("waveform", VIZ, visualiser(GraphicState.WAVEFORM), None),
+        ("visualiser off", frame_rate.RenderMode.TEXT, lambda: state.update("visualiser_enabled", False), None),
+        ("left menu", frame_rate.RenderMode.TEXT, open_menu(state.lm, rs.activate_left_menu), next_item(state.lm)),
+        ("right menu", frame_rate.RenderMode.TEXT, lambda: (rs.left_menu_timeout(), open_menu(state.rm, rs.activate_right_menu)()),
+         next_item(state.rm)),
+        ("standby", frame_rate.RenderMode.STANDBY, standby, None),
+    ]
+
+
+def run(ui:lcd_ui.LCDUI, audio:SyntheticAudio, frames:int) -> dict:
+    results = dict()
+    for (name, mode, setup, step) in scenarios(ui):
+        setup()
+        times = []
+        for i in range(frames):
+            if step is not None:
+                step(i)
+            audio.next()
+            t1 = time.perf_counter_ns()
+            ui.draw_interface()
+            times.append((time.perf_counter_ns() - t1) / 1e6)
+        t = np.array(times)
+        stats = {"frames": len(t), "mean": float(t.mean()),
+                 "p50": float(np.percentile(t, 50)), "p99": float(np.percentile(t, 99))}
+        report(name, stats)
+        results[name] = dict(stats, budget=1000 / frame_rate.DEFAULT_FPS[mode])
+    return results
+
+
+def check_panel(ui:lcd_ui.LCDUI):
+    '''
+    The panel should show the last frame, to RGB565 precision
+    '''
+    shown    = np.asarray(ui.disp.image())
+    expected = np.asarray(ui.compositor.out) & np.array([0xF8, 0xFC, 0xF8], dtype=np.uint8)
+    if not np.array_equal(shown, expected):
+        raise SystemExit("Panel doesn't show the last frame")
+
+
+def regressions(results:dict, baseline:dict, tolerance:float) -> list[str]:
+    failed = []
+    for (name, stats) in results.items():
+        if stats["p99"] > stats["budget"]:
+            failed.append(f'{name}: p99 {stats["p99"]:.2f}ms over the {stats["budget"]:.1f}ms frame budget')
+        if name not in baseline:
+            continue
+        for p in ("p50", "p99"):
+            if stats[p] > baseline[name][p] * tolerance:
+                failed.append(f'{name}: {p} {stats[p]:.3f}ms vs baseline {baseline[name][p]:.3f}ms')
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=300, help="Frames per scenario")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Allowed slow down vs the baseline")
+    parser.add_argument("--save", action="store_true", help=f'Save the results as the baseline ({BASELINE})')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    audio = SyntheticAudio()
+    ui    = headless_ui(audio)
+    prims = Primitives(ui)
+    results = run(ui, audio, args.frames)
+    check_panel(ui)
+    prims.report()
+    timer_wheel.WHEEL.stop()
+
+    if args.save:
+        BASELINE.write_text(json.dumps(results, indent=2))
+        print(f'Baseline saved to {BASELINE}')
+        return
+
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else dict()
+    if not baseline:
+        print("No baseline saved, only checking frame budgets")
+    if failed := regressions(results, baseline, args.tolerance):
+        raise SystemExit("Regressions:\n  " + "\n  ".join(failed))
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
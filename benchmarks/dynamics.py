@@ -0,0 +1,81 @@
+'''
+Spectrum smoothing and AGC: how much the equaliser columns jump from one
+frame to the next with each chunk scaled by its own loudest bin, as the
+visualisers used to, against 50% overlapped hops smoothed by Dynamics and
+scaled by its AGC level. Also times the per hop cost.
+
+The signal is the synthetic tones, which vary in level and phase from
+chunk to chunk, with a quiet passage of a few seconds in the middle.
+
+    uv run python -m benchmarks.dynamics
+'''
+import numpy as np
+
+from dabble.dynamics import Dynamics
+from dabble.spectrum import SpectrumAnalyzer
+from benchmarks.common import WIDTH, HEIGHT, synthetic_signal, time_frames, report
+
+SAMPLE_RATE = 48000
+CHUNK       = 2048
+HOP         = CHUNK // 2
+
+
+def music(chunks:int) -> np.ndarray:
+    '''
+    Interleaved chunks of tones with a quiet passage in the middle third
+    '''
+    parts = []
+    for i in range(chunks):
+        gain = 0.1 if chunks//3 <= i < 2*chunks//3 else 1.0
+        parts.append((synthetic_signal(CHUNK, SAMPLE_RATE, seed=i) * gain).astype(np.int32))
+    return np.concatenate(parts)
+
+
+def heights(analyzer:SpectrumAnalyzer, spectrum:np.ndarray, max_magnitude:float) -> np.ndarray:
+    return np.clip(analyzer.bands(WIDTH) * HEIGHT / max_magnitude, 0, HEIGHT)
+
+
+def jitter(frames:list) -> float:
+    '''
+    Mean change in column height (pixels) between frames
+    '''
+    h = np.array(frames)
+    return float(np.abs(np.diff(h, axis=0)).mean())
+
+
+def main(chunks:int=300):
+    signal = music(chunks)
+
+    per_chunk = SpectrumAnalyzer(sample_rate=SAMPLE_RATE, chunk_size=CHUNK)
+    before = []
+    for i in range(chunks):
+        (max_magnitude, spectrum) = per_chunk.analyse(signal[i*CHUNK*2:(i+1)*CHUNK*2])
+        before.append(heights(per_chunk, spectrum, max_magnitude))
+
+    overlapped = SpectrumAnalyzer(sample_rate=SAMPLE_RATE, chunk_size=CHUNK, use_window=True)
+    dynamics   = Dynamics(len(overlapped.spectrum), hop=HOP/SAMPLE_RATE, full_scale=overlapped.full_scale())
+    hops       = [signal[i*2:(i+CHUNK)*2] for i in range(0, chunks*CHUNK - CHUNK + 1, HOP)]
+    after = []
+    for s in hops:
+        (_, spectrum) = overlapped.analyse(s)
+        max_magnitude = dynamics.apply(spectrum)
+        after.append(heights(overlapped, spectrum, max_magnitude))
+
+    # Compare at the same frame rate, one frame per chunk
+    print(f'Column jitter per frame: per chunk max {jitter(before):5.2f}px, '
+          f'smoothed + AGC {jitter(after[0::2]):5.2f}px')
+    q = slice(len(before)//3, 2*len(before)//3)
+    print(f'Mean height in the quiet passage: per chunk max {np.mean(before[q]):5.2f}px, '
+          f'smoothed + AGC {np.mean(after[0::2][q]):5.2f}px')
+
+    def step(s):
+        (_, spectrum) = overlapped.analyse(s)
+        dynamics.apply(spectrum)
+        overlapped.bands(WIDTH)
+
+    report("analyse + bands", time_frames(lambda s: (per_chunk.analyse(s), per_chunk.bands(WIDTH)), hops))
+    report("analyse + dynamics + bands", time_frames(step, hops))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+'''
+Before/after frame time for LCDUI.graphic_equaliser.
+
+"Before" is the per pixel ImageDraw loop the equaliser used to use, kept
+here as the reference. "After" is the NumPy rasteriser. Every frame is
+checked to be pixel identical.
+
+    uv run python -m benchmarks.graphic_equaliser
+'''
+import numpy as np
+from PIL import Image, ImageDraw
+
+from dabble import rasteriser
+from dabble.spectrum import SpectrumAnalyzer
+from benchmarks.common import (WIDTH, HEIGHT, synthetic_signal, spectra,
+                               time_frames, report)
+
+BASE_Y     = 26
+VIZ_HEIGHT = 37
+VIZ_LINE   = '#126782'
+VIZ_DOT    = '#8ECAE6'
+FALL_DECAY = 2
+
+
+class ImageDrawEqualiser():
+    ''' The original per pixel implementation '''
+    def __init__(self):
+        self.img  = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
+        self.draw = ImageDraw.Draw(self.img)
+        self.last_max_signal = np.zeros(4096)
+
+    def render(self, spec):
+        (max_magnitude, fft_spectrum) = spec
+        height, base_y = VIZ_HEIGHT, BASE_Y
+        scale = float(height)/max_magnitude
+        self.draw.rectangle([(0, HEIGHT-height-base_y), (WIDTH, HEIGHT-base_y)], fill="black")
+        num_bins = len(fft_spectrum)
+        for x in range(0, WIDTH, 1):
+            bin_index = int((x / WIDTH) * num_bins)
+            if bin_index >= num_bins:
+                bin_index = num_bins - 1
+            y = int(fft_spectrum[bin_index] * scale)
+            self.draw.line([(x, HEIGHT - base_y), (x, HEIGHT - y - base_y)], fill=VIZ_LINE, width=1)
+            self.draw.point((x, HEIGHT - y - base_y), fill=VIZ_DOT)
+            if y > self.last_max_signal[x]:
+                self.last_max_signal[x] = y
+            if self.last_max_signal[x] > 0:
+                self.draw.point((x, HEIGHT - self.last_max_signal[x] - base_y), fill=VIZ_DOT)
+                self.last_max_signal[x] -= FALL_DECAY
+
+
+class NumpyEqualiser():
+    ''' Same calls LCDUI.graphic_equaliser makes '''
+    def __init__(self):
+        self.img   = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
+        self.frame = rasteriser.VizFrame(WIDTH, VIZ_HEIGHT+1)
+        self.peaks = np.zeros(WIDTH, dtype=np.int64)
+        self.bin_map = SpectrumAnalyzer().bin_map(WIDTH)
+
+    def render(self, spec):
+        (max_magnitude, fft_spectrum) = spec
+        scale = float(VIZ_HEIGHT)/max_magnitude
+        heights = rasteriser.column_heights(fft_spectrum[self.bin_map], scale, VIZ_HEIGHT)
+        rasteriser.graphic_equaliser(self.frame, heights, self.peaks,
+                                     rasteriser.rgb(VIZ_LINE), rasteriser.rgb(VIZ_DOT),
+                                     fall_decay=FALL_DECAY)
+        self.frame.paste(self.img, HEIGHT-VIZ_HEIGHT-BASE_Y)
+
+
+def main(frames:int=200):
+    inputs = spectra([synthetic_signal(seed=i) for i in range(frames)])
+
+    # Pixel identical? Run both over the same sequence so peak hold matches too
+    before, after = ImageDrawEqualiser(), NumpyEqualiser()
+    for i, spec in enumerate(inputs):
+        before.render(spec)
+        after.render(spec)
+        if before.img.tobytes() != after.img.tobytes():
+            raise SystemExit(f'Frame {i} differs')
+    print(f'{frames} frames pixel identical')
+
+    b = time_frames(ImageDrawEqualiser().render, inputs)
+    a = time_frames(NumpyEqualiser().render, inputs)
+    report("graphic_equaliser ImageDraw", b)
+    report("graphic_equaliser numpy", a)
+    print(f'Speed up: {b["mean"]/a["mean"]:.1f}x')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+'''
+Before/after frame time for LCDUI.graphic_equaliser_bars.
+
+"Before" is the per bar loop with np.max/np.mean and ImageDraw calls,
+kept here as the reference. "After" is the reshape/reduce band aggregation
+and NumPy rasteriser. Every frame is checked to be pixel identical.
+
+    uv run python -m benchmarks.graphic_equaliser_bars
+'''
+import numpy as np
+from PIL import Image, ImageDraw
+
+from dabble import rasteriser
+from benchmarks.common import (WIDTH, HEIGHT, synthetic_signal, spectra,
+                               time_frames, report)
+
+BASE_Y     = 26
+VIZ_HEIGHT = 37
+NUM_BARS   = 32
+VIZ_LINE   = '#126782'
+VIZ_DOT    = '#8ECAE6'
+FALL_DECAY = 3
+
+
+class ImageDrawBars():
+    ''' The original per bar implementation '''
+    def __init__(self):
+        self.img  = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
+        self.draw = ImageDraw.Draw(self.img)
+        self.last_max_signal = np.zeros(4096)
+
+    def render(self, spec):
+        (max_magnitude, fft_spectrum) = spec
+        height, base_y = VIZ_HEIGHT, BASE_Y
+        scale = float(height)/max_magnitude
+        bin_size  = len(fft_spectrum) // NUM_BARS
+        bar_width = WIDTH // NUM_BARS
+        self.draw.rectangle([(0, HEIGHT - height - base_y), (WIDTH, HEIGHT - base_y)], fill="black")
+        for x in range(0, NUM_BARS):
+            start = x * bin_size
+            end   = min(start + bin_size, len(fft_spectrum))
+            bar_value  = np.max(fft_spectrum[start:end]) if x>0 else np.mean(fft_spectrum[start:end])
+            bar_height = int(bar_value * scale)
+            x1 = x * bar_width
+            x2 = x1 + bar_width - 2
+            self.draw.rectangle([(x1, HEIGHT - base_y - bar_height), (x2, HEIGHT - base_y)], fill=VIZ_LINE, width=1)
+            if bar_height > self.last_max_signal[x]:
+                self.last_max_signal[x] = bar_height
+            if self.last_max_signal[x] > 0:
+                self.draw.line([(x1, HEIGHT - base_y - self.last_max_signal[x]),
+                                (x2, HEIGHT - base_y - self.last_max_signal[x])], fill=VIZ_DOT, width=1)
+                self.last_max_signal[x] -= FALL_DECAY
+
+
+class NumpyBars():
+    ''' Same calls LCDUI.graphic_equaliser_bars makes '''
+    def __init__(self):
+        self.img   = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
+        self.frame = rasteriser.VizFrame(WIDTH, VIZ_HEIGHT+1)
+        self.peaks = np.zeros(NUM_BARS, dtype=np.int64)
+
+    def render(self, spec):
+        (max_magnitude, fft_spectrum) = spec
+        scale = float(VIZ_HEIGHT)/max_magnitude
+        heights = (rasteriser.band_values(fft_spectrum, NUM_BARS) * scale).astype(np.int64)
+        np.clip(heights, 0, VIZ_HEIGHT, out=heights)
+        rasteriser.graphic_equaliser_bars(self.frame, heights, self.peaks, WIDTH // NUM_BARS,
+                                          rasteriser.rgb(VIZ_LINE), rasteriser.rgb(VIZ_DOT),
+                                          fall_decay=FALL_DECAY)
+        self.frame.paste(self.img, HEIGHT-VIZ_HEIGHT-BASE_Y)
+
+
+def main(frames:int=200):
+    inputs = spectra([synthetic_signal(seed=i) for i in range(frames)])
+
+    before, after = ImageDrawBars(), NumpyBars()
+    for i, spec in enumerate(inputs):
+        before.render(spec)
+        after.render(spec)
+        if before.img.tobytes() != after.img.tobytes():
+            raise SystemExit(f'Frame {i} differs')
+    print(f'{frames} frames pixel identical')
+
+    b = time_frames(ImageDrawBars().render, inputs)
+    a = time_frames(NumpyBars().render, inputs)
+    report("graphic_equaliser_bars ImageDraw", b)
+    report("graphic_equaliser_bars numpy", a)
+    print(f'Speed up: {b["mean"]/a["mean"]:.1f}x')
+
+
+if __name__ == "__main__":
+    main()
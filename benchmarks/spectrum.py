@@ -0,0 +1,47 @@
+'''
+Before/after time for the spectrum the equalisers draw.
+
+"Before" rebuilds the Hann window and redesigns the Butterworth filter on
+every frame and runs the two pass filtfilt, as LCDUI.fft used to. "After"
+is SpectrumAnalyzer with its cached window, SOS coefficients and
+preallocated float32 buffers.
+
+    uv run python -m benchmarks.spectrum
+'''
+import numpy as np
+from scipy.signal import butter, filtfilt
+
+from dabble.spectrum import SpectrumAnalyzer
+from benchmarks.common import WIDTH, synthetic_signal, time_frames, report
+
+SAMPLE_RATE = 48000
+CUTOFF      = 4000.0
+
+
+def fft_per_frame(signal, use_window:bool, low_pass_cutoff:float):
+    ''' The original LCDUI.fft '''
+    mono_signal = ((signal[0::2].astype(np.float32) + signal[1::2].astype(np.float32)) / 2).astype(np.int32)
+    if low_pass_cutoff > 0.0:
+        nyq_freq = float(SAMPLE_RATE)/2.0
+        b, a = butter(4, low_pass_cutoff/nyq_freq, btype='lowpass', analog=False)
+        mono_signal = filtfilt(b, a, mono_signal)
+    windowed_signal = mono_signal * np.hanning(len(mono_signal)) if use_window else mono_signal
+    fft_spectrum = np.abs(np.fft.rfft(windowed_signal))[0:512]/10000
+    max_magnitude = np.max(fft_spectrum)
+    bin_index = ((np.arange(WIDTH) / WIDTH) * len(fft_spectrum)).astype(int)
+    return (max_magnitude, fft_spectrum[bin_index])
+
+
+def main(frames:int=200):
+    signals = [synthetic_signal(seed=i) for i in range(frames)]
+    for (use_window, cutoff) in ((False, 0.0), (True, 0.0), (True, CUTOFF)):
+        name = f'window:{use_window:d} lowpass:{cutoff:.0f}'
+        b = time_frames(lambda s: fft_per_frame(s, use_window, cutoff), signals)
+        analyzer = SpectrumAnalyzer(sample_rate=SAMPLE_RATE, use_window=use_window, low_pass_cutoff=cutoff)
+        a = time_frames(lambda s: (analyzer.analyse(s), analyzer.columns(WIDTH)), signals)
+        report(f'per frame  {name}', b)
+        report(f'analyzer   {name}', a)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+'''
+Frame time drawing the text of a playing screen: a scrolling PAD message,
+ensemble, DAB type and mode, plus a menu. "Before" measures and draws
+each string with ImageDraw every frame as LCDUI used to. "After" pastes
+strips from the TextCache. Every frame is checked to be pixel identical.
+
+    uv run python -m benchmarks.text_cache
+'''
+from PIL import Image, ImageDraw, ImageFont
+
+from dabble.text_cache import TextCache
+from benchmarks.common import WIDTH, HEIGHT, time_frames, report
+
+FONT_FILE = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+PAD       = "Now playing: Queen - Don't Stop Me Now. Call us on 0344 1 059 059"
+STATION   = "#8ECAE6"
+ENSEMBLE  = "#FFB703"
+MENU      = ("Equaliser/Bars", "Waveform: On", "Levels")
+
+
+def font(size:int):
+    try:
+        return ImageFont.truetype(FONT_FILE, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+FONTS = {"station": font(20), "ensemble": font(13), "menu": font(18), "menu_sml": font(15)}
+
+
+def frame_text(scroll_x:int) -> list:
+    ''' (xy, text, font, colour, anchor) drawn in a frame '''
+    return [
+        ((WIDTH - scroll_x, HEIGHT//2), PAD, FONTS["station"], STATION, "lm"),
+        ((0, HEIGHT), "D1 National", FONTS["ensemble"], ENSEMBLE, "ld"),
+        ((WIDTH, HEIGHT), "DAB+", FONTS["ensemble"], ENSEMBLE, "rd"),
+        ((0, 0), "Radio", FONTS["ensemble"], "#FB8500", "lt"),
+        ((35, 0), "Airplay", FONTS["ensemble"], ENSEMBLE, "lt"),
+        ((5, HEIGHT//2 - 18), MENU[0], FONTS["menu_sml"], ENSEMBLE, "lm"),
+        ((5, HEIGHT//2), MENU[1], FONTS["menu"], STATION, "lm"),
+        ((5, HEIGHT//2 + 18), MENU[2], FONTS["menu_sml"], ENSEMBLE, "lm"),
+    ]
+
+
+class ImageDrawText():
+    def __init__(self):
+        self.img  = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
+        self.draw = ImageDraw.Draw(self.img)
+
+    def render(self, texts):
+        self.img.paste((0, 0, 0), (0, 0, WIDTH, HEIGHT))
+        for (xy, t, f, colour, anchor) in texts:
+            # LCDUI measured the text for layout and dirty regions
+            self.draw.textbbox(xy, t, font=f, anchor=anchor)
+            self.draw.textlength(t, font=f)
+            self.draw.text(xy, t, font=f, fill=colour, anchor=anchor)
+
+
+class CachedText():
+    def __init__(self):
+        self.img   = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
+        self.cache = TextCache()
+
+    def render(self, texts):
+        self.img.paste((0, 0, 0), (0, 0, WIDTH, HEIGHT))
+        for (xy, t, f, colour, anchor) in texts:
+            self.cache.draw(self.img, xy, t, f, colour, anchor)
+
+
+def main():
+    frames = [frame_text(x) for x in range(0, 600, 2)]
+    before = ImageDrawText()
+    after  = CachedText()
+    for texts in frames:
+        before.render(texts)
+        after.render(texts)
+        assert before.img.tobytes() == after.img.tobytes(), "Frames differ"
+
+    report("ImageDraw text", time_frames(before.render, frames))
+    report("TextCache", time_frames(after.render, frames))
+    print(f'Text cache: {after.cache.summary()}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+'''
+Spinning an encoder resets the station or menu timeout on every detent.
+Compares the old PeriodicTask, a new threading.Timer per reset, with the
+timer wheel: threads created and reset latency for a fast spin, and that
+the timeout still fires once, on time, after the spin stops.
+
+    uv run python -m benchmarks.timers
+'''
+import threading
+import time
+
+import numpy as np
+
+from dabble.timer_wheel import TimerWheel
+
+TIMEOUT = 0.5
+DETENTS = 2000
+
+
+class OldPeriodicTask:
+    '''
+    menus.PeriodicTask before the timer wheel, counting the threads it makes
+    '''
+    threads_created = 0
+
+    def __init__(self, interval, callback):
+        self.interval = interval
+        self.callback = callback
+        self._t = None
+
+    def run(self):
+        self._t = threading.Timer(self.interval, self.callback)
+        self._t.start()
+        OldPeriodicTask.threads_created += 1
+
+    def reset(self):
+        self._t.cancel()
+        self.run()
+
+
+def spin(reset, detents:int) -> np.ndarray:
+    '''
+    Reset latency (us) for each detent
+    '''
+    times = np.empty(detents)
+    for i in range(detents):
+        t1 = time.perf_counter_ns()
+        reset()
+        times[i] = (time.perf_counter_ns() - t1) / 1000
+    return times
+
+
+def report(name:str, times:np.ndarray, threads:int, late:float):
+    print(f'{name:<16} resets:{len(times):5d} threads created:{threads:5d} '
+          f'reset p50:{np.percentile(times, 50):7.1f}us p99:{np.percentile(times, 99):7.1f}us '
+          f'fired {late*1000:+.0f}ms after timeout')
+
+
+def main():
+    fired = threading.Event()
+    stamp = dict()
+
+    def timeout():
+        stamp["fired"] = time.monotonic()
+        fired.set()
+
+    old = OldPeriodicTask(TIMEOUT, timeout)
+    old.run()
+    times = spin(old.reset, DETENTS)
+    stamp["reset"] = time.monotonic()
+    fired.wait()
+    report("PeriodicTask", times, OldPeriodicTask.threads_created, stamp["fired"] - stamp["reset"] - TIMEOUT)
+
+    fired.clear()
+    wheel = TimerWheel()
+    timer = wheel.schedule(TIMEOUT, timeout)
+    times = spin(lambda: wheel.reset(timer), DETENTS)
+    stamp["reset"] = time.monotonic()
+    fired.wait()
+    report("timer wheel", times, wheel.threads_created, stamp["fired"] - stamp["reset"] - TIMEOUT)
+    print(wheel.stats())
+    wheel.stop()
+
+
+if __name__ == "__main__":
+    main()
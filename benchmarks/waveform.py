@@ -0,0 +1,90 @@
+'''
+Before/after frame time for the waveform visualiser, decimation plus
+drawing, at several chunk sizes.
+
+"Before" is what AudioProcessing and LCDUI.waveform used to do: mix to
+mono with float temporaries, np.max over each column's slice in a python
+loop, then a line and two points per column with ImageDraw. It only shows
+the max so the waveform is drawn symmetric. "After" is the Envelope (peak
+and RMS) and the NumPy rasteriser. The peak envelope is checked against
+a per column min/max loop.
+
+    uv run python -m benchmarks.waveform
+'''
+import numpy as np
+from PIL import Image, ImageDraw
+
+from dabble import rasteriser
+from dabble.envelope import Decimation, Envelope
+from dabble.spectrum import SpectrumAnalyzer
+from benchmarks.common import WIDTH, HEIGHT, synthetic_signal, time_frames, report
+
+BASE_Y      = 26
+VIZ_HEIGHT  = 36
+VIZ_LINE    = '#126782'
+VIZ_DOT     = '#8ECAE6'
+CHUNK_SIZES = (1024, 2048, 4096, 8192)
+
+
+class ImageDrawWaveform():
+    ''' The original implementation '''
+    def __init__(self):
+        self.img  = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
+        self.draw = ImageDraw.Draw(self.img)
+
+    def render(self, signal):
+        mono = (signal[0::2].astype(np.float32) + signal[1::2].astype(np.float32)) / 2
+        bin_size = len(mono) // WIDTH
+        envelope = [np.max(mono[x*bin_size:(x+1)*bin_size]) for x in range(WIDTH)]
+        max_amplitude = float(np.max(mono))
+
+        self.draw.rectangle([(0, HEIGHT - VIZ_HEIGHT - BASE_Y), (WIDTH, HEIGHT - BASE_Y)], fill="black")
+        scale  = float(VIZ_HEIGHT - 2)/max_amplitude
+        centre = HEIGHT - HEIGHT//2
+        for x in range(WIDTH):
+            h = (envelope[x] * scale) // 2
+            self.draw.line([(x, centre - h), (x, centre + h)], fill=VIZ_LINE, width=1)
+            self.draw.point((x, centre - h), fill=VIZ_DOT)
+            self.draw.point((x, centre + h), fill=VIZ_DOT)
+
+
+class NumpyWaveform():
+    ''' Same calls AudioProcessing and LCDUI.waveform make '''
+    def __init__(self, decimation:Decimation):
+        self.img      = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
+        self.frame    = rasteriser.VizFrame(WIDTH, VIZ_HEIGHT+1)
+        self.analyzer = SpectrumAnalyzer()
+        self.envelope = Envelope(columns=WIDTH, decimation=decimation)
+
+    def render(self, signal):
+        mono = self.analyzer.mix(signal)
+        (lo, hi) = self.envelope.decimate(signal, mono)
+        rasteriser.waveform(self.frame, lo, hi, self.envelope.amplitude,
+                            rasteriser.rgb(VIZ_LINE), rasteriser.rgb(VIZ_DOT))
+        self.frame.paste(self.img, HEIGHT-VIZ_HEIGHT-BASE_Y)
+
+
+def check_peak(signal:np.ndarray):
+    envelope = Envelope(columns=WIDTH)
+    (lo, hi) = envelope.decimate(signal)
+    per_column = (len(signal) // 2 // WIDTH) * 2
+    for x in range(WIDTH):
+        column = signal[x*per_column:(x+1)*per_column]
+        assert lo[x] == np.float32(column.min()) and hi[x] == np.float32(column.max()), f'Column {x} differs'
+
+
+def main(frames:int=100):
+    for chunk_size in CHUNK_SIZES:
+        inputs = [synthetic_signal(frames=chunk_size, seed=i) for i in range(frames)]
+        check_peak(inputs[0])
+        print(f'Chunk size {chunk_size}')
+        b = time_frames(ImageDrawWaveform().render, inputs)
+        report("  max, ImageDraw", b)
+        for decimation in Decimation:
+            a = time_frames(NumpyWaveform(decimation).render, inputs)
+            report(f'  {decimation}, numpy', a)
+            print(f'  Speed up: {b["mean"]/a["mean"]:.1f}x')
+
+
+if __name__ == "__main__":
+    main()
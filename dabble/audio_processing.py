@@ -9,16 +9,56 @@ import alsaaudio
 import pyaudio
 import numpy as np
 import threading
+import time
 from copy import copy,deepcopy
+from dataclasses import dataclass
 from enum import Enum,StrEnum
 
+from . import dynamics, envelope, metrics, ringbuffer, spectrum
+
 logger = logging.getLogger(__name__)
 
+CALLBACK  = metrics.METRICS.histogram("audio.callback")
+ANALYSIS  = metrics.METRICS.histogram("audio.analysis")
+FFT       = metrics.METRICS.histogram("audio.fft")
+CHUNKS    = metrics.METRICS.counter("audio.chunks")
+OVERFLOWS = metrics.METRICS.counter("audio.overflows")
+SKIPPED   = metrics.METRICS.counter("audio.hops_skipped")
+
 class DeviceSelection(Enum):
     DEFAULT = 0
     PULSE = 1
     MANUAL = 2
 
+@dataclass
+class Analysis():
+    '''
+    Results of analysing one chunk of audio, ready for the visualisers.
+    Arrays are preallocated and overwritten in place, see AudioProcessing.analysis()
+    '''
+    seq:int             = 0     # Increases by one per chunk analysed, a hop apart
+    max_magnitude:float = 0.01  # AGC reference level to scale the spectrum by
+    spectrum:np.ndarray = None  # Smoothed FFT magnitudes
+    columns:np.ndarray  = None  # Spectrum mapped linearly onto display columns
+    bands:np.ndarray    = None  # Spectrum in log/mel bands, one per display column
+    envelope_lo:np.ndarray = None  # Bottom of the waveform per display column
+    envelope_hi:np.ndarray = None  # Top of the waveform per display column
+    max_amplitude:float = 0.0   # Largest magnitude in the envelope
+    peak_l:int          = 0
+    peak_r:int          = 0
+    analysis_time:float = 0.0   # ms taken to analyse the chunk
+
+    def store(self, name:str, values:np.ndarray):
+        '''
+        Copy values into the named array, only allocating if the size changed
+        '''
+        a = getattr(self, name)
+        if a is None or a.shape != values.shape:
+            setattr(self, name, values.copy())
+        else:
+            np.copyto(a, values)
+
+
 class AudioProcessing():
     '''
     Process audio being played through sound card so we can do visualisations.
@@ -33,12 +73,20 @@ class AudioProcessing():
     SRC=$(pactl list sources short | head -1 | cut -f2)
     SINK=alsa_output.platform-snd_aloop.0.analog-stereo
     pactl load-module module-loopback source=$SRC sink=$SINK channels=2
+
+    The spectrum is taken over the last frame_chunk_size frames every hop,
+    overlap (e.g. 0.5) of a chunk apart, then smoothed and given a slow
+    automatic gain by dynamics.Dynamics
     '''
 
     def __init__(self, 
                  device_selection:DeviceSelection=DeviceSelection.PULSE, 
                  frame_chunk_size:int=2048, 
-                 device_index:int=0):
+                 device_index:int=0,
+                 columns:int=160,
+                 decimation:envelope.Decimation=envelope.Decimation.PEAK,
+                 band_scale:spectrum.BandScale=spectrum.BandScale.LOG,
+                 overlap:float=0.5):
 
         self.p=pyaudio.PyAudio()
         logger.info("Available Audio Devices:")
@@ -70,11 +118,24 @@ class AudioProcessing():
         self.sample_rate  = int(self.record_dev['defaultSampleRate'])
         self.rec_channels = self.record_dev['maxInputChannels']
         self.frames_chunk_size = frame_chunk_size 
+        self.hop               = max(int(frame_chunk_size * (1.0 - overlap)), 1)
 
         logger.info("Using %s (index:%d)", self.record_dev_name, self.record_dev_index)
         logger.info("Sample Rate: %d", self.sample_rate)
         logger.info("Channels:    %d", self.rec_channels)
         logger.info("Chunk Size:  %d", self.frames_chunk_size)
+        logger.info("Hop:         %d", self.hop)
+
+        # FFT for the visualisers. Caches window, filter etc between frames.
+        # Windowed as the chunks overlap
+        self.spectrum_analyzer = spectrum.SpectrumAnalyzer(
+                                    sample_rate=self.sample_rate,
+                                    chunk_size=self.frames_chunk_size,
+                                    use_window=True)
+        self.dynamics          = dynamics.Dynamics(
+                                    size=len(self.spectrum_analyzer.spectrum),
+                                    hop=self.hop/self.sample_rate,
+                                    full_scale=self.spectrum_analyzer.full_scale())
 
         try:
             # ALSA naming nightmare. Try to pick sensible defaults...
@@ -88,14 +149,36 @@ class AudioProcessing():
             logger.info("Using default mixer")
 
         self.stream:pyaudio.Stream = None
-        # Callback updates this so need locking to protect it
-        self._signal = np.zeros(4096)
+        # Callback writes captured frames into the ring, readers take views
+        # of the latest frames. No locks so the callback never waits
+        self._ring   = ringbuffer.RingBuffer(4*self.frames_chunk_size, channels=self.rec_channels)
+        self._zeros  = np.zeros(self.frames_chunk_size*self.rec_channels, dtype=np.int32)
+        self._zero_requested = False
     
         self.ch_l    = None
         self.ch_r    = None
         self.peak_l  = 0
         self.peak_r  = 0
 
+        # Analysis runs once per hop in its own thread, reading from the
+        # ring. Results are triple buffered: the thread fills a buffer that
+        # is neither the front nor the one the renderer last took, then
+        # makes it the front. The renderer's keeps still until it asks again
+        self.columns          = columns
+        self.band_scale       = spectrum.BandScale(band_scale)
+        self.envelope         = envelope.Envelope(columns=columns,
+                                                  channels=self.rec_channels,
+                                                  decimation=decimation)
+        self._analyses        = [Analysis(), Analysis(), Analysis()]
+        self._front           = 0
+        self._reading         = 0   # Taken by the renderer, see analysis()
+        self._swap            = threading.Lock()
+        self._next_end        = self.frames_chunk_size # Frame the next analysed chunk ends at
+        self._end_analysis    = threading.Event()
+        self._t_analysis      = None
+        self.chunks_analysed  = 0
+        self.analysis_time    = 0.0 # ms, last chunk
+
         # Volume is the % value
         # We assume joined volume which is the natual way to change vol
         volcap = self.mixer.volumecap()
@@ -120,20 +203,106 @@ class AudioProcessing():
 
     def signal(self) -> np.ndarray:
         '''
-        Return a copy of the current signal buffer
-        We use lock/copy as another thread maybe updating it
+        Return a copy of the latest chunk of (interleaved) frames
         '''
-        s=None
-        with self._lock:
-            s=self._signal.copy()
-        return s
+        (_, s) = self._ring.latest(self.frames_chunk_size)
+        return s.copy()
 
     def zero_signal(self):
         '''
-        Set the signal buffer to zero
+        Show silence until the next chunk arrives. The analysis thread
+        picks this up, the ring only has the one writer
         '''
-        with self._lock:
-            self._signal = np.zeros(4096)
+        self._zero_requested = True
+
+    def analysis(self) -> Analysis:
+        '''
+        Latest analysis results. Left alone until the next call, so take
+        it once per frame and don't hold on to it after
+        '''
+        with self._swap:
+            self._reading = self._front
+        return self._analyses[self._reading]
+
+    def _analyse_chunk(self, signal:np.ndarray):
+        '''
+        Analyse one chunk into a spare buffer then make it the front
+        '''
+        t1 = time.perf_counter_ns()
+        with self._swap:
+            spare = 3 - self._front - self._reading if self._front != self._reading else (self._front + 1) % 3
+        back = self._analyses[spare]
+
+        self.ch_l = signal[0::2]
+        self.ch_r = signal[1::2]
+        back.peak_l = int(np.abs(np.max(self.ch_l))/self._max_value*100.0)
+        back.peak_r = int(np.abs(np.max(self.ch_r))/self._max_value*100.0)
+
+        # Waveform envelope, decimated to display columns
+        mono = self.spectrum_analyzer.mix(signal)
+        (lo, hi) = self.envelope.decimate(signal, mono)
+        back.store("envelope_lo", lo)
+        back.store("envelope_hi", hi)
+        back.max_amplitude = self.envelope.amplitude
+
+        # Spectrum. Note this filters/windows the mono buffer
+        t = FFT.start()
+        (_, spectrum) = self.spectrum_analyzer.transform()
+        FFT.stop(t)
+
+        # Smooth in place, so columns and bands are smoothed too, and scale
+        # by the AGC level rather than this chunk's loudest bin
+        back.max_magnitude = self.dynamics.apply(spectrum)
+        back.store("spectrum", spectrum)
+        back.store("columns", self.spectrum_analyzer.columns(self.columns))
+        back.store("bands", self.spectrum_analyzer.bands(self.columns, self.band_scale))
+
+        self.chunks_analysed += 1
+        back.seq = self.chunks_analysed
+        back.analysis_time = (time.perf_counter_ns() - t1)/1000000
+        ANALYSIS.observe(time.perf_counter_ns() - t1)
+        self.analysis_time = back.analysis_time
+
+        # Flip
+        with self._swap:
+            self._front = spare
+        self.peak_l = back.peak_l
+        self.peak_r = back.peak_r
+
+    def _run_analysis(self):
+        '''
+        Analysis thread. Polls the ring a few times per hop and analyses
+        the chunk ending at each hop written since it last looked. If it
+        falls more than a chunk behind it skips to the latest, so the work
+        per chunk period is bounded
+        '''
+        logger.info("Audio analysis starts")
+        poll_interval = self.hop / self.sample_rate / 4
+        while not self._end_analysis.wait(timeout=poll_interval):
+            if self._zero_requested:
+                self._zero_requested = False
+                self.dynamics.reset()
+                self._analyse_chunk(self._zeros)
+                continue
+            written = self._ring.written
+            if written - self._next_end > self.frames_chunk_size:
+                SKIPPED.inc((written - self._next_end) // self.hop)
+                self._next_end = written
+            while self._next_end <= written:
+                signal = self._ring.window(self.frames_chunk_size, self._next_end)
+                self._next_end += self.hop
+                if signal is not None:
+                    self._analyse_chunk(signal)
+        logger.info("Audio analysis ends")
+
+    def stop(self):
+        '''
+        Stop the analysis thread
+        '''
+        self._end_analysis.set()
+        if self._t_analysis is not None:
+            self._t_analysis.join()
+            self._t_analysis = None
 
     def magnitude_to_db(self,magnitude:int|float, reference:float=1.0) -> int:
         '''
@@ -184,12 +353,16 @@ class AudioProcessing():
         logger.debug(f'Setting volume to {v} {self.volume(db=True)}db')
 
     def sound_data_avail_callback(self, in_data, frame_count, time_info, status):
-        with self._lock:
-            self._signal = np.frombuffer(in_data, dtype=self.audio_bit_size)
-            self.ch_l    = self._signal[0::2]
-            self.ch_r    = self._signal[1::2]
-            self.peak_l  = int(np.abs(np.max(self.ch_l))/self._max_value*100.0)
-            self.peak_r  = int(np.abs(np.max(self.ch_r))/self._max_value*100.0)
+        '''
+        Called by PortAudio per chunk. Keep it quick and never block,
+        the analysis thread does the work.
+        '''
+        t = CALLBACK.start()
+        self._ring.write(np.frombuffer(in_data, dtype=self.audio_bit_size))
+        CHUNKS.inc()
+        if status:
+            OVERFLOWS.inc()
+        CALLBACK.stop(t)
         return (None, pyaudio.paContinue)
 
     def start(self):
@@ -200,6 +373,12 @@ class AudioProcessing():
         the Adafruit speaker bonnet. Therefore you need to specify the device
         on the command line e.g. AUDIODEV=xx python ..
         '''
+        self.spectrum_analyzer.set_sample_rate(self.sample_rate)
+        if self._t_analysis is None:
+            self._end_analysis.clear()
+            self._t_analysis = threading.Thread(target=self._run_analysis, name="audio_analysis", daemon=True)
+            self._t_analysis.start()
+
         self.stream=self.p.open(
                         format=self.audio_format,
                         channels=self.rec_channels,
@@ -207,7 +386,7 @@ class AudioProcessing():
                         input_device_index=self.record_dev_index,
                         input=True,
                         start=False, # Need to wait for dablin to catch up
-                        frames_per_buffer=self.frames_chunk_size,
+                        frames_per_buffer=self.hop,
                         stream_callback = lambda in_data, frame_count, time_info, status:self.sound_data_avail_callback(in_data,frame_count,time_info,status)
         )
 
@@ -223,9 +402,8 @@ class AudioProcessing():
         if self.stream is None:
             return False
         
-        d = self.stream.read(self.frames_chunk_size, exception_on_overflow=False)
-        with self._lock:
-            self._signal = np.frombuffer(d,dtype=self.audio_bit_size)
+        d = self.stream.read(self.hop, exception_on_overflow=False)
+        self._ring.write(np.frombuffer(d,dtype=self.audio_bit_size))
         logger.debug("Latency %0.3fs Frames avail to read: %d", self.stream.get_input_latency(), self.stream.get_read_available())
         return True
 
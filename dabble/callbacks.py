@@ -1,22 +1,25 @@
 
+import json
 import logging
 import alsaaudio 
-from threading import Lock, current_thread
-from . import encoder, exceptions, menus, lcd_ui
+from threading import current_thread, main_thread
+from . import encoder, exceptions, menus, lcd_ui, metrics, profiler
 
 
 logger = logging.getLogger(__name__)
 
-# TODO: Feels wrong here! mmmm
-# Lock to protect station changes
-# Rapid turns of encoder can result in multiple callbacks
-# and strange station choices
-station_lock = Lock()
+MQTT_MESSAGES = metrics.METRICS.counter("mqtt.messages")
 
-# Ease debugging by changing threadname to the callback name
+# Callbacks run on the event loop (see core.Core), one at a time, so
+# station changes from rapid turns of the encoder can't interleave.
+# Anything slow is handed to the core's worker with ui.state.core.blocking
+
+# Ease debugging by changing threadname to the callback name. Not the
+# loop's thread, everything runs there
 def change_thread_name(func):
     def wrapper(*args, **kwargs):
-        current_thread().name = func.__name__
+        if current_thread() is not main_thread():
+            current_thread().name = func.__name__
         result = func(*args, **kwargs)
         return result
     return wrapper
@@ -46,30 +49,33 @@ def exit_menu(encoder_position, ui, player, audio_processor):
         # exit_menu can be called multiple times if button debounce misses double press
         if encoder_position == encoder.EncoderPosition.LEFT:
             logger.info("Exiting left menu")
-            ui.state.left_encoder.device.when_rotated_clockwise          = lambda: change_station(ui,player,audio_processor)
-            ui.state.left_encoder.device.when_rotated_counter_clockwise  = lambda: change_station(ui,player,audio_processor)
+            ui.state.left_encoder.device.when_rotated_clockwise          = ui.state.core.bridge(lambda: change_station(ui,player,audio_processor))
+            ui.state.left_encoder.device.when_rotated_counter_clockwise  = ui.state.core.bridge(lambda: change_station(ui,player,audio_processor))
             ui.state.radio_state.exit_left_menu()
 
     elif ui.state.radio_state.selecting_right_menu.is_active:
         if encoder_position == encoder.EncoderPosition.RIGHT:
             logger.info("Exiting right menu")
-            ui.state.right_encoder.device.when_rotated_clockwise         = lambda: ui.state.update("volume",audio_processor.vol_up(ui.state.volume_change_step))
-            ui.state.right_encoder.device.when_rotated_counter_clockwise = lambda: ui.state.update("volume",audio_processor.vol_down(ui.state.volume_change_step))
+            ui.state.right_encoder.device.when_rotated_clockwise         = ui.state.core.bridge(lambda: ui.state.update("volume",audio_processor.vol_up(ui.state.volume_change_step)))
+            ui.state.right_encoder.device.when_rotated_counter_clockwise = ui.state.core.bridge(lambda: ui.state.update("volume",audio_processor.vol_down(ui.state.volume_change_step)))
             ui.state.radio_state.exit_right_menu()
     else:
         logging.warning("Exit called. Wrong state: %s", ui.state.radio_state.current_state.id)
+    ui.state.changed()
 
 @change_thread_name
 def next_menu(state, curr_menu):
     ''' Get next menu item, reseting timeout '''
     state.menu_timer.reset()
     state.current_menu_item = curr_menu.get_next_menu()
+    state.changed(menu_only=True)
 
 @change_thread_name
 def prev_menu(state, curr_menu):
     ''' Get prev menu item, reseting timeout '''
     state.menu_timer.reset()
     state.current_menu_item = curr_menu.get_prev_menu()
+    state.changed(menu_only=True)
 
 @change_thread_name
 def activate_or_run_menu(encoder_position, ui, player, audio_processor):
@@ -85,8 +91,8 @@ def activate_or_run_menu(encoder_position, ui, player, audio_processor):
     if ui.state.radio_state.standby.is_active:
         # Move from standby to playing
         ui.state.radio_state.activate_radio()
-        player.play(ui.state.station_name)
-        audio_processor.stream.start_stream()
+        ui.state.core.blocking(player.play, ui.state.station_name,
+                               then=lambda _: audio_processor.stream.start_stream())
 
     elif encoder_position == encoder.EncoderPosition.LEFT:
         curr_menu = ui.state.lm
@@ -109,8 +115,8 @@ def activate_or_run_menu(encoder_position, ui, player, audio_processor):
             ui.state.radio_state.right_menu_selection()
 
     if change_encoder_function:
-        selected_encoder.device.when_rotated_clockwise         = lambda: next_menu(ui.state, curr_menu)
-        selected_encoder.device.when_rotated_counter_clockwise = lambda: prev_menu(ui.state, curr_menu)
+        selected_encoder.device.when_rotated_clockwise         = ui.state.core.bridge(lambda: next_menu(ui.state, curr_menu))
+        selected_encoder.device.when_rotated_counter_clockwise = ui.state.core.bridge(lambda: prev_menu(ui.state, curr_menu))
         ui.state.current_menu_item=curr_menu.get_first_menu_item()
         logging.info("Menu currently selected: %s", ui.state.current_menu_item)
         ui.state.menu_timer = menus.PeriodicTask(interval=8, name="menu_timer", callback=lambda:exit_menu(encoder_position, ui, player, audio_processor))
@@ -120,6 +126,7 @@ def activate_or_run_menu(encoder_position, ui, player, audio_processor):
          ui.state.radio_state.selecting_right_menu.is_active:
         ui.state.menu_timer.reset()
         curr_menu.run_action(ui.state.current_menu_item)
+    ui.state.changed()
 
 @change_thread_name
 def play_new_station(ui,player,audio_processor):
@@ -143,17 +150,19 @@ def play_new_station(ui,player,audio_processor):
     # Pause streaming ...
     audio_processor.stream.stop_stream()
 
-    # start playing state.current_station
-    player.stop()
-    player.play(ui.state.station_name)
-
-    # Resume playing
-    audio_processor.stream.start_stream()
-
+    # Clear the last station's details, play may fill in cached ones
     ui.state.update_pad(" ")
     ui.state.dab_type = ""
     ui.state.last_pad_message = ""
-    logger.info(f'Now playing {ui.state.station_name}')
+
+    def resume(_):
+        audio_processor.stream.start_stream()
+        ui.state.changed()
+        logger.info(f'Now playing {ui.state.station_name}')
+
+    # start playing state.current_station. The player only restarts the
+    # tuner if the station is on another channel
+    ui.state.core.blocking(player.play, ui.state.station_name, then=resume)
 
 @change_thread_name
 def change_station(ui,player,audio_processor):
@@ -169,38 +178,38 @@ def change_station(ui,player,audio_processor):
         # Disable change station when in airplay mode
         return
 
-    with station_lock:
-        # Get current position
-        left_encoder_value = ui.state.left_encoder.device.steps
-
-        if ui.state.radio_state.playing.is_active or \
-           not ui.state.radio_state.left_menu_activated.is_active and \
-           not ui.state.radio_state.right_menu_activated.is_active and \
-           not ui.state.radio_state.selecting_a_station.is_active:
-            # If we're entering station selection ..
-            # Change into select_station state
-            ui.state.radio_state.toggle_select_station()
-            # Set up timeout timer which changes station once stopped selecting
-            ui.state.station_timer = menus.PeriodicTask(interval=4, name="station_select_timer", callback=lambda:play_new_station(ui,player,audio_processor))
-            ui.state.station_timer.run()
-            logger.info("Start changing station..")
-            station_index  = player.radio_stations.station_index(player.playing)
-            logger.info("Left Encoder Steps: %d  Current Station Index: %d", left_encoder_value, station_index)
-
-        if ui.state.radio_state.selecting_a_station.is_active:
-            # still twiddling so reset timeout
-            ui.state.station_timer.reset()
-            # Get index of station in list and correct given current station
-            station_index  = player.radio_stations.station_index(player.playing)
-            station_number = left_encoder_value + station_index
-            logger.info("Left Encoder Steps: %d  Current Station Index: %d, will choose %d", left_encoder_value, station_index, station_number)
-
-            # Get the new station name and details
-            (ui.state.station_name, station_details)=player.radio_stations.select_station(station_number)
-            ui.state.ensemble     = station_details['ensemble']
-            ui.state.current_msg  = lcd_ui.MessageState.STATION
-            logger.info(f'New station {station_number} {ui.state.station_name}/{ui.state.ensemble} selected')
-            ui.reset_station_name_scroll()
+    # Get current position
+    left_encoder_value = ui.state.left_encoder.device.steps
+
+    if ui.state.radio_state.playing.is_active or \
+       not ui.state.radio_state.left_menu_activated.is_active and \
+       not ui.state.radio_state.right_menu_activated.is_active and \
+       not ui.state.radio_state.selecting_a_station.is_active:
+        # If we're entering station selection ..
+        # Change into select_station state
+        ui.state.radio_state.toggle_select_station()
+        # Set up timeout timer which changes station once stopped selecting
+        ui.state.station_timer = menus.PeriodicTask(interval=4, name="station_select_timer", callback=lambda:play_new_station(ui,player,audio_processor))
+        ui.state.station_timer.run()
+        logger.info("Start changing station..")
+        station_index  = player.radio_stations.station_index(player.playing)
+        logger.info("Left Encoder Steps: %d  Current Station Index: %d", left_encoder_value, station_index)
+
+    if ui.state.radio_state.selecting_a_station.is_active:
+        # still twiddling so reset timeout
+        ui.state.station_timer.reset()
+        # Get index of station in list and correct given current station
+        station_index  = player.radio_stations.station_index(player.playing)
+        station_number = left_encoder_value + station_index
+        logger.info("Left Encoder Steps: %d  Current Station Index: %d, will choose %d", left_encoder_value, station_index, station_number)
+
+        # Get the new station name and details
+        (ui.state.station_name, station_details)=player.radio_stations.select_station(station_number)
+        ui.state.ensemble     = station_details['ensemble']
+        ui.state.current_msg  = lcd_ui.MessageState.STATION
+        logger.info(f'New station {station_number} {ui.state.station_name}/{ui.state.ensemble} selected')
+        ui.reset_station_name_scroll()
+        ui.state.changed()
 
 @change_thread_name
 def update_msg(ui, msg, sub_msg:str=""):
@@ -222,13 +231,53 @@ def initiate_scan(ui, player, audio_processor):
     print(ui, player, audio_processor)
     ui.state.radio_state.toggle_scan()
     was_playing = player.playing
-    # Scan will reload station list
-    player.scan(ui, ui_msg_callback=update_msg)
-    player.play(was_playing)
-    # Wait for dabble/eti-cmdline to restart
-    ui.state.radio_state.toggle_scan()
-    exit_menu(encoder.EncoderPosition.RIGHT, ui, player, audio_processor)
-    time.sleep(2)
+
+    def scan_and_play():
+        # Scan will reload station list. Progress is drawn on the loop
+        player.scan(ui, ui_msg_callback=ui.state.core.bridge(update_msg))
+        player.play(was_playing)
+
+    def scanned(_):
+        ui.state.radio_state.toggle_scan()
+        exit_menu(encoder.EncoderPosition.RIGHT, ui, player, audio_processor)
+
+    ui.state.core.blocking(scan_and_play, then=scanned)
+
+@change_thread_name
+def start_profile(ui, seconds:float=30, mqtt_client=None):
+    '''
+    Sample every thread for seconds, see profiler.PROFILER. When done the
+    hot functions are logged and, if asked over MQTT, published to
+    dabble-radio/profile/result
+    '''
+    def finished():
+        if ui.state.rm is not None and "Profile" in ui.state.rm.menu:
+            ui.state.rm.menu["Profile"].state = "Off"
+        ui.state.changed()
+
+    def done(profile):
+        # On the profiler's thread
+        if mqtt_client is not None:
+            mqtt_client.publish("dabble-radio/profile/result", json.dumps(profile.summary()))
+        ui.state.core.call(finished)
+
+    if profiler.PROFILER.start(seconds, on_done=done):
+        logger.info("Profiling started for %gs", seconds)
+    ui.state.changed()
+
+def enable_metrics(ui, enabled:bool):
+    '''
+    Turn recording metrics, and the summary every minute, on or off. Off
+    the hot paths don't pay for timing and the timer wheel can go idle
+    '''
+    ui.state.metrics_enabled = enabled
+    metrics.METRICS.enabled  = enabled
+    if (reporter := ui.state.metrics_reporter) is not None:
+        if enabled:
+            reporter.start()
+        else:
+            reporter.stop()
+    logger.info("Metrics %s", "enabled" if enabled else "disabled")
 
 @change_thread_name
 def on_connect(client, userdata, flags, reason_code, properties):
@@ -241,6 +290,7 @@ def on_connect(client, userdata, flags, reason_code, properties):
     client.subscribe("dabble-radio/#")
 
 @change_thread_name
+@metrics.METRICS.timed("mqtt.message")
 def on_message(client, userdata, msg, ui=None, audio_processor=None, player=None):
     '''
     Callback on msg MQTT topic receive. Currently used to receive
@@ -258,7 +308,12 @@ def on_message(client, userdata, msg, ui=None, audio_processor=None, player=None
 
     base_topic = topic_components[0]
     cmd        = topic_components[1]
+    if msg.topic in ("dabble-radio/metrics", "dabble-radio/profile/result"):
+        # Our own, see metrics.Reporter and start_profile
+        return
+    MQTT_MESSAGES.inc()
     payload    = msg.payload.decode("utf-8")
+    raw        = payload
     if payload == "1" or payload == "0":
         # Convert payload to boolean
         payload = payload == "1"
@@ -279,14 +334,14 @@ def on_message(client, userdata, msg, ui=None, audio_processor=None, player=None
                 # Save the station name
                 ui.state.last_station_name = ui.state.station_name 
                 if player:
-                    player.stop()
+                    ui.state.core.blocking(player.stop)
             case "active_end":
                 logger.info("Airplay deactivated, Radio should start up again. Station: %s", ui.state.last_station_name)
                 ui.state.radio_state.mode = menus.PlayerMode.RADIO
                 ui.state.station_name = ui.state.last_station_name 
                 if player:
-                    player.play(ui.state.station_name)
-                ui.state.ensemble = player.ensemble
+                    ui.state.core.blocking(player.play, ui.state.station_name,
+                                           then=lambda _: ui.state.update("ensemble", player.ensemble))
             case "album":
                 logger.info("Airplay %s: %s", cmd, payload)
                 ui.state.album = payload
@@ -308,8 +363,25 @@ def on_message(client, userdata, msg, ui=None, audio_processor=None, player=None
                 audio_processor.set_volume(vol_db, units=alsaaudio.VOLUME_UNITS_DB)
                 ui.state.update("volume",audio_processor.volume())
                 logger.info("Vol DB:%f. Current volume: %d", vol_db, ui.state.volume)
+            case "profile":
+                # Payload is how many seconds to profile for, default 30.
+                # 0 stops a profile early
+                try:
+                    seconds = float(raw) if raw else 30
+                except ValueError:
+                    seconds = -1
+                if seconds == 0:
+                    profiler.PROFILER.stop()
+                elif seconds > 0:
+                    start_profile(ui, seconds=seconds, mqtt_client=client)
+                else:
+                    logger.info("Profile needs a number of seconds, not %s", raw)
+            case "metrics_enabled":
+                # 1 or 0
+                enable_metrics(ui, payload is True)
             case _:
                 logger.info("Unhandled MQTT Topic:%s - %s", msg.topic, payload)
+        ui.state.changed()
     else:
         logger.info("Unexpected MQTT Topic:%s - %s", msg.topic, payload)
 
@@ -322,8 +394,8 @@ def change_mode(mode, mqtt_client, ui, player):
         logger.info("Radio enabled. Station: %s", ui.state.last_station_name)
         ui.state.radio_state.mode = menus.PlayerMode.RADIO
         ui.state.station_name = ui.state.last_station_name 
-        player.play(ui.state.station_name)
-        ui.state.ensemble = player.ensemble
+        ui.state.core.blocking(player.play, ui.state.station_name,
+                               then=lambda _: ui.state.update("ensemble", player.ensemble))
 
     elif mode == menus.PlayerMode.AIRPLAY:
         logger.info("Airplay activated, Radio should shutdown")
@@ -331,10 +403,11 @@ def change_mode(mode, mqtt_client, ui, player):
         # Save the station name
         ui.state.last_station_name = ui.state.station_name 
         if player:
-            player.stop()
+            ui.state.core.blocking(player.stop)
         ui.state.last_pad_message = ""
         ui.state.station_name = "Airplay active"
         ui.state.shairport_dbus_interface.Play()
+    ui.state.changed()
 
 @change_thread_name
 def pad_update_handler(ui, updates):
@@ -363,6 +436,17 @@ def pad_update_handler(ui, updates):
         ui.state.awaiting_signal = False
         ui.state.genre = updates.get('prog_type').value
         logger.info(f"Genre: \"{ui.state.genre}\"")
+    ui.state.changed()
+
+def cached_metadata_handler(ui, cached:dict):
+    '''
+    Show what we saw last time a station was tuned until dablin catches up
+    '''
+    ui.state.dab_type     = cached.get('dab_type', ui.state.dab_type)
+    ui.state.genre        = cached.get('prog_type', ui.state.genre)
+    ui.state.audio_format = cached.get('media_fmt', ui.state.audio_format)
+    logger.info(f"Cached DAB type: {ui.state.dab_type}, Genre: \"{ui.state.genre}\", Audio format: \"{ui.state.audio_format}\"")
+    ui.state.changed()
 
 @change_thread_name
 def enter_standby(ui, player, audio_processor):
@@ -371,5 +455,6 @@ def enter_standby(ui, player, audio_processor):
     # Pause streaming ...
     audio_processor.stream.stop_stream()
     # start playing state.current_station
-    player.stop()
+    ui.state.core.blocking(player.stop)
+    ui.state.changed()
 
@@ -0,0 +1,117 @@
+'''
+Layers drawn over the LCD image, e.g. a menu or standby over the dimmed
+screen. The dimmed screen is kept until invalidate(), so each frame only
+the overlays' areas are redrawn. The last overlay pushed is on top.
+'''
+import logging
+from dataclasses import dataclass
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Same as Image.eval(img, lambda x: x/5), which rounds
+DIM_LUT = [int(i/5 + 0.5) for i in range(256)]
+
+
+@dataclass
+class Overlay():
+    '''
+    name: To find it again
+    draw: Called with the image to draw on, returns the (x0,y0,x1,y1)
+          boxes it drew in
+    '''
+    name:str
+    draw:object
+
+
+class Compositor():
+    def __init__(self, base:Image.Image, lut:list=DIM_LUT):
+        self.base        = base
+        self.lut         = lut * len(base.getbands())
+        self.out         = Image.new(base.mode, base.size)
+        self._background = Image.new(base.mode, base.size)
+        self._background_ok = False
+        self._drawn      = []     # Boxes the overlays drew in out last frame
+        self._shown_out  = False  # The last frame shown was out, not base
+        self.overlays    = []
+        self.dims        = 0
+
+    @property
+    def frozen(self) -> bool:
+        '''
+        Overlays are open over a dimmed screen that's been kept, the screen
+        behind them needn't be drawn
+        '''
+        return bool(self.overlays) and self._background_ok
+
+    def has(self, name:str) -> bool:
+        return any(o.name == name for o in self.overlays)
+
+    def push(self, overlay:Overlay):
+        self.overlays.append(overlay)
+
+    def pop(self, name:str|None=None):
+        '''
+        Remove the top overlay or the one called name
+        '''
+        if name is None:
+            self.overlays.pop()
+        else:
+            self.overlays = [o for o in self.overlays if o.name != name]
+        if not self.overlays:
+            self.invalidate()
+
+    def invalidate(self):
+        '''
+        The screen behind the overlays has changed, dim it again
+        '''
+        self._background_ok = False
+
+    def dim(self, img:Image.Image|None=None) -> Image.Image:
+        '''
+        A dimmed copy of img (default the base image) in the output buffer
+        '''
+        self.out.paste((self.base if img is None else img).point(self.lut))
+        self.dims += 1
+        self._shown_out = True
+        return self.out
+
+    def _clip(self, box:tuple) -> tuple|None:
+        (x0, y0, x1, y1) = (max(0, int(box[0])), max(0, int(box[1])),
+                            min(self.out.width, int(box[2]) + 1), min(self.out.height, int(box[3]) + 1))
+        return (x0, y0, x1, y1) if x0 < x1 and y0 < y1 else None
+
+    def compose(self) -> tuple[Image.Image, list|None]:
+        '''
+        The frame to show and the boxes in it that may have changed since
+        the last frame, None if it could have changed anywhere. With no
+        overlays this is the base image and no boxes (its own dirty regions
+        apply), unless an overlay was showing last frame.
+        '''
+        if not self.overlays:
+            full = self._shown_out
+            self._shown_out = False
+            self._drawn = []
+            return (self.base, None if full else [])
+
+        if not self._background_ok:
+            self._background.paste(self.base.point(self.lut))
+            self._background_ok = True
+            self.dims += 1
+            self.out.paste(self._background)
+            changed = None
+        else:
+            # Put back what the overlays drew over last time
+            for box in self._drawn:
+                self.out.paste(self._background.crop(box), box[0:2])
+            changed = list(self._drawn)
+
+        drawn = []
+        for o in self.overlays:
+            drawn.extend(b for b in map(self._clip, o.draw(self.out)) if b is not None)
+        self._drawn = drawn
+        self._shown_out = True
+        if changed is not None:
+            changed.extend(drawn)
+        return (self.out, changed)
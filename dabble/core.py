@@ -0,0 +1,89 @@
+'''
+The radio's event loop.
+
+Everything that changes UIState runs on one asyncio loop in the main
+thread: the render loop, encoder and MQTT callbacks, menu and station
+timers and the parsing of dablin's output. gpiozero and paho still call
+back on their own threads so their callbacks are bridged onto the loop
+with call_soon_threadsafe rather than touching the state directly.
+
+Slow work (tuning, stopping processes, scanning) would stall the display
+so it is handed to a single worker thread. Only one such job runs at a
+time, in the order they were asked for, and the result is passed back to
+the loop.
+'''
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Core():
+    def __init__(self):
+        self.loop     = asyncio.new_event_loop()
+        self._thread  = threading.main_thread()
+        self._worker  = ThreadPoolExecutor(max_workers=1, thread_name_prefix="player")
+        self.bridged  = 0  # Calls handed over from other threads
+
+    def on_loop(self) -> bool:
+        '''
+        True if called from the loop's thread
+        '''
+        return threading.current_thread() is self._thread
+
+    def call(self, fn, *args):
+        '''
+        Run fn(*args) on the loop. Straight away if already on it,
+        otherwise as soon as the loop gets to it
+        '''
+        if self.on_loop():
+            return fn(*args)
+        self.bridged += 1
+        self.loop.call_soon_threadsafe(fn, *args)
+
+    def bridge(self, fn):
+        '''
+        Wrap a callback made from another thread (gpiozero, paho) so it
+        runs on the loop
+        '''
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            self.call(functools.partial(fn, *args, **kwargs))
+        return wrapper
+
+    def blocking(self, fn, *args, then=None):
+        '''
+        Run fn(*args) on the worker thread. then(result) is called on
+        the loop once it has finished
+        '''
+        def done(f):
+            if f.exception() is not None:
+                logger.error("%s failed", getattr(fn, "__name__", fn), exc_info=f.exception())
+            elif then is not None:
+                self.call(then, f.result())
+
+        future = self._worker.submit(fn, *args)
+        future.add_done_callback(done)
+        return future
+
+    def run(self, main):
+        '''
+        Run the coroutine main on the loop until it finishes or is
+        interrupted
+        '''
+        asyncio.set_event_loop(self.loop)
+        task = self.loop.create_task(main)
+        try:
+            self.loop.run_until_complete(task)
+        finally:
+            task.cancel()
+            # Work on the worker may be waiting on the loop, let it finish
+            self.loop.run_until_complete(
+                asyncio.to_thread(self._worker.shutdown, wait=True, cancel_futures=True))
+
+    def close(self):
+        self._worker.shutdown(wait=True, cancel_futures=True)
+        self.loop.close()
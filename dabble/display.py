@@ -0,0 +1,144 @@
+'''
+Windowed writes to the ST7735 LCD.
+
+The st7735 driver only has display(image) which sends the whole frame over
+SPI. Most frames only change a few small areas (levels, a scroll, the
+visualiser) so WindowedDisplay keeps a copy of what the panel is showing,
+works out which pixels in the dirty regions actually changed and only sends
+those windows.
+'''
+import logging
+import time
+import numpy as np
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+SPI_BYTES = metrics.METRICS.counter("display.spi_bytes")
+
+
+class WindowedDisplay():
+    '''
+    Wrap an st7735.ST7735 (or anything with set_window/image_to_data/data).
+
+    rotation:          Same rotation the driver was created with
+    full_frame_ratio:  If the changed windows cover more than this fraction
+                       of the screen just send the whole frame
+    '''
+    # CASET + 4 bytes, RASET + 4 bytes, RAMWR
+    WINDOW_CMD_BYTES = 11
+    SPI_CHUNK_SIZE   = 4096
+
+    def __init__(self, disp, rotation:int=90, full_frame_ratio:float=0.6):
+        self.disp             = disp
+        self.width            = disp.width
+        self.height           = disp.height
+        self.rotation         = rotation
+        self.full_frame_ratio = full_frame_ratio
+
+        # What the panel is showing. None until the first full frame
+        self._shown = None
+
+        # Stats
+        self.bytes_sent   = 0
+        self.windows_sent = 0
+        self.frames_sent  = 0
+        self._rate_st     = time.monotonic()
+        self._rate_bytes  = 0
+
+    def _panel_window(self, box:tuple) -> tuple[int,int,int,int]:
+        '''
+        Map an (inclusive) box in image coordinates to panel coordinates,
+        undoing the rotation image_to_data applies
+        '''
+        (x0, y0, x1, y1) = box
+        w, h = self.width, self.height
+        match (self.rotation // 90) % 4:
+            case 0:
+                return (x0, y0, x1, y1)
+            case 1:
+                return (y0, w-1-x1, y1, w-1-x0)
+            case 2:
+                return (w-1-x1, h-1-y1, w-1-x0, h-1-y0)
+            case 3:
+                return (h-1-y1, x0, h-1-y0, x1)
+
+    def _send(self, data:bytes):
+        for i in range(0, len(data), self.SPI_CHUNK_SIZE):
+            self.disp.data(data[i:i + self.SPI_CHUNK_SIZE])
+        self.bytes_sent += len(data) + self.WINDOW_CMD_BYTES
+        self.windows_sent += 1
+        SPI_BYTES.inc(len(data) + self.WINDOW_CMD_BYTES)
+
+    def display(self, img):
+        '''
+        Send the whole frame
+        '''
+        frame = np.asarray(img)
+        self.disp.set_window()
+        self._send(self.disp.image_to_data(frame, self.rotation))
+        self._shown = frame.copy()
+        self.frames_sent += 1
+
+    def display_window(self, frame:np.ndarray, box:tuple):
+        '''
+        Send the (inclusive) box of frame
+        '''
+        (x0, y0, x1, y1) = box
+        window = frame[y0:y1+1, x0:x1+1]
+        self.disp.set_window(*self._panel_window(box))
+        self._send(self.disp.image_to_data(window, self.rotation))
+        self._shown[y0:y1+1, x0:x1+1] = window
+
+    def changed_box(self, frame:np.ndarray, box:tuple) -> tuple|None:
+        '''
+        Smallest box inside box where frame differs from what is shown
+        '''
+        (x0, y0, x1, y1) = box
+        changed = np.any(frame[y0:y1+1, x0:x1+1] != self._shown[y0:y1+1, x0:x1+1], axis=2)
+        rows = np.flatnonzero(changed.any(axis=1))
+        if len(rows) == 0:
+            return None
+        cols = np.flatnonzero(changed.any(axis=0))
+        return (x0 + int(cols[0]), y0 + int(rows[0]), x0 + int(cols[-1]), y0 + int(rows[-1]))
+
+    @metrics.METRICS.timed("display.push")
+    def update(self, img, regions:list|None=None):
+        '''
+        Send what has changed in img. regions is a list of inclusive
+        (x0,y0,x1,y1) boxes that may have changed, None means anywhere.
+        '''
+        if self._shown is None:
+            self.display(img)
+            return
+
+        frame = np.asarray(img)
+        if regions is None:
+            regions = [(0, 0, self.width-1, self.height-1)]
+
+        windows = [b for b in (self.changed_box(frame, r) for r in regions) if b is not None]
+        if not windows:
+            return
+
+        area = sum((x1-x0+1) * (y1-y0+1) for (x0, y0, x1, y1) in windows)
+        if area > self.full_frame_ratio * self.width * self.height:
+            self.display(img)
+            return
+
+        for box in windows:
+            # An earlier overlapping window may have sent this already
+            if (box := self.changed_box(frame, box)) is not None:
+                self.display_window(frame, box)
+        self.frames_sent += 1
+
+    def bytes_per_second(self) -> float:
+        '''
+        SPI bytes sent per second since the last call
+        '''
+        now = time.monotonic()
+        elapsed = now - self._rate_st
+        rate = (self.bytes_sent - self._rate_bytes) / elapsed if elapsed > 0 else 0.0
+        self._rate_st    = now
+        self._rate_bytes = self.bytes_sent
+        return rate
@@ -0,0 +1,101 @@
+'''
+Smoothing and automatic gain for the spectrum visualisers. Each bin gets
+an attack/release, and a slow AGC level, floored below full scale, is
+what the visualisers scale by.
+'''
+import logging
+import math
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def coefficient(tau:float, hop:float) -> float:
+    '''
+    Fraction of the way an exponential with time constant tau moves in hop
+    seconds. A tau of 0 follows straight away
+    '''
+    return 1.0 if tau <= 0.0 else 1.0 - math.exp(-hop/tau)
+
+
+class Dynamics():
+    '''
+    size:        Values per update e.g. spectrum bins
+    hop:         Seconds between updates
+    attack:      Time constant (s) for smoothed values rising
+    release:     Time constant (s) for smoothed values falling
+    agc_attack:  Time constant (s) for the reference level rising
+    agc_hold:    Seconds the reference holds a peak before releasing
+    agc_release: Time constant (s) for the reference level falling
+    full_scale:  Value of a full scale signal, see SpectrumAnalyzer.full_scale()
+    floor_db:    Lowest reference level, dB below full scale, so silence
+                 and hiss aren't blown up to full height
+    '''
+    def __init__(self,
+                 size:int,
+                 hop:float,
+                 attack:float=0.01,
+                 release:float=0.12,
+                 agc_attack:float=0.05,
+                 agc_hold:float=1.5,
+                 agc_release:float=4.0,
+                 full_scale:float=1.0,
+                 floor_db:float=-50.0):
+        self.attack      = attack
+        self.release     = release
+        self.agc_attack  = agc_attack
+        self.agc_hold    = agc_hold
+        self.agc_release = agc_release
+        self.floor       = full_scale * 10 ** (floor_db / 20)
+        self.smoothed    = np.zeros(size, dtype=np.float32)
+        self._rising     = np.zeros(size, dtype=bool)
+        self._coef       = np.zeros(size, dtype=np.float32)
+        self._step       = np.zeros(size, dtype=np.float32)
+        self.level       = self.floor  # AGC reference
+        self._held       = 0
+        self.set_hop(hop)
+
+    def set_hop(self, hop:float):
+        '''
+        Work out the per update coefficients for hop seconds between updates
+        '''
+        self.hop          = hop
+        self._attack      = coefficient(self.attack, hop)
+        self._release     = coefficient(self.release, hop)
+        self._agc_attack  = coefficient(self.agc_attack, hop)
+        self._agc_release = coefficient(self.agc_release, hop)
+        self._hold_hops   = int(round(self.agc_hold / hop))
+        logger.info("Dynamics: hop %0.1fms, attack %0.2f release %0.2f per hop, AGC hold %d hops",
+                    hop*1000, self._attack, self._release, self._hold_hops)
+
+    def reset(self):
+        '''
+        Back to silence e.g. on changing station
+        '''
+        self.smoothed.fill(0.0)
+        self.level = self.floor
+        self._held = 0
+
+    def apply(self, values:np.ndarray) -> float:
+        '''
+        Smooth values in place and return the reference level to scale by
+        '''
+        s = self.smoothed
+        np.greater(values, s, out=self._rising)
+        self._coef.fill(self._release)
+        np.copyto(self._coef, self._attack, where=self._rising)
+        np.subtract(values, s, out=self._step)
+        self._step *= self._coef
+        s += self._step
+        np.copyto(values, s)
+
+        peak = float(s.max())
+        if peak > self.level:
+            self.level += self._agc_attack * (peak - self.level)
+            self._held  = 0
+        elif self._held < self._hold_hops:
+            self._held += 1
+        else:
+            self.level = max(self.level + self._agc_release * (peak - self.level), self.floor)
+        return self.level
@@ -0,0 +1,67 @@
+'''
+Waveform envelope for the visualiser: each display column shows the range
+of its samples. PEAK is the min/max of the interleaved signal, RMS is
++/- the RMS of the mono mix.
+'''
+import logging
+from enum import StrEnum
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Decimation(StrEnum):
+    PEAK = "peak"
+    RMS  = "rms"
+
+
+class Envelope():
+    '''
+    columns:    Display columns to decimate a chunk into
+    channels:   Interleaved channels in the signal
+    decimation: PEAK or RMS
+    '''
+    def __init__(self, columns:int=160, channels:int=2, decimation:Decimation=Decimation.PEAK):
+        self.columns    = columns
+        self.channels   = channels
+        self.decimation = Decimation(decimation)
+        self.lo         = np.zeros(columns, dtype=np.float32)  # Bottom of each column
+        self.hi         = np.zeros(columns, dtype=np.float32)  # Top of each column
+        self._peak_lo   = np.zeros(columns, dtype=np.int32)
+        self._peak_hi   = np.zeros(columns, dtype=np.int32)
+        self.amplitude  = 0.0  # Largest magnitude of lo/hi, to scale by
+
+    def peak(self, signal:np.ndarray):
+        '''
+        Min and max of the interleaved signal over each column
+        '''
+        per_column = (len(signal) // self.channels // self.columns) * self.channels
+        block = signal[0:self.columns*per_column].reshape(self.columns, per_column)
+        block.min(axis=1, out=self._peak_lo)
+        block.max(axis=1, out=self._peak_hi)
+        np.copyto(self.lo, self._peak_lo, casting="unsafe")
+        np.copyto(self.hi, self._peak_hi, casting="unsafe")
+
+    def rms(self, mono:np.ndarray):
+        '''
+        +/- the RMS of the mono signal over each column
+        '''
+        per_column = len(mono) // self.columns
+        block = mono[0:self.columns*per_column].reshape(self.columns, per_column)
+        np.einsum('ij,ij->i', block, block, out=self.hi)
+        self.hi *= 1/per_column
+        np.sqrt(self.hi, out=self.hi)
+        np.negative(self.hi, out=self.lo)
+
+    def decimate(self, signal:np.ndarray, mono:np.ndarray|None=None) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        (lo, hi) per column for a chunk. mono is the mixed signal, only
+        needed for RMS. The arrays are overwritten by the next chunk.
+        '''
+        if self.decimation == Decimation.RMS:
+            self.rms(mono)
+        else:
+            self.peak(signal)
+        self.amplitude = max(-float(self.lo.min()), float(self.hi.max()))
+        return (self.lo, self.hi)
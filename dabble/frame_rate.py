@@ -0,0 +1,166 @@
+'''
+Frame rate governor for the render loop.
+
+Rather than draw as fast as possible, the render loop asks the governor to
+wait until the next frame is due. How often frames are due depends on what
+is on screen: the visualiser needs a smooth frame rate, text only needs
+enough to scroll and standby only shows a clock. State changes (new PAD,
+volume, menu navigation) wake the loop early so the UI still feels instant.
+'''
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from enum import Enum
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class RenderMode(Enum):
+    VISUALISER = 0
+    TEXT       = 1
+    STANDBY    = 2
+
+
+DEFAULT_FPS = {
+    RenderMode.VISUALISER: 30,
+    RenderMode.TEXT:       15,
+    RenderMode.STANDBY:    1,
+}
+
+
+class FrameRateGovernor():
+    '''
+    Pace the render loop:
+
+        while True:
+            governor.frame_start()
+            ui.draw_interface()
+            governor.frame_end()
+            governor.wait(mode)
+
+    or, on an event loop, await governor.wait_async(mode) after use_loop(loop)
+
+    fps:          Target frames per second for each RenderMode
+    report_every: Log a summary every this many seconds (0 to disable)
+    history:      Frame times kept for the percentiles
+    '''
+    def __init__(self, fps:dict|None=None, report_every:int=60, history:int=300):
+        self.fps           = dict(DEFAULT_FPS) if fps is None else fps
+        self.max_fps       = max(self.fps.values())
+        self.report_every  = report_every
+        self._wake         = threading.Event()
+        self._loop         = None
+        self._async_wake   = None
+        self._frame_times  = deque(maxlen=history)
+        self._frame_st     = 0.0
+        self._last_frame   = 0.0
+
+        # Stats for the current reporting period
+        self._period_st    = time.monotonic()
+        self._period_frames= 0
+        self._period_idle  = 0.0
+        self._report_st    = self._period_st
+
+        # Last completed period
+        self.achieved_fps  = 0.0
+        self.idle_pct      = 0.0
+        self.wakes         = 0
+
+    def wake(self):
+        '''
+        Something changed, render the next frame now. Safe from any thread
+        '''
+        self._wake.set()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._async_wake.set)
+
+    def use_loop(self, loop:asyncio.AbstractEventLoop):
+        '''
+        The render loop runs on loop and waits with wait_async()
+        '''
+        self._loop       = loop
+        self._async_wake = asyncio.Event()
+
+    def frame_start(self):
+        self._frame_st = time.monotonic()
+
+    def frame_end(self):
+        now = time.monotonic()
+        self._frame_times.append((now - self._frame_st)*1000)
+        self._last_frame = self._frame_st
+        self._period_frames += 1
+
+        elapsed = now - self._period_st
+        if elapsed >= 1:
+            self.achieved_fps   = self._period_frames / elapsed
+            self.idle_pct       = 100 * self._period_idle / elapsed
+            self._period_st     = now
+            self._period_frames = 0
+            self._period_idle   = 0.0
+            if self.report_every and now - self._report_st >= self.report_every:
+                self._report_st = now
+                logger.info("Render: %s", self.summary())
+
+    def _due(self, mode:RenderMode) -> tuple[float, float]:
+        '''
+        When the next frame is due and the earliest it may be drawn
+        '''
+        return (self._last_frame + 1/self.fps[mode], self._last_frame + 1/self.max_fps)
+
+    def wait(self, mode:RenderMode) -> bool:
+        '''
+        Sleep until the next frame is due for mode, or until woken.
+        Frames are never closer together than the highest target fps.
+        Returns True if woken by a state change
+        '''
+        t1 = time.monotonic()
+        (due, earliest) = self._due(mode)
+
+        woken = self._wake.wait(timeout=max(0.0, due - t1))
+        self._wake.clear()
+        if woken:
+            self.wakes += 1
+            if (pause := earliest - time.monotonic()) > 0:
+                time.sleep(pause)
+        self._period_idle += time.monotonic() - t1
+        return woken
+
+    async def wait_async(self, mode:RenderMode) -> bool:
+        '''
+        wait() for the event loop, other callbacks run while we wait
+        '''
+        t1 = time.monotonic()
+        (due, earliest) = self._due(mode)
+
+        woken = self._async_wake.is_set()
+        if not woken:
+            try:
+                await asyncio.wait_for(self._async_wake.wait(), timeout=max(0.0, due - t1))
+                woken = True
+            except TimeoutError:
+                pass
+        self._async_wake.clear()
+        self._wake.clear()
+        if woken:
+            self.wakes += 1
+            if (pause := earliest - time.monotonic()) > 0:
+                await asyncio.sleep(pause)
+        self._period_idle += time.monotonic() - t1
+        return woken
+
+    def percentiles(self, q:tuple=(50, 95, 99)) -> dict:
+        '''
+        Frame time (ms) percentiles over recent frames
+        '''
+        if not self._frame_times:
+            return {p: 0.0 for p in q}
+        return dict(zip(q, np.percentile(np.fromiter(self._frame_times, dtype=float), q)))
+
+    def summary(self) -> str:
+        p = self.percentiles()
+        return (f'{self.achieved_fps:.1f}fps idle {self.idle_pct:.0f}% '
+                f'frame p50 {p[50]:.1f}ms p95 {p[95]:.1f}ms p99 {p[99]:.1f}ms wakes {self.wakes}')
@@ -0,0 +1,95 @@
+'''
+Stand-ins for the LCD and shairport-sync so LCDUI(headless=True) runs
+without a Pi, e.g. for benchmarks/draw_interface.py.
+'''
+import logging
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class HeadlessPanel():
+    '''
+    In-memory ST7735. Pixels are kept as big endian RGB565 in panel
+    (unrotated) order as the driver would send them.
+
+    width, height: Native panel size, 80x160 for the 0.96" LCD
+    rotation:      As passed to st7735.ST7735
+    '''
+    def __init__(self, width:int=80, height:int=160, rotation:int=90):
+        self._width    = width
+        self._height   = height
+        self._rotation = rotation
+        self.mem       = np.zeros((height, width), dtype='>u2')
+        self._window   = (0, 0, width-1, height-1)
+        self._pending  = bytearray()
+        self.bytes_written = 0
+
+    @property
+    def width(self) -> int:
+        return self._height if self._rotation in (90, 270) else self._width
+
+    @property
+    def height(self) -> int:
+        return self._width if self._rotation in (90, 270) else self._height
+
+    def begin(self):
+        pass
+
+    def set_backlight(self, value):
+        pass
+
+    def set_window(self, x0:int=0, y0:int=0, x1:int|None=None, y1:int|None=None):
+        x1 = self._width - 1 if x1 is None else x1
+        y1 = self._height - 1 if y1 is None else y1
+        self._window  = (x0, y0, x1, y1)
+        self._pending = bytearray()
+
+    def image_to_data(self, image, rotation:int=0) -> bytes:
+        '''
+        RGB565 bytes for an RGB image or (h,w,3) array, as the driver does it
+        '''
+        if not isinstance(image, np.ndarray):
+            image = np.asarray(image.convert('RGB'))
+        pb = np.rot90(image, rotation // 90).astype(np.uint16)
+        rgb565 = ((pb[..., 0] & 0xF8) << 8) | ((pb[..., 1] & 0xFC) << 3) | (pb[..., 2] >> 3)
+        return rgb565.astype('>u2').tobytes()
+
+    def data(self, data:bytes):
+        '''
+        Pixel data for the current window, may arrive in chunks
+        '''
+        self._pending += data
+        self.bytes_written += len(data)
+        (x0, y0, x1, y1) = self._window
+        (w, h) = (x1 - x0 + 1, y1 - y0 + 1)
+        if len(self._pending) == w * h * 2:
+            self.mem[y0:y1+1, x0:x1+1] = np.frombuffer(bytes(self._pending), dtype='>u2').reshape(h, w)
+            self._pending = bytearray()
+
+    def display(self, image):
+        self.set_window()
+        self.data(self.image_to_data(image, self._rotation))
+
+    def image(self) -> Image.Image:
+        '''
+        What the panel is showing, the right way up, in RGB (565 precision)
+        '''
+        mem = np.rot90(self.mem.astype(np.uint16), -(self._rotation // 90))
+        rgb = np.empty(mem.shape + (3,), dtype=np.uint8)
+        rgb[..., 0] = (mem >> 8) & 0xF8
+        rgb[..., 1] = (mem >> 3) & 0xFC
+        rgb[..., 2] = (mem << 3) & 0xF8
+        return Image.fromarray(rgb, mode="RGB")
+
+
+class NullShairport():
+    '''
+    Swallows shairport-sync RemoteControl calls e.g. Play(), Pause()
+    '''
+    def __getattr__(self, name:str):
+        def call(*args, **kwargs):
+            logger.debug("Shairport %s ignored", name)
+        return call
@@ -5,19 +5,17 @@ import math
 import functools
 import threading
 import time
-import st7735
 import json
 import numpy as np
-import dbus
 from datetime import datetime
 
 from dataclasses import dataclass, field
 from enum import Enum,StrEnum
 from pathlib import Path
-from scipy.signal import butter, filtfilt, lfilter
 from PIL import Image, ImageDraw, ImageFont
 
-from . import exceptions, menus, encoder
+from . import compositor, exceptions, menus, encoder, rasteriser, display, frame_rate, metrics, text_cache, timer_wheel
+from .headless import HeadlessPanel, NullShairport
 
 logger = logging.getLogger(__name__)
 
@@ -121,11 +119,13 @@ class UIState():
     current_menu_item:str          = None
     lm:menus.Menu                  = None # Left Menu
     rm:menus.Menu                  = None # Right Menu
-    station_timer:threading.Thread = None # Station selection timeout
-    menu_timer:threading.Thread    = None # Menu exit timeout
+    station_timer:"menus.PeriodicTask" = None # Station selection timeout
+    menu_timer:"menus.PeriodicTask"    = None # Menu exit timeout
 
     visualiser_enabled:bool        = True
     visualiser:GraphicState        = GraphicState.GRAPHIC_EQUALISER
+    waveform_decimation:str        = "peak" # peak or rms, see envelope.Decimation
+    band_scale:str                 = "log"  # log or mel equaliser bands, see spectrum.BandScale
     levels_enabled:bool            = True
     station_enabled:bool           = True
     mode_display_enabled:bool      = True
@@ -136,8 +136,15 @@ class UIState():
 
     fps:int                        = 0 # Frames Per Sec
     render_time:int                = 0 # Time (in ms) taken to render LCD display
+    analysis_time:float            = 0 # Time (in ms) taken to analyse an audio chunk
+    spi_bytes_per_sec:int          = 0 # Bytes sent to the LCD per second
+    metrics_enabled:bool           = False # Record metrics, see metrics.METRICS
 
-    shairport_dbus_interface:dbus.Interface  = None                          
+    shairport_dbus_interface:"dbus.Interface" = None                          
+    frame_governor:frame_rate.FrameRateGovernor = None # Woken when state changes
+    core:object                    = None # Event loop UIState is changed on, see core.Core
+    metrics_reporter:object        = None # metrics.Reporter, running while metrics are enabled
+    screen_changed:bool            = False # More than the menu changed, redraw behind it
 
     
     def update(self, prop, value):
@@ -147,8 +154,20 @@ class UIState():
         Returns new value (as returned by method not value passed which may not be the same)
         '''
         setattr(self, prop, value)
+        self.changed(menu_only=prop == "current_menu_item")
         return getattr(self, prop)
 
+    def changed(self, menu_only:bool=False):
+        '''
+        Let the render loop know something has changed so it redraws now
+        rather than at the next frame. Unless only the menu selection moved
+        the screen behind an open menu is redrawn too
+        '''
+        if not menu_only:
+            self.screen_changed = True
+        if self.frame_governor is not None:
+            self.frame_governor.wake()
+
     def update_pad(self, pad):
         '''
         Update PAD message, but don't change current one otherwise
@@ -158,6 +177,7 @@ class UIState():
             self.last_pad_message = pad
         else:
             self.next_pad_message = pad
+        self.changed()
 
     def get_pad_message(self):
         '''
@@ -187,6 +207,11 @@ class UIState():
             self.last_pad_message=self.next_pad_message
 
     def __post_init__(self):
+        # Already given one e.g. headless.NullShairport
+        if self.shairport_dbus_interface is not None:
+            return
+        # Only on the radio, so the UI can run headless without dbus-python
+        import dbus
         sys_dbus = dbus.SystemBus()
         proxy = sys_dbus.get_object('org.gnome.ShairportSync', '/org/gnome/ShairportSync')
         self.shairport_dbus_interface = dbus.Interface(proxy, 'org.gnome.ShairportSync.RemoteControl')
@@ -195,18 +220,25 @@ class UIState():
 class Timer():
     '''
     Timer to record elapsed time. No callbacks needed, just calls
-    to expired or elapsed.
+    to expired or elapsed. Expiry is marked by the shared timer wheel
+    so checking it every frame is only a flag read
     '''
-    def __init__(self):
+    def __init__(self, wheel:timer_wheel.TimerWheel=None):
         self._start_time = 0
         self._elapsed    = 0
         self._expires    = 0
-        self._expired    = False
+        self._expired    = True
         self.running     = False
+        self._wheel      = timer_wheel.WHEEL if wheel is None else wheel
+        self._t          = None
 
     def _now_ns_to_ms(self):
         return time.time_ns()//1000000
 
+    def _expire(self):
+        self._expired = True
+        self.running  = False
+
     def start(self, expire_at:int):
         '''
         Start timer. Record time in microseconds
@@ -216,15 +248,16 @@ class Timer():
         self._start_time = self._now_ns_to_ms()
         self._expired    = False
         self.running     = True
+        if self._t is None:
+            self._t = self._wheel.schedule(expire_at/1000, self._expire, name="scroll_pause")
+        else:
+            self._wheel.reset(self._t, expire_at/1000)
 
     def elapsed(self):
         self._elapsed = self._now_ns_to_ms() - self._start_time
-        self._expired = self._elapsed >= self._expires
-        self.running  = self._expired
         return self._elapsed
 
     def expired(self):
-        self.elapsed()
         return self._expired
 
 
@@ -240,7 +273,12 @@ class LCDUI():
     '''
     def __init__(self, 
                  dc_gpio:str="GPIO9",
-                 backlight_gpio:str="GPIO26"):
+                 backlight_gpio:str="GPIO26",
+                 headless:bool=False):
+        '''
+        headless: Draw into an in-memory framebuffer rather than the LCD and
+                  don't connect to shairport-sync e.g. for benchmarks
+        '''
 
         self._lock = Locks.INTERFACE
 
@@ -249,16 +287,32 @@ class LCDUI():
         # Be mindful of GPIO use when using other devices
         logging.info("Initialising LCD display")
 
-        self.disp = st7735.ST7735(
-            port=0,
-            cs=0,
-            dc=dc_gpio,
-            backlight=backlight_gpio,
-            rotation=90,
-            spi_speed_hz=4000000
-        )
+        self.headless = headless
+        if headless:
+            self.disp = HeadlessPanel(rotation=90)
+        else:
+            # Only on the radio, so the UI can run headless without the
+            # LCD driver and its GPIO/SPI dependencies
+            import st7735
+            self.disp = st7735.ST7735(
+                port=0,
+                cs=0,
+                dc=dc_gpio,
+                backlight=backlight_gpio,
+                rotation=90,
+                spi_speed_hz=4000000
+            )
 
         self.disp.begin()
+
+        # Only send changed windows of the display over SPI. Draw methods
+        # mark the regions they touch, see _mark_dirty()
+        self.panel = display.WindowedDisplay(self.disp, rotation=90)
+        self._dirty_regions       = list()
+        self._frames_since_full   = 0
+        self._last_pushed         = None  # Image sent last frame
+        self.full_check_every     = 100 # Frames. Diff whole frame in case a region was missed
+
         self.WIDTH         = self.disp.width
         self.HEIGHT        = self.disp.height
         self.CENTRE_HEIGHT = self.HEIGHT//2 
@@ -267,6 +321,13 @@ class LCDUI():
 
         self.img = Image.new('RGB', (self.WIDTH, self.HEIGHT), color=(0, 0, 0))
         self.draw = ImageDraw.Draw(self.img)
+        # Dims the screen behind menus and in standby
+        self.compositor = compositor.Compositor(self.img)
+
+        # Station, PAD, ensemble and menu text is rendered once and pasted
+        self.text_cache          = text_cache.TextCache()
+        self.text_cache_report   = 60 # Log its stats every this many seconds
+        self._text_cache_st      = time.time()
 
         # Use to scroll station/PAD messages
         self.station_name_x       = self.WIDTH 
@@ -283,17 +344,20 @@ class LCDUI():
         self.last_r_level     = 0
         self.last_max_l_level = 0
         self.last_max_r_level = 0
-        self.last_max_signal  = np.zeros(4096)
         self.max_mag          = 1
+
+        # Visualiser buffers and peak hold state. Peaks belong to the
+        # visualiser being drawn and are dropped when it changes
+        self._viz_frames      = dict()
+        self._viz_peak_hold   = None
+        self._viz_drawn       = None
     
         # This will also set a default theme just in case
         # any requested theme is broken/not there
-        self.state = UIState()
+        self.state = UIState(shairport_dbus_interface=NullShairport() if headless else None)
 
-        # FPS calcs
-        self._fps  = 0     # Count for FPS
-        self._fps_st = time.time()   # Start of period
-        self._fps_et = 0   # End of period (1s)
+        # Start of the once a second stats update
+        self._fps_st = time.time()
 
     def get_font_path(self, style):
         fp=str(self.font_dir  / f'{self.base_font}-{style}.ttf')
@@ -317,6 +381,9 @@ class LCDUI():
         self.ensemble_font_file = self.get_font_path(self.state.theme.ensemble_font_style)
         self.menu_font_file     = self.get_font_path(self.state.theme.menu_font_style)
 
+        # Cached text was rendered with the old fonts
+        self.text_cache.clear()
+
         try:
             self.station_font    = ImageFont.truetype(self.station_font_file, self.state.theme.station_font_size)
             self.ensemble_font   = ImageFont.truetype(self.ensemble_font_file, self.state.theme.ensemble_font_size)
@@ -327,6 +394,26 @@ class LCDUI():
             logging.error("Cannot load font: %s", self.base_font)
             raise exceptions.FontException
 
+    def _viz_frame(self, height:int) -> rasteriser.VizFrame:
+        '''
+        Get the (preallocated) viz buffer for an area height pixels high
+        '''
+        if height not in self._viz_frames:
+            self._viz_frames[height] = rasteriser.VizFrame(self.WIDTH, height)
+        return self._viz_frames[height]
+
+    def _viz_peaks(self, size:int) -> np.ndarray:
+        '''
+        Get the peak hold heights for the current visualiser, one per
+        column or bar. Reset if the visualiser (or its size) has changed
+        '''
+        if self._viz_drawn != self.state.visualiser or \
+           self._viz_peak_hold is None or \
+           len(self._viz_peak_hold) != size:
+            self._viz_peak_hold = np.zeros(size, dtype=np.int64)
+            self._viz_drawn = self.state.visualiser
+        return self._viz_peak_hold
+
     def draw_viz(self, with_lock:bool=False):
         '''
         Draw the visualiser
@@ -337,20 +424,43 @@ class LCDUI():
             # Only do something if enabled
             if with_lock:
                 self._lock.acquire()
+            # Audio is analysed once per chunk by the audio processor,
+            # we just draw the latest results
+            analysis = self.state.audio_processor.analysis()
             match self.state.visualiser:
                 case GraphicState.GRAPHIC_EQUALISER:
-                    #self.graphic_equaliser(self.state.audio_processor.signal(), base_y=28, height=35)
-                    self.graphic_equaliser(self.state.audio_processor.signal(), base_y=26, height=37)
+                    #self.graphic_equaliser(analysis, base_y=28, height=35)
+                    self.graphic_equaliser(analysis, base_y=26, height=37)
                 case GraphicState.GRAPHIC_EQUALISER_BARS:
-                    #self.graphic_equaliser_bars(self.state.audio_processor.signal(), base_y=28, height=35, num_bars=32)
-                    self.graphic_equaliser_bars(self.state.audio_processor.signal(), base_y=26, height=37, num_bars=32)
+                    #self.graphic_equaliser_bars(analysis, base_y=28, height=35, num_bars=32)
+                    self.graphic_equaliser_bars(analysis, base_y=26, height=37, num_bars=32)
                 case GraphicState.WAVEFORM:
-                    #self.waveform(self.state.audio_processor.signal(), base_y=28, height=35)
-                    self.waveform(self.state.audio_processor.signal(), base_y=26, height=36)
+                    #self.waveform(analysis, base_y=28, height=35)
+                    self.waveform(analysis, base_y=26, height=36)
             if with_lock:
                 self._lock.release()
 
 
+    def render_mode(self) -> frame_rate.RenderMode:
+        '''
+        What sort of frame rate the current display needs
+        '''
+        if self.state.radio_state.standby.is_active:
+            return frame_rate.RenderMode.STANDBY
+        if self.compositor.frozen:
+            # Only the menu changes and that wakes the loop
+            return frame_rate.RenderMode.TEXT
+        if self.state.visualiser_enabled:
+            return frame_rate.RenderMode.VISUALISER
+        return frame_rate.RenderMode.TEXT
+
+    def _menu_open(self) -> bool:
+        return self.state.radio_state.left_menu_activated.is_active or \
+               self.state.radio_state.right_menu_activated.is_active or \
+               self.state.radio_state.selecting_left_menu.is_active or \
+               self.state.radio_state.selecting_right_menu.is_active
+
+    @metrics.METRICS.timed("render.frame")
     def draw_interface(self, reset_scroll=False, dim_screen=True, draw_centre_lines:bool=False):
         '''
         Draw the entire interface
@@ -361,131 +471,184 @@ class LCDUI():
 
         '''
         with self._lock:
-            t1=time.time_ns()
-
             # Normal display
            
             if self.state.radio_state.standby.is_active:
                 self.clear_screen()
                 self.draw_clock()
-                dimmed_image= Image.eval(self.img, lambda x: x/5)
-                self.update(img=dimmed_image)
+                self.update(img=self.compositor.dim())
                 return
 
-            # If we have no vis OR no signals then make sure we clear the station name area or
-            # we will get smudges as viz doesnt draw when no signal
-            clear_sn = not self.state.visualiser_enabled or \
-                       (self.state.audio_processor.peak_l==0 and self.state.audio_processor.peak_r==0)
-
-            #vol_bar_y = self.HEIGHT - 27
-            vol_bar_y = self.HEIGHT - 24
-
-            if reset_scroll:
-                self.reset_station_name_scroll()
-
-            # Scroll station name
-            if self.state.radio_state.playing.is_active or \
-               self.state.radio_state.left_menu_activated.is_active or \
-               self.state.radio_state.right_menu_activated.is_active:
-                self.scroll_station_name()
-
-            # When waiting for signal set PAD to nothing or status
-            if self.state.radio_state.mode == menus.PlayerMode.RADIO:
-                if self.state.awaiting_signal:
-                    self.state.last_pad_message = ""
-                elif not self.state.have_signal:
-                    self.state.last_pad_message = "No Signal"
-
-            # Draw the viz first, so we layer other text on top
-            self.draw_viz()
-
-            # Now station name
-            if self.state.station_enabled or self.state.radio_state.selecting_a_station.is_active:
-                self.draw_station_name(self.state.get_current_message(), clear=clear_sn)
-            else:
-                self.draw_station_name(" ", clear=clear_sn)
-
-            # Now volume and mode
-            if self.state.volume_display_enabled:
-                self.draw_volume_bar(self.state.volume, x=0,y=vol_bar_y, height=4)   
-            if self.state.mode_display_enabled:
-                self.draw_mode(clear=True)
-
-            # Now Ensemble and DAB type (if in radio mode)
-            if self.state.radio_state.mode == menus.PlayerMode.RADIO:
-                self.draw_ensemble(self.state.ensemble, clear=True)
-                self.draw_dab_type(self.state.dab_type, clear=True)
-
-            # Otherwise draw album name
-            # Scroll if too big
-            elif self.state.radio_state.mode == menus.PlayerMode.AIRPLAY:
-                if len(self.state.album)>20:
-                    self.scroll_status()
-                    self.scrolling_status=True
-                else:
-                    self.scrolling_status=False
-                self.draw_status(self.state.album)
-
-            # Now levels
-            if not self.state.levels_enabled:
-                self.clear_levels(y=self.HEIGHT-1)
-            else:
-                self.draw_levels(self.state.audio_processor.peak_l, self.state.audio_processor.peak_r, y=self.HEIGHT-1)
-
-            if draw_centre_lines:
-                self.draw.line((self.CENTRE_WIDTH, 0, self.CENTRE_WIDTH, self.HEIGHT),  fill='gray')
-                self.draw.line((0, self.CENTRE_HEIGHT, self.WIDTH, self.CENTRE_HEIGHT), fill='gray')
-
             # If we're selecting menus then dim background and draw current menu selection
-            # if menus are active draw over dimmed background
-            dimmed_image=None
-            if self.state.radio_state.left_menu_activated.is_active or \
-               self.state.radio_state.right_menu_activated.is_active or \
-               self.state.radio_state.selecting_left_menu.is_active or \
-               self.state.radio_state.selecting_right_menu.is_active:
-
-                dimmed_image= Image.eval(self.img, lambda x: x/5)
-                self.draw_menu(draw=ImageDraw.Draw(dimmed_image))
+            # over it. The dimmed background is kept while only the menu changes
+            menu_open = self._menu_open()
+            if self.state.screen_changed:
+                self.state.screen_changed = False
+                self.compositor.invalidate()
+            if menu_open and not self.compositor.has("menu"):
+                self.compositor.push(compositor.Overlay("menu", self.draw_menu))
+            elif not menu_open and self.compositor.has("menu"):
+                self.compositor.pop("menu")
+
+            if not self.compositor.frozen:
+                self.draw_screen(reset_scroll=reset_scroll, draw_centre_lines=draw_centre_lines)
 
             # Update image on LCD
-            self.update(img=dimmed_image)
+            (img, regions) = self.compositor.compose()
+            if img is not self.img:
+                self._dirty_regions = list()
+            for box in regions or []:
+                self._mark_dirty(*box)
+            self.update(img=img, full=regions is None)
+
+            # Once a second take the frame rate and render time from the
+            # governor, which times the frames
+            now = time.time()
+            if now - self._fps_st >= 1:
+                self._fps_st = now
+                if (governor := self.state.frame_governor) is not None:
+                    self.state.fps = round(governor.achieved_fps)
+                    self.state.render_time = governor.percentiles((50,))[50]
+                self.state.analysis_time = self.state.audio_processor.analysis_time
+                self.state.spi_bytes_per_sec = int(self.panel.bytes_per_second())
+                if self.text_cache_report and now - self._text_cache_st >= self.text_cache_report:
+                    self._text_cache_st = now
+                    logger.info("Text cache: %s", self.text_cache.summary())
+
+
+
+    def draw_screen(self, reset_scroll=False, draw_centre_lines:bool=False):
+        '''
+        Draw the playing screen, everything but overlays such as menus
+        '''
+        # If we have no vis OR no signals then make sure we clear the station name area or
+        # we will get smudges as viz doesnt draw when no signal
+        clear_sn = not self.state.visualiser_enabled or \
+                   (self.state.audio_processor.peak_l==0 and self.state.audio_processor.peak_r==0)
+
+        #vol_bar_y = self.HEIGHT - 27
+        vol_bar_y = self.HEIGHT - 24
+
+        if reset_scroll:
+            self.reset_station_name_scroll()
+
+        # Scroll station name
+        if self.state.radio_state.playing.is_active or \
+           self.state.radio_state.left_menu_activated.is_active or \
+           self.state.radio_state.right_menu_activated.is_active:
+            self.scroll_station_name()
+
+        # When waiting for signal set PAD to nothing or status
+        if self.state.radio_state.mode == menus.PlayerMode.RADIO:
+            if self.state.awaiting_signal:
+                self.state.last_pad_message = ""
+            elif not self.state.have_signal:
+                self.state.last_pad_message = "No Signal"
+
+        # Draw the viz first, so we layer other text on top
+        self.draw_viz()
+
+        # Now station name
+        if self.state.station_enabled or self.state.radio_state.selecting_a_station.is_active:
+            self.draw_station_name(self.state.get_current_message(), clear=clear_sn)
+        else:
+            self.draw_station_name(" ", clear=clear_sn)
+
+        # Now volume and mode
+        if self.state.volume_display_enabled:
+            self.draw_volume_bar(self.state.volume, x=0,y=vol_bar_y, height=4)   
+        if self.state.mode_display_enabled:
+            self.draw_mode(clear=True)
+
+        # Now Ensemble and DAB type (if in radio mode)
+        if self.state.radio_state.mode == menus.PlayerMode.RADIO:
+            self.draw_ensemble(self.state.ensemble, clear=True)
+            self.draw_dab_type(self.state.dab_type, clear=True)
+
+        # Otherwise draw album name
+        # Scroll if too big
+        elif self.state.radio_state.mode == menus.PlayerMode.AIRPLAY:
+            if len(self.state.album)>20:
+                self.scroll_status()
+                self.scrolling_status=True
+            else:
+                self.scrolling_status=False
+            self.draw_status(self.state.album)
 
-            # Calc FPS
-            t2=time.time_ns()
-            render_time = ((t2-t1)/1000000)
-            self._fps_et=time.time()
-            if self._fps_et - self._fps_st>=1:
-                self.state.fps = self._fps
-                self.state.render_time = render_time
-                self._fps_st=time.time()
-                self._fps=0
-            self._fps += 1 
+        # Now levels
+        if not self.state.levels_enabled:
+            self.clear_levels(y=self.HEIGHT-1)
+        else:
+            self.draw_levels(self.state.audio_processor.peak_l, self.state.audio_processor.peak_r, y=self.HEIGHT-1)
+
+        if draw_centre_lines:
+            self.draw.line((self.CENTRE_WIDTH, 0, self.CENTRE_WIDTH, self.HEIGHT),  fill='gray')
+            self.draw.line((0, self.CENTRE_HEIGHT, self.WIDTH, self.CENTRE_HEIGHT), fill='gray')
+            self._mark_dirty(0, 0, self.WIDTH, self.HEIGHT)
+
+    def update(self,img=None,full:bool=False):
+        '''
+        Update LCD. Use img or, or if none, the class image.
+        Only the dirty regions are checked for changes. They are the class
+        image's unless img is the compositor's output. Any other image
+        could differ anywhere, as could any image if full or the first
+        frame after a different image was shown e.g. leaving a menu or
+        standby
+        '''
+        img = self.img if img is None else img
+        regions = None
+        self._frames_since_full += 1
+        if (img is self.img or img is self.compositor.out) and img is self._last_pushed and not full and \
+           self._frames_since_full < self.full_check_every:
+            regions = self._dirty_regions
+        else:
+            self._frames_since_full = 0
+        self.panel.update(img, regions)
+        self._last_pushed   = img
+        self._dirty_regions = list()
 
+    def _mark_dirty(self, x0, y0, x1, y1):
+        '''
+        Record a region of the class image that has been drawn on and
+        may need sending to the display
+        '''
+        (x0,x1) = (max(0, math.floor(min(x0,x1))), min(self.WIDTH-1,  math.ceil(max(x0,x1))))
+        (y0,y1) = (max(0, math.floor(min(y0,y1))), min(self.HEIGHT-1, math.ceil(max(y0,y1))))
+        if x0<=x1 and y0<=y1:
+            self._dirty_regions.append((x0,y0,x1,y1))
 
-    def update(self,img=None):
+    def _mark_text_dirty(self, xy, t:str, font, anchor:str):
         '''
-        Update LCD. Use img or, or if none, the class image
+        Mark the bounding box of text drawn at xy
         '''
+        self._mark_dirty(*self.draw.textbbox(xy, t, font=font, anchor=anchor))
+
+    def _draw_text(self, xy, t:str, font, fill, anchor:str="la", img=None):
+        '''
+        Draw text from the text cache and mark it dirty. img defaults to
+        the class image
+        '''
+        bbox = self.text_cache.draw(self.img if img is None else img, xy, t, font, fill, anchor)
         if img is None:
-            self.disp.display(self.img)
-        else:
-            self.disp.display(img)
+            self._mark_dirty(*bbox)
+        return bbox
 
 
     def _get_text_hw_and_bb(self, t:str, font=None):
         '''
         Get boundingbox, text height and width give text str and font
         '''
-        (x1,y1,x2,y2) = font.getbbox(t)
+        ((x1,y1,x2,y2), text_width) = self.text_cache.measure(t, font)
         text_height = abs(y2 - y1)
-        text_width  = self.draw.textlength(t, font=font)
         return (x1,y1,x2,y2,text_height,text_width)
 
 
     def clear_screen(self):
         self.draw.rectangle((0, 0, self.WIDTH, self.HEIGHT), (0, 0, 0))
+        self._mark_dirty(0, 0, self.WIDTH, self.HEIGHT)
 
 
+    @metrics.METRICS.timed("draw.clock")
     def draw_clock(self):
         '''
         Draw clock in standby mode
@@ -495,6 +658,7 @@ class LCDUI():
         text_width  = self.draw.textlength(t, font=self.clock_font)
         text_x = text_width//2
         self.draw.text( (text_x, self.CENTRE_HEIGHT), t, font=self.clock_font, fill=self.state.theme.station, anchor="lm")
+        self._mark_text_dirty((text_x, self.CENTRE_HEIGHT), t, self.clock_font, "lm")
 
 
     def show_startup(self):
@@ -509,7 +673,9 @@ class LCDUI():
         Clear the levels
         '''
         self.draw.rectangle((0,y,self.WIDTH,y+1), (0, 0, 0))
+        self._mark_dirty(0, y, self.WIDTH, y+1)
 
+    @metrics.METRICS.timed("draw.levels")
     def draw_levels(self, l:int, r:int, y:int=1, decay:int=1, rainbow:bool=False):
         '''
         Draw levels
@@ -542,6 +708,7 @@ class LCDUI():
             self.draw.point((c+self.last_max_r_level,y),fill=self.state.theme.viz_dot)
             self.last_max_r_level -= decay
 
+    @metrics.METRICS.timed("draw.mode")
     def draw_mode(self, clear:bool=True):
         '''
         Draw Mode e.g. Airplay or Radio
@@ -551,15 +718,17 @@ class LCDUI():
         (x1,y1,x2,y2,text_height,text_width) = self._get_text_hw_and_bb(t, font=self.ensemble_font)
         if clear:
             self.draw.rectangle((0,0, text_width, text_height), (0, 0, 0))
+            self._mark_dirty(0, 0, text_width, text_height)
 
         ra_col = self.state.theme.mode_hilite if self.state.radio_state.mode==menus.PlayerMode.RADIO   else self.state.theme.ensemble
         ap_col = self.state.theme.mode_hilite if self.state.radio_state.mode==menus.PlayerMode.AIRPLAY else self.state.theme.ensemble
            
         # TODO: ?Calc text width, so no hardcoded x coords?
         # TODO: Themes will break this if the ensemble pt size is changed
-        self.draw.text( (0, y1),"Radio" ,  font=self.ensemble_font, fill=ra_col, anchor="lt")
-        self.draw.text( (35,y1),"Airplay", font=self.ensemble_font, fill=ap_col, anchor="lt")
+        self._draw_text( (0, y1),"Radio" ,  font=self.ensemble_font, fill=ra_col, anchor="lt")
+        self._draw_text( (35,y1),"Airplay", font=self.ensemble_font, fill=ap_col, anchor="lt")
 
+    @metrics.METRICS.timed("draw.status")
     def draw_status(self, t:str, clear:bool=True):
         '''
         Draw Status. Use full bottom line
@@ -574,9 +743,11 @@ class LCDUI():
         self.status_size_x = text_width
         if clear:
             self.draw.rectangle((0,self.HEIGHT-text_height-4, self.WIDTH, self.HEIGHT), (0, 0, 0))
-        self.draw.text( (text_x,self.HEIGHT), t, font=self.ensemble_font, fill=self.state.theme.ensemble, anchor="ld")
+            self._mark_dirty(0, self.HEIGHT-text_height-4, self.WIDTH, self.HEIGHT)
+        self._draw_text( (text_x,self.HEIGHT), t, font=self.ensemble_font, fill=self.state.theme.ensemble, anchor="ld")
 
 
+    @metrics.METRICS.timed("draw.ensemble")
     def draw_ensemble(self, t:str, clear:bool=True):
         '''
         Draw Ensemble. Divide bottom into 4. Ensemble text consumes 3/4 of screen
@@ -585,9 +756,11 @@ class LCDUI():
         split_point = self.WIDTH//4*3
         if clear:
             self.draw.rectangle((0,self.HEIGHT-text_height-4, split_point, self.HEIGHT), (0, 0, 0))
-        self.draw.text( (0,self.HEIGHT), t, font=self.ensemble_font, fill=self.state.theme.ensemble, anchor="ld")
+            self._mark_dirty(0, self.HEIGHT-text_height-4, split_point, self.HEIGHT)
+        self._draw_text( (0,self.HEIGHT), t, font=self.ensemble_font, fill=self.state.theme.ensemble, anchor="ld")
 
 
+    @metrics.METRICS.timed("draw.dab_type")
     def draw_dab_type(self, t:str, clear:bool=True):
         '''
         Draw DAB Type. Divide bottom into 4. Type text consumes last 1/4 of screen
@@ -598,14 +771,18 @@ class LCDUI():
         split_point = self.WIDTH//4*3
         if clear:
             self.draw.rectangle((split_point,self.HEIGHT-text_height-4, self.WIDTH, self.HEIGHT), (0, 0, 0))
-        self.draw.text( (self.WIDTH,self.HEIGHT), t, font=self.ensemble_font, fill=self.state.theme.ensemble, anchor="rd")
+            self._mark_dirty(split_point, self.HEIGHT-text_height-4, self.WIDTH, self.HEIGHT)
+        self._draw_text( (self.WIDTH,self.HEIGHT), t, font=self.ensemble_font, fill=self.state.theme.ensemble, anchor="rd")
 
 
-    def draw_menu(self, draw=None):
+    @metrics.METRICS.timed("draw.menu")
+    def draw_menu(self, img=None):
         '''
-        Draw on-screen menu
+        Draw on-screen menu, on img if given e.g. a dimmed copy of the screen.
+        Returns the boxes drawn in
         '''
-        draw = self.draw if draw is None else draw
+        img  = self.img if img is None else img
+        draw = ImageDraw.Draw(img)
 
         menu_id      = self.state.current_menu_item.menu_id
         display_text = self.state.current_menu_item.dstate()
@@ -635,11 +812,13 @@ class LCDUI():
             next_menu = menu_list[i+1].dstate() if i<len(menu_list)-1 else menu_list[0].dstate()
 
             draw.line((0, 0, 0, self.HEIGHT), width=1, fill=self.state.theme.volume_bg)
-            draw.text( (x, self.CENTRE_HEIGHT-cm_height), prev_menu, font=self.menu_sml_font, fill=self.state.theme.menu_sml, anchor=anchor)
-            draw.text( (x, self.CENTRE_HEIGHT), display_text, font=self.menu_sel_font, fill=self.state.theme.menu, anchor=anchor)
-            draw.text( (x, self.CENTRE_HEIGHT+cm_height), next_menu, font=self.menu_sml_font, fill=self.state.theme.menu_sml, anchor=anchor)
-       
+            return [(0, 0, 0, self.HEIGHT),
+                self._draw_text( (x, self.CENTRE_HEIGHT-cm_height), prev_menu, font=self.menu_sml_font, fill=self.state.theme.menu_sml, anchor=anchor, img=img),
+                self._draw_text( (x, self.CENTRE_HEIGHT), display_text, font=self.menu_sel_font, fill=self.state.theme.menu, anchor=anchor, img=img),
+                self._draw_text( (x, self.CENTRE_HEIGHT+cm_height), next_menu, font=self.menu_sml_font, fill=self.state.theme.menu_sml, anchor=anchor, img=img)]
+        return []
 
+    @metrics.METRICS.timed("draw.station_name")
     def draw_station_name(self, t:str, clear:bool=False):
         '''
         Draw station name (or PAD) 
@@ -650,9 +829,10 @@ class LCDUI():
         # Calc text x with scroll factor
         text_x = self.WIDTH - self.station_name_x
 
-        (x1,y1,x2,y2) = self.draw.textbbox( (text_x,self.CENTRE_HEIGHT), t,font=self.station_font,anchor="lm")
-        text_width  = self.draw.textlength(t, font=self.station_font)
-        text_height = abs(y2-y1)
+        # Scrolling only moves the cached strip
+        strip = self.text_cache.strip(t, self.station_font, self.state.theme.station, "lm")
+        text_width  = strip.length
+        text_height = strip.height
         if text_height==0:
             text_height=14
         half_th = text_height // 2
@@ -661,7 +841,8 @@ class LCDUI():
         if clear:
             # Viz is 35 pixels high starting at 28
             self.draw.rectangle((0,self.HEIGHT-28-35,self.WIDTH,self.HEIGHT-28), (0, 0, 0))
-        self.draw.text( (text_x, self.CENTRE_HEIGHT), t, font=self.station_font, fill=self.state.theme.station, anchor="lm")
+            self._mark_dirty(0, self.HEIGHT-28-35, self.WIDTH, self.HEIGHT-28)
+        self._draw_text( (text_x, self.CENTRE_HEIGHT), t, font=self.station_font, fill=self.state.theme.station, anchor="lm")
 
 
     def scroll_status(self, speed=1, pause_for:int=900):
@@ -706,6 +887,7 @@ class LCDUI():
         self.station_name_x = self.WIDTH
 
 
+    @metrics.METRICS.timed("draw.volume_bar")
     def draw_volume_bar(self, volume, max_volume=100, width=160, height=4, x=0, y=0, bar_margin=0):
         '''
         Draws a horizontal volume bar at position (x, y).
@@ -723,185 +905,92 @@ class LCDUI():
         self.draw.rectangle([
             (x + bar_margin, bar_y), 
             (x + bar_margin + fill_width, bar_y + bar_height)], fill=self.state.theme.volume)
+        self._mark_dirty(x + bar_margin, bar_y, x + width - bar_margin, bar_y + bar_height)
 
 
     def scale_log(self, c, f):
         return c * math.log(float(1 + f),10);
 
 
-    def fft(self, signal, is_mono:bool=False, use_window:bool=False, low_pass_cutoff:float=0.0):
-        '''
-        Calc FFT of signal and process so we can visualise it.
-        This is quick but processor intensive
-
-        TODO: Move to audio_processing
-        '''
-        # Convert to mono
-        if is_mono:
-            mono_signal = signal
-        else:
-            mono_signal = ((signal[0::2].astype(np.float32) + signal[1::2].astype(np.float32)) / 2).astype(np.int32)   
-
-        # Use lowpass filter to enhance lower frequencies so viz has more energy
-        if low_pass_cutoff>0.0:
-            nyq_freq = float(self.state.audio_processor.sample_rate)/2.0
-            normalised_cutoff = low_pass_cutoff/nyq_freq
-            b, a  = butter(4, normalised_cutoff, btype='lowpass', analog=False)
-            mono_signal = filtfilt(b, a, mono_signal)
-
-        # Window to reduce spectral oddities
-        windowed_signal = mono_signal * np.hanning(len(mono_signal)) if use_window else mono_signal
-
-        # FFT magic
-        fft_data        = np.abs(np.fft.rfft(windowed_signal))
-
-        # FFT spectrum seems to be repeated so take what looks like
-        # first "chunk" of repeated data
-        fft_spectrum = fft_data[0:512]/10000
-
-        # Max value
-        max_magnitude = np.max(fft_spectrum)
-        if max_magnitude==0.0:
-            max_magnitude=0.01
-
-        return (max_magnitude, fft_spectrum)
-
-
-    def graphic_equaliser(self, signal, base_y:int=0, height:int=60, width:int=0, fall_decay:int=2, use_log_scale:bool=False, is_mono:bool=False):
+    @metrics.METRICS.timed("draw.graphic_equaliser")
+    def graphic_equaliser(self, analysis, base_y:int=0, height:int=60, width:int=0, fall_decay:int=2, use_log_scale:bool=True):
         '''
-        Show frequencies using fft
+        Show frequencies using fft, one column per log (or mel) band, or
+        spread linearly over the spectrum if not use_log_scale
         '''
-        if signal is None:
+        if analysis is None:
+            return
+        columns = analysis.bands if use_log_scale else analysis.columns
+        if columns is None:
             return
 
         if width==0:
             width=self.WIDTH
 
-        (max_magnitude, fft_spectrum) = self.fft(signal, is_mono=is_mono)
-        scale:float = float(height)/max_magnitude
+        scale:float = float(height)/analysis.max_magnitude
 
-        # Clear existing graphics
-        self.draw.rectangle([
-            (0,self.HEIGHT-height-base_y),
-            (self.WIDTH,self.HEIGHT-base_y)], fill="black")
-
-        # Map FFT bins to x-axis
-        num_bins = len(fft_spectrum)
-
-        # self.draw.line ( (0, self.HEIGHT - base_y - height, self.WIDTH , self.HEIGHT - base_y - height), fill=self.state.theme.viz_line)
-        for x in range(0,self.WIDTH,1):
-            # Map x pixel to FFT bin index
-            bin_index = int((x / self.WIDTH) * num_bins)
-            if bin_index >= num_bins:
-                bin_index = num_bins - 1
-            y = int(fft_spectrum[bin_index] * scale)
-            # Draw line and dot
-            self.draw.line ([
-                (x, self.HEIGHT - base_y), 
-                (x , self.HEIGHT - y - base_y)], 
-                            fill=self.state.theme.viz_line, width=1)
-            self.draw.point( 
-                (x, self.HEIGHT - y - base_y), 
-                            fill=self.state.theme.viz_dot)
-            # Draw decay point
-            if y > self.last_max_signal[x]:
-                self.last_max_signal[x] = y
-
-            if self.last_max_signal[x]>0:
-                self.draw.point(
-                        (x , self.HEIGHT - self.last_max_signal[x] - base_y),
-                        fill=self.state.theme.viz_dot)
-                self.last_max_signal[x] -= fall_decay
-
-
-    def graphic_equaliser_bars(self, signal, base_y:int=0, height:int=60, width:int=0, fall_decay:int=3, use_log_scale:bool=True, num_bars:int=32, is_mono:bool=False):
+        # Rasterise into the viz buffer and paste it into the image in one go
+        # Area runs from the top of the tallest column down to the base line
+        frame   = self._viz_frame(height+1)
+        heights = rasteriser.column_heights(columns, scale, height)
+        rasteriser.graphic_equaliser(frame, heights,
+                                     self._viz_peaks(self.WIDTH),
+                                     rasteriser.rgb(self.state.theme.viz_line),
+                                     rasteriser.rgb(self.state.theme.viz_dot),
+                                     fall_decay=fall_decay)
+        frame.paste(self.img, self.HEIGHT-height-base_y)
+        self._mark_dirty(0, self.HEIGHT-height-base_y, self.WIDTH, self.HEIGHT-base_y)
+
+
+    @metrics.METRICS.timed("draw.graphic_equaliser_bars")
+    def graphic_equaliser_bars(self, analysis, base_y:int=0, height:int=60, width:int=0, fall_decay:int=3, use_log_scale:bool=True, num_bars:int=32):
         '''
         Show frequencies using fft, grouped into num_bars (default 32) bins.
+        With use_log_scale the bars group the log (or mel) bands the full
+        equaliser shows, otherwise equal slices of the spectrum
         '''
-        if signal is None:
+        if analysis is None:
+            return
+        values = analysis.bands if use_log_scale else analysis.spectrum
+        if values is None:
             return
         if width == 0:
             width = self.WIDTH
 
-        (max_magnitude, fft_spectrum) = self.fft(signal, is_mono=is_mono)
-        scale:float = float(height)/max_magnitude
+        scale:float = float(height)/analysis.max_magnitude
 
-        # Bin the FFT magnitudes into num_bars
-        bin_size  = len(fft_spectrum) // num_bars
+        # Bin the FFT magnitudes into num_bars and scale to pixels
         bar_width = width // num_bars
+        heights   = (rasteriser.band_values(values, num_bars) * scale).astype(np.int64)
+        np.clip(heights, 0, height, out=heights)
 
-        # Clear area
-        self.draw.rectangle([
-            (0, self.HEIGHT - height - base_y), 
-            (self.WIDTH, self.HEIGHT - base_y)], 
-            fill="black")
-
-        for x in range(0,num_bars):
-            start = x * bin_size
-            end   = start + bin_size
-            if end > len(fft_spectrum):
-                end = len(fft_spectrum)
-            # Aggregate magnitude within the bin
-            # For first bar (bass) use mean as it looks better
-            bar_value  = np.max(fft_spectrum[start:end]) if x>0 else np.mean(fft_spectrum[start:end])
-            bar_height = int(bar_value * scale)
-            x1 = x * bar_width
-            x2 = x1 + bar_width - 2
-
-            # Draw the bar (rectangle)
-            self.draw.rectangle([
-                (x1, self.HEIGHT - base_y - bar_height), 
-                (x2, self.HEIGHT - base_y)], fill=self.state.theme.viz_line, width=1)
-
-            if bar_height > self.last_max_signal[x]:
-                self.last_max_signal[x] = bar_height
-
-            if self.last_max_signal[x]>0:
-                self.draw.line([
-                    (x1, self.HEIGHT - base_y - self.last_max_signal[x]), 
-                    (x2, self.HEIGHT - base_y - self.last_max_signal[x])], 
-                    fill=self.state.theme.viz_dot, width=1)
-                self.last_max_signal[x] -= fall_decay
-
-
-    def waveform(self, signal, base_y:int=0, height:int=60, width:int=0, fall_decay:int=4, is_mono:bool=False):
-        '''
-        Show waveform
-        '''
-        if signal is None:
+        frame = self._viz_frame(height+1)
+        rasteriser.graphic_equaliser_bars(frame, heights,
+                                          self._viz_peaks(num_bars),
+                                          bar_width,
+                                          rasteriser.rgb(self.state.theme.viz_line),
+                                          rasteriser.rgb(self.state.theme.viz_dot),
+                                          fall_decay=fall_decay)
+        frame.paste(self.img, self.HEIGHT-height-base_y)
+        self._mark_dirty(0, self.HEIGHT-height-base_y, self.WIDTH, self.HEIGHT-base_y)
+
+
+    @metrics.METRICS.timed("draw.waveform")
+    def waveform(self, analysis, base_y:int=0, height:int=60, width:int=0, fall_decay:int=4):
+        '''
+        Show waveform, the envelope of each column centred in the area
+        '''
+        if analysis is None or analysis.envelope_hi is None:
             return
         if width==0:
             width=self.WIDTH
 
-        if is_mono:
-            mono_signal = signal
-        else:
-            mono_signal = ((signal[0::2].astype(np.float32) + signal[1::2].astype(np.float32)) / 2).astype(np.int32)   
-
-        # Clear area
-        self.draw.rectangle([
-            (0, self.HEIGHT - height - base_y), 
-            (self.WIDTH, self.HEIGHT - base_y )], fill="black")
-
-        max_magnitude = np.max(mono_signal)
-        if max_magnitude==0:
-            max_magnitude=0.001
-        scale:float = float(height-2)/max_magnitude
-
-        bin_size = len(mono_signal) // self.WIDTH
-        base_y = self.CENTRE_HEIGHT
-
-        for x in range(0,self.WIDTH,1):
-            start = x * bin_size
-            end = start + bin_size
-            if end > len(mono_signal):
-                end = len(mono_signal)
-            v  = np.max(mono_signal[start:end])
-            h = (v * scale) // 2 
-            self.draw.line( [
-                (x, self.HEIGHT - base_y - h) , 
-                (x, self.HEIGHT - base_y + h) ], fill=self.state.theme.viz_line, width=1)
-            self.draw.point( (x , self.HEIGHT - base_y - h), fill=self.state.theme.viz_dot)
-            self.draw.point( (x , self.HEIGHT - base_y + h), fill=self.state.theme.viz_dot)
+        frame = self._viz_frame(height+1)
+        rasteriser.waveform(frame, analysis.envelope_lo[0:width], analysis.envelope_hi[0:width],
+                            analysis.max_amplitude,
+                            rasteriser.rgb(self.state.theme.viz_line),
+                            rasteriser.rgb(self.state.theme.viz_dot))
+        frame.paste(self.img, self.HEIGHT-height-base_y)
+        self._mark_dirty(0, self.HEIGHT-height-base_y, self.WIDTH, self.HEIGHT-base_y)
 
 
@@ -9,19 +9,22 @@ from statemachine import StateMachine, State, Event
 from time import sleep,time
 from enum import Enum
 from dabble import (audio_processing, encoder, exceptions, keyboard, lcd_ui,
-                    radio_player, radio_stations)
+                    radio_player, radio_stations, timer_wheel)
 
 logger = logging.getLogger(__name__)
 
 class PeriodicTask:
-    def __init__(self, interval, callback, name:str=""):
+    def __init__(self, interval, callback, name:str="", wheel:timer_wheel.TimerWheel=None):
         '''
         Init the timer. Callback is called every interval seconds.
         Note, callback should be a lambda.
+        Timers share one timer wheel so resetting one is cheap. Once the
+        wheel is attached to the event loop callbacks run on the loop
         '''
         self.interval = interval
         self.callback = callback
         self.name     = name
+        self.wheel    = timer_wheel.WHEEL if wheel is None else wheel
         self._t        = None
         self._terminate = threading.Event()
 
@@ -34,7 +37,7 @@ class PeriodicTask:
         # Set event to terminate and not repeat
         if self._terminate.is_set():
             logging.info("Timer %s ends", self.name)
-            self._t.cancel()
+            self.wheel.cancel(self._t)
             self._t = None
         else:
             logging.info("Timer %s resetting. Will fire again in %ds", self.name, self.interval)
@@ -44,9 +47,10 @@ class PeriodicTask:
         '''
         Call callback every interval seconds
         '''
-        self._t = threading.Timer(self.interval, self.run_callback)
-        self._t.name = self.name
-        self._t.start()
+        if self._t is None:
+            self._t = self.wheel.schedule(self.interval, self.run_callback, name=self.name)
+        else:
+            self.wheel.reset(self._t, self.interval)
 
     def terminate(self):
         self._terminate.set()
@@ -55,7 +59,6 @@ class PeriodicTask:
         '''
         Reset the timer back to zero and start counting again
         '''
-        self._t.cancel()
         self.run()
 
 
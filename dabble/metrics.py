@@ -0,0 +1,231 @@
+'''
+Counters and timing histograms for the hot paths, all in METRICS. Off
+until enabled, recording then returns straight away. A Reporter
+summarises what was recorded since it last looked.
+'''
+import functools
+import json
+import logging
+import time
+
+from . import timer_wheel
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = 4 * 65
+
+
+def _bucket(ns:int) -> int:
+    '''
+    Log bucket for a value: 2 bits of mantissa under the leading one
+    '''
+    b = ns.bit_length()
+    if b <= 3:
+        return ns
+    return (b << 2) | ((ns >> (b - 3)) & 3)
+
+
+def _bucket_value(i:int) -> float:
+    '''
+    Middle of the range of values in bucket i
+    '''
+    if i < 8:
+        return float(i)
+    (b, m) = (i >> 2, i & 3)
+    lo = (4 | m) << (b - 3)
+    return lo + (1 << (b - 3)) / 2
+
+
+class Counter():
+    __slots__ = ("name", "value", "_registry")
+
+    def __init__(self, name:str, registry:"Registry"):
+        self.name      = name
+        self.value     = 0
+        self._registry = registry
+
+    def inc(self, n:int=1):
+        if self._registry.enabled:
+            self.value += n
+
+
+class Histogram():
+    '''
+    Durations (or any positive integer) in log buckets
+    '''
+    __slots__ = ("name", "buckets", "count", "total", "_registry")
+
+    def __init__(self, name:str, registry:"Registry"):
+        self.name      = name
+        self.buckets   = [0] * BUCKETS
+        self.count     = 0
+        self.total     = 0
+        self._registry = registry
+
+    def start(self) -> int:
+        return time.perf_counter_ns() if self._registry.enabled else 0
+
+    def stop(self, t:int):
+        '''
+        Record the time since start() returned t
+        '''
+        if t:
+            self.observe(time.perf_counter_ns() - t)
+
+    def observe(self, ns:int):
+        if self._registry.enabled:
+            self.buckets[_bucket(ns)] += 1
+            self.count += 1
+            self.total += ns
+
+    def snapshot(self) -> tuple[int, int, list]:
+        return (self.count, self.total, list(self.buckets))
+
+
+def percentile(buckets:list, count:int, q:float) -> float:
+    '''
+    Approximate q'th percentile (0-100) of the values in buckets
+    '''
+    if count == 0:
+        return 0.0
+    rank = q / 100 * count
+    seen = 0
+    for (i, n) in enumerate(buckets):
+        seen += n
+        if n and seen >= rank:
+            return _bucket_value(i)
+    return 0.0
+
+
+class Registry():
+    def __init__(self, enabled:bool=False):
+        self.enabled     = enabled
+        self.counters    = dict()
+        self.histograms  = dict()
+        self.gauges      = dict()
+
+    def counter(self, name:str) -> Counter:
+        if name not in self.counters:
+            self.counters[name] = Counter(name, self)
+        return self.counters[name]
+
+    def histogram(self, name:str) -> Histogram:
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, self)
+        return self.histograms[name]
+
+    def gauge(self, name:str, fn):
+        '''
+        fn() is called for the current value when a summary is made
+        '''
+        self.gauges[name] = fn
+
+    def timed(self, name:str):
+        '''
+        Decorator recording each call's duration in histogram name
+        '''
+        h = self.histogram(name)
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                t = time.perf_counter_ns()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    h.observe(time.perf_counter_ns() - t)
+            return wrapper
+        return decorator
+
+
+class Reporter():
+    '''
+    Every interval seconds log a summary of what was recorded since the
+    last one and hand it, as JSON, to publish() e.g. to send over MQTT.
+
+    Runs on the timer wheel so on the event loop once the wheel is attached
+    '''
+    def __init__(self, registry:Registry, interval:float=60, publish=None, wheel=None):
+        self.registry = registry
+        self.interval = interval
+        self.publish  = publish
+        self.wheel    = timer_wheel.WHEEL if wheel is None else wheel
+        self._last    = dict()
+        self._last_c  = dict()
+        self._last_t  = time.monotonic()
+        self._t       = None
+
+    def start(self):
+        if self._t is not None:
+            return
+        self._last   = {name: h.snapshot() for (name, h) in self.registry.histograms.items()}
+        self._last_c = {name: c.value for (name, c) in self.registry.counters.items()}
+        self._last_t = time.monotonic()
+        self._t      = self.wheel.schedule(self.interval, self.report, name="metrics")
+
+    def stop(self):
+        if self._t is not None:
+            self.wheel.cancel(self._t)
+            self._t = None
+
+    def summary(self) -> dict:
+        '''
+        Counts, rates and percentiles (ms) since the last summary
+        '''
+        now     = time.monotonic()
+        elapsed = max(now - self._last_t, 1e-9)
+        result  = {"period": round(elapsed, 1), "histograms": dict(), "counters": dict(), "gauges": dict()}
+
+        for (name, h) in self.registry.histograms.items():
+            (count, total, buckets) = h.snapshot()
+            (last_count, last_total, last_buckets) = self._last.get(name, (0, 0, [0] * BUCKETS))
+            self._last[name] = (count, total, buckets)
+            n = count - last_count
+            if n == 0:
+                continue
+            delta = [a - b for (a, b) in zip(buckets, last_buckets)]
+            result["histograms"][name] = {
+                "count": n,
+                "mean":  round((total - last_total) / n / 1e6, 3),
+                "p50":   round(percentile(delta, n, 50) / 1e6, 3),
+                "p99":   round(percentile(delta, n, 99) / 1e6, 3),
+            }
+
+        for (name, c) in self.registry.counters.items():
+            n = c.value - self._last_c.get(name, 0)
+            self._last_c[name] = c.value
+            result["counters"][name] = {"total": c.value, "per_sec": round(n / elapsed, 2)}
+
+        for (name, fn) in self.registry.gauges.items():
+            try:
+                result["gauges"][name] = round(float(fn()), 2)
+            except Exception as e:
+                logger.debug("Gauge %s failed: %s", name, e)
+
+        self._last_t = now
+        return result
+
+    def report(self):
+        s = self.summary()
+        logger.info("Metrics over %.0fs: %s", s["period"], format_summary(s))
+        if self.publish is not None:
+            try:
+                self.publish(json.dumps(s))
+            except Exception as e:
+                logger.warning("Cannot publish metrics: %s", e)
+        if self._t is not None:
+            self.wheel.reset(self._t, self.interval)
+
+
+def format_summary(s:dict) -> str:
+    '''
+    One line for the journal
+    '''
+    parts  = [f'{name} n={h["count"]} p50={h["p50"]}ms p99={h["p99"]}ms' for (name, h) in s["histograms"].items()]
+    parts += [f'{name} {c["per_sec"]}/s' for (name, c) in s["counters"].items()]
+    parts += [f'{name}={v}' for (name, v) in s["gauges"].items()]
+    return ", ".join(parts)
+
+
+METRICS = Registry()
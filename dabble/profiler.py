@@ -0,0 +1,167 @@
+'''
+On-demand sampling profiler. While running it samples every thread's
+stack and writes the collapsed stacks for a flame graph, no overhead when
+stopped.
+'''
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Threads blocked waiting end up on top of their stacks here. Left out of
+# the hot functions but kept in the flame graph
+IDLE = {"threading:wait", "selectors:select", "threading:_wait_for_tstate_lock",
+        "asyncio.base_events:_run_once", "queue:get"}
+
+
+@dataclass
+class Profile():
+    '''
+    stacks:   Collapsed stack -> samples
+    samples:  Number of times the threads were sampled
+    path:     Where the collapsed stacks were written, None if not written
+    '''
+    stacks:Counter       = field(default_factory=Counter)
+    samples:int          = 0
+    duration:float       = 0.0
+    path:Path|None       = None
+
+    def top(self, n:int=10) -> list[tuple[str, int, int]]:
+        '''
+        (function, self samples, total samples) for the n functions with
+        the most self samples i.e. on the top of a stack. Threads that
+        are waiting (see IDLE) aren't counted
+        '''
+        own   = Counter()
+        total = Counter()
+        for (stack, count) in self.stacks.items():
+            funcs = stack.split(";")[1:]
+            if not funcs or funcs[-1] in IDLE:
+                continue
+            own[funcs[-1]] += count
+            for f in set(funcs):
+                total[f] += count
+        return [(f, c, total[f]) for (f, c) in own.most_common(n)]
+
+    def summary(self, n:int=10) -> dict:
+        return {
+            "samples":  self.samples,
+            "duration": round(self.duration, 1),
+            "file":     str(self.path) if self.path else None,
+            "top":      [{"function": f, "self": s, "total": t} for (f, s, t) in self.top(n)],
+        }
+
+
+def _frame_name(frame) -> str:
+    code   = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f'{module}:{code.co_name}'
+
+
+class SamplingProfiler():
+    '''
+    interval: Seconds between samples
+    out_dir:  Where to write the collapsed stacks
+    '''
+    def __init__(self, interval:float=0.01, out_dir:Path=Path("profiles")):
+        self.interval = interval
+        self.out_dir  = Path(out_dir)
+        self._t       = None
+        self._stop    = threading.Event()
+        self.last     = None  # Last completed Profile
+
+    @property
+    def running(self) -> bool:
+        return self._t is not None and self._t.is_alive()
+
+    def start(self, seconds:float=30, on_done=None) -> bool:
+        '''
+        Sample for seconds on a thread of its own then call on_done(profile)
+        from that thread. Returns False if already running
+        '''
+        if self.running:
+            logger.info("Profiler already running")
+            return False
+        self._stop.clear()
+        self._t = threading.Thread(target=self._run, args=(seconds, on_done), name="profiler", daemon=True)
+        self._t.start()
+        return True
+
+    def stop(self):
+        '''
+        Finish early, the profile so far is still written
+        '''
+        self._stop.set()
+
+    def sample(self, profile:Profile, names:dict):
+        '''
+        Add one sample of every thread's stack, except ours
+        '''
+        me = threading.get_ident()
+        for (ident, frame) in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident) or f'thread-{ident}')
+            stack.reverse()
+            profile.stacks[";".join(stack)] += 1
+        profile.samples += 1
+
+    def collect(self, seconds:float) -> Profile:
+        '''
+        Sample for seconds (or until stop()) in the calling thread
+        '''
+        logger.info("Profiling for %gs every %gms", seconds, self.interval*1000)
+        profile = Profile()
+        st      = time.monotonic()
+        end     = st + seconds
+        names   = dict()
+        next_sample = st
+        while not self._stop.is_set() and time.monotonic() < end:
+            if profile.samples % 100 == 0:
+                # Threads come and go, don't look them up every sample
+                names = {t.ident: t.name for t in threading.enumerate()}
+            self.sample(profile, names)
+            next_sample += self.interval
+            if (pause := next_sample - time.monotonic()) > 0:
+                self._stop.wait(pause)
+            else:
+                next_sample = time.monotonic()
+        profile.duration = time.monotonic() - st
+        return profile
+
+    def write(self, profile:Profile) -> Path:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        path = self.out_dir / f'dabble-{datetime.now().strftime("%Y%m%d-%H%M%S")}.folded'
+        with open(path, "w") as f:
+            for (stack, count) in profile.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        profile.path = path
+        return path
+
+    def _run(self, seconds:float, on_done):
+        profile = self.collect(seconds)
+        try:
+            self.write(profile)
+        except OSError as e:
+            logger.error("Cannot write profile: %s", e)
+
+        logger.info("Profile: %d samples over %0.1fs written to %s", profile.samples, profile.duration, profile.path)
+        for (func, own, total) in profile.top():
+            logger.info("Profile: %5.1f%% self %5.1f%% total %s",
+                        100*own/max(profile.samples, 1), 100*total/max(profile.samples, 1), func)
+        self.last = profile
+        if on_done is not None:
+            on_done(profile)
+
+
+PROFILER = SamplingProfiler()
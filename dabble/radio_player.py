@@ -1,11 +1,13 @@
 import json
 import logging
+import os
 import re
 import shlex
 import signal
 import subprocess
 import sys
 import time
+from collections import deque
 from copy import copy
 from dataclasses import dataclass, field
 from io import StringIO
@@ -14,10 +16,14 @@ from queue import Empty, Queue
 from string import Template
 from threading import Event, Lock, Thread
 
-from . import radio_stations
+from . import metrics, radio_stations, scanner, supervisor, tuning_cache
 
 logger = logging.getLogger(__name__)
 
+DABLIN_LINE_COUNT = metrics.METRICS.counter("dablin.lines")
+TUNES             = metrics.METRICS.counter("radio.tunes")
+TUNE_TO_DAB       = metrics.METRICS.histogram("radio.tune_to_signal")
+
 @dataclass
 class UpdateState():
     name:str = ""
@@ -26,8 +32,8 @@ class UpdateState():
     empty:bool = True
 
 class MsgUpdates():
-    def __init__(self, lookups):
-        self._keys = lookups.keys()
+    def __init__(self, keys):
+        self._keys = tuple(keys)
         self._values = dict()
         for k in self._keys:
             self._values[k]=UpdateState()
@@ -55,112 +61,272 @@ class MsgUpdates():
     def is_updated(self,k):
         if k in self._values:
             return self._values[k].updated
+
+    def value(self,k):
+        '''
+        Current value of k without marking it as read
+        '''
+        if k in self._values:
+            return self._values[k].value
+        return None
               
+# TODO: Fix upstream in dablin?
+# Dablin adds colour codes to errors (and no new line) when it has decode errors
+# This usually means poor reception 
+# We filter these out so as not to confuse the parser (which it does)
+# However, dablin seems to get confused and things like PTY msgs etc seem to stop
+# https://stackoverflow.com/questions/30425105/filter-special-chars-such-as-color-codes-from-shell-output
+# Colour codes and error counts e.g. (3) are removed in one pass
+ANSI_CODES = re.compile(r'\x1b\[.*?[@-~]|\(\d+\)')
+
+# Bytes in an ETI(NI) frame
+ETI_FRAME_SIZE = 6144
+
+# Keys of the updates passed to the pad update handler
+DABLIN_KEYS = ("dab_type", "prog_type", "pad_label", "media_fmt", "no_signal")
+
+# Lines are dispatched on their first word to one precompiled alternation
+# with a named group per key. FICDecoder/PAD lines are captured for every
+# SId in the ensemble. See RadioPlayer.play for example messages
+DABLIN_LINES = {
+    "FICDecoder:": re.compile(
+        r"FICDecoder: SId (?P<sid>\w+): (?:"
+        r"audio service \(SubChId\s+\d+, (?P<dab_type>.*), primary\)"
+        r"|programme type \(static\): '(?P<prog_type>.*)'"
+        r"|programme service label '(?P<label>.*)' \()"),
+    "PADChangeDynamicLabel": re.compile(
+        r"PADChangeDynamicLabel SId (?P<sid>\w+) Label:'(?P<pad_label>.+)'"),
+    "EnsemblePlayer:": re.compile(
+        r"EnsemblePlayer: format: (?P<media_fmt>.*)"),
+    "There": re.compile(
+        r"There does not seem to be a DAB signal here(?P<no_signal>)"),
+}
+
+def parse_dablin_line(l:str) -> tuple[str|None, str|None, str|None]:
+    '''
+    Match a (cleaned) line of dablin's stderr. Returns (key, sid, value),
+    sid is None for lines that aren't about one service. (None, None, None)
+    if nothing matched.
+    '''
+    pattern = DABLIN_LINES.get(l.split(' ', 1)[0])
+    if pattern is None:
+        # pad_label has no start of line anchor which helps when reception
+        # is challenging and eti_cmdline pumps out errors
+        # TODO: eti_cmdline.... errors confuse log parsing
+        if (i := l.find("PADChange")) < 0:
+            return (None, None, None)
+        l = l[i:]
+        pattern = DABLIN_LINES["PADChangeDynamicLabel"]
+    if (r := pattern.match(l)) is None:
+        return (None, None, None)
+    key = r.lastgroup
+    if key == "no_signal":
+        return (key, None, "no_data")
+    return (key, r.group("sid") if "sid" in pattern.groupindex else None, r.group(key))
+
 class DablinLogParser():
+    '''
+    Consume lines of dablin's stderr from a queue and turn them into
+    updates (PAD, DAB type etc). Blocks on the queue so lines are handled
+    as soon as they arrive. Whatever has queued up meanwhile is parsed as
+    a batch. On an event loop lines are fed in as they are read instead,
+    see begin() and feed()
+    '''
     def __init__(self, q:Queue, e:Event):
         self._q = q
         self._end_task = e
-        self._lookups = dict()
+        self._sid = None
         self._updates_lock = Lock()
         self._recv_errors = 0
         self._updates = None
+        self.lines_parsed = 0
+
+        # Everything heard about each SId in the ensemble, sid -> {key: value}
+        self.services = dict()
 
         # Callback to handle updates
         self.pad_update_handler = None
 
-    def _get_line_from_q(self, recd_threshold:int=200):
-            s=""
-            recd=0
-            # Q returns characters not lines!!
-            for c in self._q.get_nowait():
-                s+=c
-                recd+=1
-                if c=="\n" or recd>recd_threshold:
-                    break
-            if recd>recd_threshold:
-                self._recv_errors+=1
-                logger.error("Log buffer overflowed. Probable reception errors")
-                logger.error("%s",s)
-            # TODO: Fix upstream in dablin?
-            # Dablin adds colour codes to errors (and no new line) when it has decode errors
-            # This usually means poor reception 
-            # We filter these out so as not to confuse the parser (which it does)
-            # However, dablin seems to get confused and things like PTY msgs etc seem to stop
-            # https://stackoverflow.com/questions/30425105/filter-special-chars-such-as-color-codes-from-shell-output
-            s = re.sub(u'\x1b\[.*?[@-~]', '', s)
-            s = re.sub(r'\(\d+\)', '', s)
-            # s = re.sub(r'\x1b(\[.*?[@-~]|\].*?(\x07|\x1b\\))', '', s)
-            logger.debug("Dablin - Line read from q: %s", s)
-            return s
-    
-    def _parse_dablin_output(self):
+    def _clean_line(self, s:str, recd_threshold:int=200) -> str:
         '''
-        Parse the dablin log and run regexs to extract info such as
-        PAD announcements, DAB type etc. See play method for more
-        details.
+        Truncate overlong lines (usually reception errors) and strip
+        colour codes
+        '''
+        if len(s)>recd_threshold:
+            self._recv_errors+=1
+            logger.error("Log line overflowed. Probable reception errors")
+            logger.error("%s",s)
+            s = s[0:recd_threshold+1]
+        s = ANSI_CODES.sub('', s)
+        logger.debug("Dablin - Line read from q: %s", s)
+        return s
+
+    def _parse_line(self, l:str):
+        '''
+        Extract info such as PAD announcements, DAB type etc. Every
+        service's details are kept in services. Returns (key, value) if l
+        is an update for the tuned service, otherwise (None, None)
         '''
+        (k, sid, v) = parse_dablin_line(l)
+        if k is None:
+            return (None, None)
+        if sid is None:
+            return (k, v)
+        sid = sid.lower()
+        with self._updates_lock:
+            self.services.setdefault(sid, dict())[k] = v
+        if sid == self._sid:
+            return (k, v)
+        return (None, None)
+
+    def _get_batch(self) -> list|None:
+        '''
+        Block until a line arrives then take anything else already queued.
+        Returns None when the stream has ended or we've been stopped
+        '''
+        line = self._q.get()
+        if line is None or self._end_task.is_set():
+            return None
+        batch = [line]
         try:
-            l=self._get_line_from_q()
-            for lu in self._lookups:
-                r=self._lookups[lu].search(l)
-                if r:
-                    return ( lu, r.groupdict()['v'] if 'v' in r.groupdict() else "no_data" )
+            while True:
+                line = self._q.get_nowait()
+                if line is None:
+                    self._end_task.set()
+                    break
+                batch.append(line)
         except Empty:
             pass
-        return (None, None)
+        return batch
 
     def stop(self):
         self._end_task.set()
+        # Wake the parser if it is waiting on the queue
+        self._q.put(None)
+
+    def begin(self, sid:str):
+        '''
+        sid is the tuned service, its updates are passed to
+        pad_update_handler
+        '''
+        self._sid = sid.lower()
+        self._updates = MsgUpdates(DABLIN_KEYS)
 
-    def run(self, lookups:dict):
+    @metrics.METRICS.timed("dablin.parse")
+    def feed(self, batch:list[str]):
+        '''
+        Parse lines, passing on any updates for the tuned service
+        '''
+        parsed = [self._parse_line(self._clean_line(l)) for l in batch]
+        self.lines_parsed += len(batch)
+        DABLIN_LINE_COUNT.inc(len(batch))
+
+        for (k,v) in parsed:
+            if k is None:
+                continue
+            logger.debug("k:%s  v:%s", k, v)
+            with self._updates_lock:
+                updated = self._updates.update(k,v)
+            # Callback?
+            if self.pad_update_handler is not None and updated:
+                self.pad_update_handler(self.updates())
+
+    def run(self, sid:str):
+        '''
+        Parse from the queue until the stream ends or stop() is called
+        '''
         logger.info(f'Log reader starts')
-        self._lookups = lookups
-        self._updates = MsgUpdates(self._lookups)
+        self.begin(sid)
         try:
-            while True:
+            while (batch := self._get_batch()) is not None:
+                self.feed(batch)
                 if self._end_task.is_set():
                     break
 
-                have_updates=False
-                with self._updates_lock:
-                    k,v = self._parse_dablin_output()
-                    if k is not None:
-                        logger.debug("k:%s  v:%s", k, v)
-                        have_updates=True
-                        self._updates.update(k,v)
-
-                # Callback?
-                if self.pad_update_handler is not None and have_updates:
-                    self.pad_update_handler(self.updates())
-
-                # Need this pause.
-                time.sleep(0.05)
-
         except KeyboardInterrupt as e:
             pass
+        logger.info(f'Log reader ends')
         return
 
     def updates(self):
         with self._updates_lock:
             return copy(self._updates)
 
+    def service(self, sid:str) -> dict:
+        '''
+        What has been seen for sid e.g. {'dab_type': 'DAB+', 'label': 'Radio X'}
+        '''
+        with self._updates_lock:
+            return dict(self.services.get(sid.lower(), {}))
+
 
 class RadioPlayer():
     def __init__(self, 
                  radio_stations:radio_stations.RadioStations=None,
-                 pad_update_handler:object=None):
-        self.dablin_proc = None
+                 pad_update_handler:object=None,
+                 cached_metadata_handler:object=None,
+                 core:object=None):
         self.playing = "Not Playing Yet"
         self.ensemble=""
         self.channel=""
         self.sid=""
         self.radio_stations = radio_stations
         self.multiplexes = list()
-        # TODO: Parameterise gain (-g). Auto-gain does work but sometimes need to boost
+        # Auto-gain does work but sometimes need to boost. The gain that
+        # worked for a station is kept in the tuning cache
         #self.play_cmdline=Template('/usr/local/bin/dablin -D eti-cmdline -d eti-cmdline-rtlsdr -c $channel -s $sid -I -g 70')
-        self.play_cmdline=Template('/usr/local/bin/dablin -D eti-cmdline -d eti-cmdline-rtlsdr -c $channel -s $sid -g 70')
-        self.scan_cmdline=Template('/usr/local/bin/eti-cmdline-rtlsdr -J -x -C $block -D $scantime -Q')
+        self.play_cmdline=Template('/usr/local/bin/dablin -D eti-cmdline -d eti-cmdline-rtlsdr -c $channel -s $sid -g $gain')
+        self.default_gain=70
+        self.gain=self.default_gain
+
+        # Warm standby: eti-cmdline keeps the tuner on the current channel
+        # and its ETI is piped into dablin, so changing to a station in the
+        # same multiplex only needs a new dablin
+        self.warm_standby=True
+        self.tuner_cmdline=Template('/usr/local/bin/eti-cmdline-rtlsdr -C $channel -G $gain -O -')
+        self.ensemble_cmdline=Template('/usr/local/bin/dablin -s $sid')
+        self._eti_sink=None
+        # Held while the pump writes to _eti_sink and while it is swapped, so
+        # a sink is never closed (and its fd reused) under a write
+        self._eti_lock=Lock()
+        self._switch=None
+        self.switch_latency={"warm": deque(maxlen=20), "cold": deque(maxlen=20)}
+        self.scan_cmdline=Template('/usr/local/bin/eti-cmdline-rtlsdr -J -x -C $block -D $scantime -Q $device_opts')
+        # Scan blocks in parallel over every RTL-SDR plugged in
+        self.scan_devices=list(range(max(1, scanner.count_rtlsdr_devices())))
         self._pad_update_handler = pad_update_handler
+        self.background_rescan = None
+
+        # Last seen metadata for each station, shown as soon as it is tuned
+        self.tuning_cache = tuning_cache.TuningCache()
+        self._cached_metadata_handler = cached_metadata_handler
+        self._tune_st = 0.0
+        self.metadata_latency = dict()  # Seconds from tuning until each key first arrived
+
+        # Start, stop and restart the processes. dablin always gets a stdin
+        # pipe, it is only used with warm_standby. Given the radio's event
+        # loop (core.Core) dablin's output is read and parsed on the loop
+        self._core = core
+        self.dablin_log_parser = None
+        self._t_dablin_log_parser = None
+        self.tuner = supervisor.ProcessSupervisor(
+            "eti-cmdline",
+            self._tuner_cmdline,
+            on_start=self._tuner_started,
+            popen_args={"stdout": subprocess.PIPE, "stderr": subprocess.PIPE})
+        if core is None:
+            self.dablin = supervisor.ProcessSupervisor(
+                "dablin",
+                self._dablin_cmdline,
+                on_start=self._dablin_started,
+                popen_args={"stdin": subprocess.PIPE, "stderr": subprocess.PIPE, "bufsize": 0})
+        else:
+            self.dablin = supervisor.AsyncProcessSupervisor(
+                "dablin",
+                self._dablin_cmdline,
+                loop=core.loop,
+                on_line=self._on_dablin_line,
+                stdin=self._dablin_stdin)
 
     def signal_handler(self, sig, frame):
         print('You pressed Ctrl+C!')
@@ -169,40 +335,171 @@ class RadioPlayer():
         sys.exit(0)
 
     def _read_stream(self, stream, queue:Queue):
+        # dablin may be restarted so this doesn't end the parser, stop() does
         for line in iter(stream.readline, b''):
-            queue.put(line.decode().replace("\n",""))
+            queue.put(line.decode(errors="replace").replace("\n",""))
         stream.close()
 
+    def _tuner_running(self) -> bool:
+        return self.tuner.running
+
+    def _read_tuner_log(self, stream):
+        '''
+        eti-cmdline's messages (e.g. no signal) go to whichever parser is
+        current
+        '''
+        for line in iter(stream.readline, b''):
+            line = line.decode(errors="replace").replace("\n","")
+            if self._core is not None:
+                self._core.call(self._on_dablin_line, line)
+            else:
+                self.dablin_stderr_q.put(line)
+        stream.close()
+
+    def _pump_eti(self, stream):
+        '''
+        Copy ETI frames from eti-cmdline to the current dablin. Whole frames
+        so a new dablin starts on a frame boundary
+        '''
+        while (frame := stream.read(ETI_FRAME_SIZE)):
+            with self._eti_lock:
+                if (sink := self._eti_sink) is None:
+                    continue
+                try:
+                    sink.write(frame)
+                except (BrokenPipeError, ValueError, OSError):
+                    # dablin is being swapped
+                    pass
+        stream.close()
+
+    def _swap_eti_sink(self, sink=None):
+        '''
+        Point the pump at sink and close the old one once the pump has let
+        go of it. The dablin reading the old one must have exited, or a
+        write blocked on it would hold the lock
+        '''
+        with self._eti_lock:
+            (old, self._eti_sink) = (self._eti_sink, sink)
+        if old is not None:
+            old.close()
+
+    @staticmethod
+    def _start_threads(*threads) -> list[Thread]:
+        for t in threads:
+            t.start()
+        return list(threads)
+
+    def _tuner_started(self, proc:subprocess.Popen) -> list[Thread]:
+        return self._start_threads(
+            Thread(target=self._read_tuner_log, args=(proc.stderr,), name="tuner_log", daemon=True),
+            Thread(target=self._pump_eti, args=(proc.stdout,), name="eti_pump", daemon=True))
+
+    def _tuner_cmdline(self) -> list[str]:
+        return shlex.split(self.tuner_cmdline.substitute({
+            "channel":self.channel,
+            "gain": self.gain
+        }))
+
+    def _dablin_cmdline(self) -> list[str]:
+        if self.warm_standby:
+            # Reads ETI from the tuner via stdin
+            cmdline = self.ensemble_cmdline.substitute({"sid": self.sid})
+        else:
+            cmdline = self.play_cmdline.substitute({
+                "channel":self.channel,
+                "sid": self.sid,
+                "gain": self.gain
+            })
+        return shlex.split(cmdline)
+
+    def _dablin_started(self, proc:subprocess.Popen) -> list[Thread]:
+        self._swap_eti_sink(proc.stdin)
+        # Read dablins log and populate q
+        return self._start_threads(
+            Thread(target=self._read_stream, args=(proc.stderr, self.dablin_stderr_q), name="dablin_log", daemon=True))
+
+    def _dablin_stdin(self) -> int|None:
+        '''
+        A new pipe from the ETI pump for each dablin on the event loop.
+        Returns the end dablin reads
+        '''
+        if not self.warm_standby:
+            return None
+        # The last dablin has exited, restarts and starts come after that
+        self._swap_eti_sink()
+        (r, w) = os.pipe()
+        self._swap_eti_sink(open(w, "wb", buffering=0))
+        return r
+
+    def _on_dablin_line(self, line:str):
+        if (parser := self.dablin_log_parser) is not None:
+            parser.feed([line])
+
+    def _stop_dablin(self):
+        # Stop dablin first so a write blocked on its pipe fails and lets go
+        self.dablin.stop()
+        self._swap_eti_sink()
+        logger.info("dablin: %s", self.dablin.stats())
+        self.dablin_log_parser.stop()
+        if self._t_dablin_log_parser is not None:
+            self._t_dablin_log_parser.join()
+            self._t_dablin_log_parser = None
+        self._cache_ensemble()
+
+    @metrics.METRICS.timed("radio.tune")
     def play(self,name) -> bool:
         logger.info("Player starting")
-
-        self.dablin_stderr_q = Queue()
-        self._stop_log_parser_event = Event()
-        self.dablin_log_parser = DablinLogParser(self.dablin_stderr_q,  self._stop_log_parser_event)
-        self.dablin_log_parser.pad_update_handler = self._pad_update_handler
+        switch_st = time.monotonic()
 
         self._recv_errors=0
         self.playing = name
 
-        if (station_details:=self.radio_stations.tuning_details(name)) is not None:
-            logger.info("Station details: %s", station_details)
-            (self.channel, self.sid, self.ensemble) = station_details
-        else:
+        if (station_details:=self.radio_stations.tuning_details(name)) is None:
             # Name of station wrong/not found. This should not happen
             logger.warn("Station name error: %s", name)
             return False
+        logger.info("Station details: %s", station_details)
+
+        # Same multiplex and the tuner is running? Only dablin needs changing
+        warm = self.warm_standby and station_details[0] == self.channel and self._tuner_running()
+        if warm:
+            logger.info("Switching service in place on %s", self.channel)
+            if self.dablin.active:
+                self._stop_dablin()
+        else:
+            if self.dablin.active or self.tuner.active:
+                self.stop()
+            # dablin needs the tuner
+            if self.background_rescan is not None:
+                self.background_rescan.yield_tuner()
+        (self.channel, self.sid, self.ensemble) = station_details
 
-        # This is run in parallel so will not block
+        self.dablin_stderr_q = Queue()
+        self._stop_log_parser_event = Event()
+        self.dablin_log_parser = DablinLogParser(self.dablin_stderr_q,  self._stop_log_parser_event)
+        self.dablin_log_parser.pad_update_handler = self._on_updates
+        if self._core is not None:
+            # Fed on the loop as dablin's lines are read
+            self.dablin_log_parser.begin(self.sid)
+
+        # Show what we saw last time while dablin catches up
+        self._tune_st = switch_st
+        self._switch = "warm" if warm else "cold"
+        self.metadata_latency = dict()
+        cached = self.tuning_cache.get(self.channel, self.sid)
+        self.gain = cached.get("gain", self.default_gain)
+        if cached:
+            logger.info("Cached metadata: %s", cached)
+            if self._cached_metadata_handler is not None:
+                self._cached_metadata_handler(cached)
+            self.metadata_latency["cached"] = time.monotonic() - self._tune_st
+
+        # These are run in parallel so will not block
         # Sound sent straight to sound card via SDL
-        self.dablin_proc=subprocess.Popen(
-            shlex.split(
-                self.play_cmdline.substitute({
-                    "channel":self.channel,
-                    "sid": self.sid
-                })
-            ),
-            stderr=subprocess.PIPE
-        )
+        if self.warm_standby and not warm:
+            logger.info("Starting tuner on %s", self.channel)
+            self.tuner.start()
+        self.dablin.start()
         '''
         Messages from dablin/eti_cmdline:
 
@@ -216,35 +513,71 @@ class RadioPlayer():
         PADChangeDynamicLabel SId 0xC4CD Label:'Radio X - Get Into the Music'
         PADChangeDynamicLabel SId 0xC4CD Label:'On Air Now on Radio X: Dan Gasser'        
         '''
-        # pad_label removed start_of_line anchor which may help when reception is challanging and eti_cmdline
-        # pumps out errors
-        # TODO: eti_cmdline.... errors confuse log parsing
-        self.dablin_stderr_lookups = {
-            "dab_type":  re.compile(f"^FICDecoder: SId {self.sid}: audio service \(SubChId\s+\d+, (?P<v>.*), primary\)", re.IGNORECASE),
-            "prog_type": re.compile(f"^FICDecoder: SId {self.sid}: programme type \(static\): '(?P<v>.*)'", re.IGNORECASE),
-            "pad_label": re.compile(f"PADChangeDynamicLabel SId {self.sid} Label:'(?P<v>.+)'", re.IGNORECASE),
-            "media_fmt": re.compile(f"^EnsemblePlayer: format: (?P<v>.*)", re.IGNORECASE),
-            "no_signal": re.compile(f"^There does not seem to be a DAB signal here", re.IGNORECASE)
-        }
-        # Read dablins log files and populate q
-        logger.info("Starting dablin log reader thread")
-        self._t_dablin_log_reader=Thread(target=self._read_stream, args=(self.dablin_proc.stderr, self.dablin_stderr_q,))
-        self._t_dablin_log_reader.start()
-
         # Consume q and post updates back to main UI
-        logger.info("Starting dablin log parser thread")
-        self._t_dablin_log_parser=Thread(target=self.dablin_log_parser.run, args=(self.dablin_stderr_lookups,))
-        self._t_dablin_log_parser.start()
+        if self._core is None:
+            logger.info("Starting dablin log parser thread")
+            self._t_dablin_log_parser=Thread(target=self.dablin_log_parser.run, args=(self.sid,))
+            self._t_dablin_log_parser.start()
 
+        TUNES.inc()
         logger.info("Player playing")
         return True
 
+    def _on_updates(self, updates:MsgUpdates):
+        '''
+        Note when metadata first arrives and cache it, then pass the
+        updates on to the UI
+        '''
+        for k in ("dab_type", "prog_type", "media_fmt"):
+            if k not in self.metadata_latency and updates.value(k):
+                self.metadata_latency[k] = time.monotonic() - self._tune_st
+                logger.info("Tune to first %s: %0.2fs", k, self.metadata_latency[k])
+                if k == "dab_type":
+                    TUNE_TO_DAB.observe(int(self.metadata_latency[k]*1e9))
+                values = {k: updates.value(k)}
+                if k == "dab_type":
+                    # Have a signal so the gain is good
+                    values["gain"] = self.gain
+                self.tuning_cache.update(self.channel, self.sid, **values)
+                self.tuning_cache.save()
+
+                # Audio is playing once dablin knows the format
+                if k == "media_fmt":
+                    for p in (self.tuner, self.dablin):
+                        if p.active:
+                            p.mark_audio()
+                if k == "media_fmt" and self._switch is not None:
+                    self.switch_latency[self._switch].append(self.metadata_latency[k])
+                    logger.info("Switch (%s) to %s: %0.2fs. %s", self._switch, self.playing,
+                                self.metadata_latency[k], self.switch_summary())
+                    self._switch = None
+
+        if self._pad_update_handler is not None:
+            self._pad_update_handler(updates)
+
+    def _cache_ensemble(self):
+        '''
+        dablin reports every service in the ensemble, cache them all
+        '''
+        for sid, values in self.dablin_log_parser.services.copy().items():
+            self.tuning_cache.update(self.channel, sid, **values)
+        self.tuning_cache.save()
+
+    def switch_summary(self) -> str:
+        '''
+        Average time from play() to audio for in place (warm) and full
+        (cold) station changes
+        '''
+        return ", ".join(f'{k} {sum(v)/len(v):0.2f}s ({len(v)})' if v else f'{k} -'
+                         for k, v in self.switch_latency.items())
+
     def stop(self):
         self.currently_playing = None
-        if self.dablin_proc is not None:
-            self.dablin_proc.terminate()
-            self.dablin_log_parser.stop()
-        time.sleep(1)
+        if self.dablin.active:
+            self._stop_dablin()
+        if self.tuner.active:
+            self.tuner.stop()
+            logger.info("eti-cmdline: %s", self.tuner.stats())
 
     """
     def _get_line_from_q(self, recd_threshold:int=200):
@@ -299,46 +632,62 @@ class RadioPlayer():
 
         # Cant scan while RTLSDR is in use
         self.stop()
-
-        stations=dict()
+        if self.background_rescan is not None:
+            self.background_rescan.pause()
 
         # Get multiplex blocks
         self.load_multiplexes()
-        for block in sorted(self.multiplexes):
-            print("Scanning", block)
+        scheduler = scanner.ScanScheduler(self.scan_cmdline, devices=self.scan_devices, scantime=8)
+        results = dict()
+        for r in scheduler.scan(sorted(self.multiplexes)):
+            results[r.block] = r
             if ui_msg_callback is not None:
-                ui_msg_callback(ui, f'Scanning {block}')
-
-            self.dablin_proc=subprocess.run(shlex.split(
-                self.scan_cmdline.substitute({
-                    "block":block,
-                    "scantime": 8
-                }))
-            )
-            
-            ensemble_file = Path(f'ensemble-ch-{block}.json')
-            if ensemble_file.exists():
-                with open(ensemble_file, 'r') as jfile:
-                    data = json.load(jfile)
-                    ui_msg_callback(ui, "Done", sub_msg=f"{data['ensemble']} {len(data['stations'])} stations")
-                    for s,sid in data['stations'].items():
-                        if s not in stations:
-                            stations[s]={ 'sid':sid, 'ensemble':data['ensemble'], 'channel':data['channel'] }
-                        else:
-                            stations[s + " " + data['ensemble'] ]={ 'sid':sid, 'ensemble':data['ensemble'], 'channel':data['channel'] }                  
-            else:
-                ui_msg_callback(ui, f'No stations')    
+                if r.stations:
+                    ui_msg_callback(ui, f'Scanned {r.block}', sub_msg=f"{r.ensemble} {len(r.stations)} stations")
+                else:
+                    ui_msg_callback(ui, f'Scanned {r.block}', sub_msg="No stations")
+
+            # Keep the station list up to date as blocks finish
+            self.save_stations(scanner.merge_results(results))
 
-            time.sleep(1)
+        self.radio_stations.load_stations()
+        if self.background_rescan is not None:
+            self.background_rescan.resume()
 
         if ui_msg_callback is not None:
-            ui_msg_callback(ui, f'Storing Data')
+            ui_msg_callback(ui, f'Found {self.radio_stations.total_stations} stations')
 
-        with open("station-list.json","w") as s:
-            json.dump(stations,s)
+    def start_background_rescan(self, idle, interval:float=60.0):
+        '''
+        Keep the station list fresh by rescanning a block at a time. Uses a
+        spare RTL-SDR if there is one, otherwise only scans while idle()
+        e.g. in standby
+        '''
+        self.load_multiplexes()
+        scheduler = scanner.ScanScheduler(self.scan_cmdline, devices=self.scan_devices[-1:], scantime=8)
+        self.background_rescan = scanner.BackgroundRescan(
+            scheduler, self.multiplexes, on_result=self._merge_rescan, idle=idle, interval=interval)
+        self.background_rescan.start()
 
+    def _merge_rescan(self, result:scanner.BlockResult):
+        '''
+        Merge a background rescan of a block into the station list and
+        reload it. dablin keeps playing
+        '''
+        (stations, added, removed) = scanner.merge_block(self.radio_stations.stations, result)
+        if not added and not removed:
+            return
+        logger.info("Rescan of %s added %s removed %s", result.block, added, removed)
+        self.save_stations(stations)
         self.radio_stations.load_stations()
+        self.background_rescan.block_changed(result.block)
 
-        if ui_msg_callback is not None:
-            ui_msg_callback(ui, f'Found {self.radio_stations.total_stations} stations')
-    
+    def save_stations(self, stations:dict):
+        '''
+        Write station-list.json. Written to a temp file first so a reader
+        never sees half a list
+        '''
+        tmp = Path("station-list.json.tmp")
+        with open(tmp,"w") as s:
+            json.dump(stations,s)
+        tmp.replace("station-list.json")
@@ -13,11 +13,13 @@ class RadioStations():
         
     def load_stations(self):
         try:
+            # May be reloaded after a background rescan so build the new
+            # list before swapping it in
             with open("station-list.json") as j:
-                self.stations = json.load(j)
-            self.station_list=sorted(list(self.stations.keys()))
-            self.station_list_index={ s:i for i,s in enumerate(self.station_list) }
-            self.total_stations = len(self.station_list)
+                stations = json.load(j)
+            station_list=sorted(list(stations.keys()))
+            (self.stations, self.station_list, self.station_list_index, self.total_stations) = \
+                (stations, station_list, { s:i for i,s in enumerate(station_list) }, len(station_list))
         except FileNotFoundError as e:
             logging.warn("No radio stations found")
             raise exceptions.NoRadioStations(e)
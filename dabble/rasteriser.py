@@ -0,0 +1,146 @@
+'''
+NumPy rasterisers for the visualisers. Each builds the visualiser area as
+one uint8 RGB array to paste into the LCD image, rather than an ImageDraw
+call per column.
+'''
+import functools
+import numpy as np
+from PIL import Image, ImageColor
+
+
+@functools.lru_cache(maxsize=64)
+def rgb(colour:str) -> tuple[int,int,int]:
+    '''
+    Convert a theme colour e.g. '#8ECAE6' or 'black' to an RGB tuple
+    '''
+    return ImageColor.getrgb(colour)[0:3]
+
+
+class VizFrame():
+    '''
+    Preallocated RGB buffer for the visualiser area of the screen.
+
+    Row 0 is the top of the area, row height-1 the base line.
+    '''
+    def __init__(self, width:int, height:int):
+        self.width   = width
+        self.height  = height
+        self.buf     = np.zeros((height, width, 3), dtype=np.uint8)
+        # Row and column indexes used to build masks and fancy index
+        self.rows    = np.arange(height)[:, np.newaxis]
+        self.columns = np.arange(width)
+
+    def clear(self):
+        self.buf.fill(0)
+
+    def paste(self, img:Image.Image, y:int, x:int=0):
+        '''
+        Copy the buffer into img with its top left corner at (x,y)
+        '''
+        img.paste(Image.fromarray(self.buf, mode="RGB"), (x, y))
+
+
+def column_heights(columns:np.ndarray, scale:float, height:int) -> np.ndarray:
+    '''
+    Scale the magnitude of each pixel column to a pixel height (0..height)
+    '''
+    heights = (columns * scale).astype(np.int64)
+    return np.clip(heights, 0, height, out=heights)
+
+
+def graphic_equaliser(frame:VizFrame, heights:np.ndarray, peaks:np.ndarray,
+                      line_rgb:tuple, dot_rgb:tuple, fall_decay:int=2):
+    '''
+    Rasterise columns of heights pixels with a dot on top, plus falling
+    peak-hold dots. peaks is updated in place.
+    '''
+    base = frame.height - 1
+    buf  = frame.buf
+    frame.clear()
+
+    # Column fill: every row at or below the top of the column
+    tops = base - heights
+    buf[frame.rows >= tops] = line_rgb
+    buf[tops, frame.columns] = dot_rgb
+
+    # Peak hold dots, decay only the ones still visible
+    np.maximum(peaks, heights, out=peaks)
+    visible = peaks > 0
+    buf[base - peaks[visible].astype(np.int64), frame.columns[visible]] = dot_rgb
+    peaks[visible] -= fall_decay
+
+
+def band_values(spectrum:np.ndarray, num_bars:int) -> np.ndarray:
+    '''
+    Aggregate spectrum into num_bars equal bands with one reshape and reduce.
+    Bands use the max magnitude except the first (bass) which uses the mean
+    as it looks better. Any remainder bins are dropped.
+    '''
+    bin_size = len(spectrum) // num_bars
+    bands    = spectrum[0:num_bars*bin_size].reshape(num_bars, bin_size)
+    values   = bands.max(axis=1)
+    values[0] = bands[0].mean()
+    return values
+
+
+@functools.lru_cache(maxsize=8)
+def bar_columns(width:int, num_bars:int, bar_width:int) -> tuple[np.ndarray,np.ndarray]:
+    '''
+    For each pixel column return the bar it belongs to and whether it is
+    drawn. The last column of each bar is left as a gap.
+    '''
+    columns = np.arange(width)
+    bar     = columns // bar_width
+    drawn   = ((columns % bar_width) <= bar_width - 2) & (bar < num_bars)
+    bar     = np.minimum(bar, num_bars - 1)
+    bar.flags.writeable   = False
+    drawn.flags.writeable = False
+    return (bar, drawn)
+
+
+def graphic_equaliser_bars(frame:VizFrame, heights:np.ndarray, peaks:np.ndarray, bar_width:int,
+                           line_rgb:tuple, dot_rgb:tuple, fall_decay:int=3):
+    '''
+    Rasterise one bar per entry of heights, bar_width pixels apart, plus a
+    falling peak-hold line above each. peaks is updated in place.
+    '''
+    base = frame.height - 1
+    buf  = frame.buf
+    (bar, drawn) = bar_columns(frame.width, len(heights), bar_width)
+    frame.clear()
+
+    # Gap columns get a top below the base line so nothing is filled
+    column_heights = np.where(drawn, heights[bar], -1)
+    buf[frame.rows >= base - column_heights] = line_rgb
+
+    np.maximum(peaks, heights, out=peaks)
+    visible = peaks > 0
+    columns = drawn & visible[bar]
+    buf[base - peaks[bar[columns]], frame.columns[columns]] = dot_rgb
+    peaks[visible] -= fall_decay
+
+
+def waveform(frame:VizFrame, lo:np.ndarray, hi:np.ndarray, amplitude:float,
+             line_rgb:tuple, dot_rgb:tuple):
+    '''
+    Rasterise a waveform envelope about the centre row: each column is
+    filled from lo to hi with a dot at both ends. amplitude maps to one
+    row inside the top and bottom of the frame.
+    '''
+    centre = (frame.height - 1) // 2
+    buf    = frame.buf
+    frame.clear()
+    if amplitude <= 0.0:
+        amplitude = 0.001
+    scale   = (centre - 1) / amplitude
+    columns = frame.columns[0:min(frame.width, len(hi))]
+
+    tops    = centre - (hi[0:len(columns)] * scale).astype(np.int64)
+    bottoms = centre - (lo[0:len(columns)] * scale).astype(np.int64)
+    np.clip(tops, 0, frame.height - 1, out=tops)
+    np.clip(bottoms, 0, frame.height - 1, out=bottoms)
+
+    area = buf[:, 0:len(columns)]
+    area[(frame.rows >= tops) & (frame.rows <= bottoms)] = line_rgb
+    area[tops, columns] = dot_rgb
+    area[bottoms, columns] = dot_rgb
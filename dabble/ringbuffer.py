@@ -0,0 +1,89 @@
+'''
+Lock free ring buffer for captured audio.
+
+One producer (the PortAudio callback) and one consumer (the analysis
+thread). The producer never waits on the consumer: it writes the frames
+then publishes them by bumping the write position and sequence counter.
+Python's GIL makes those single attribute updates atomic.
+
+Every frame is written twice, at i and i+capacity, so the last N frames
+are always contiguous and can be handed out as a view without copying.
+'''
+import numpy as np
+
+
+class RingBuffer():
+    '''
+    Ring of interleaved audio frames.
+
+    capacity: Frames held. A view of the last N frames stays valid until
+              another capacity-N frames have been written, so make it a
+              few chunks bigger than what readers ask for.
+    channels: Interleaved channels per frame
+    '''
+    def __init__(self, capacity:int, channels:int=2, dtype=np.int32):
+        self.capacity = capacity
+        self.channels = channels
+        self._buf     = np.zeros((2 * capacity, channels), dtype=dtype)
+        self._written = 0  # Total frames written
+        self.seq      = 0  # Writes so far. Changes when there is new data
+
+    def write(self, data:np.ndarray):
+        '''
+        Append interleaved frames. Producer side only
+        '''
+        frames = data.reshape(-1, self.channels)
+        if len(frames) > self.capacity:
+            frames = frames[-self.capacity:]
+        n   = len(frames)
+        pos = self._written % self.capacity
+
+        # Copy into both halves, splitting if it wraps
+        first = min(n, self.capacity - pos)
+        for offset in (0, self.capacity):
+            self._buf[offset + pos:offset + pos + first] = frames[0:first]
+            if first < n:
+                self._buf[offset:offset + n - first] = frames[first:]
+
+        # Publish
+        self._written += n
+        self.seq += 1
+
+    def latest(self, n:int, since_seq:int=-1) -> tuple[int, np.ndarray]|None:
+        '''
+        Zero copy view of the last n frames, interleaved, and the sequence
+        number it was taken at. Returns None if nothing new has been written
+        since since_seq. Consumer side only
+        '''
+        seq     = self.seq
+        written = self._written
+        if seq == since_seq:
+            return None
+        n   = min(n, self.capacity)
+        end = written % self.capacity + self.capacity
+        return (seq, self._buf[end - n:end].reshape(-1))
+
+    def window(self, n:int, end:int) -> np.ndarray|None:
+        '''
+        Zero copy view of the n frames before frame end, counting from the
+        first frame written. None if they haven't all been written yet or
+        have since been overwritten. Consumer side only
+        '''
+        written = self._written
+        if n > self.capacity or end > written or end - n < max(written - self.capacity, 0):
+            return None
+        e = end % self.capacity + self.capacity
+        return self._buf[e - n:e].reshape(-1)
+
+    @property
+    def written(self) -> int:
+        '''
+        Frames written so far
+        '''
+        return self._written
+
+    def available(self) -> int:
+        '''
+        Frames held, up to capacity
+        '''
+        return min(self._written, self.capacity)
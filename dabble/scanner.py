@@ -0,0 +1,430 @@
+'''
+Scan DAB blocks for stations with eti-cmdline.
+
+A scan runs eti-cmdline once per block. Each run holds an RTL-SDR dongle
+for the whole dwell, so with more than one dongle plugged in the blocks
+are spread over them: one worker per device index takes the next block
+off a shared queue. Results are handed back as each block finishes so the
+station list can be built up as the scan goes.
+
+Blocks don't all need the same dwell. eti-cmdline's output is watched
+while it runs: a block is dropped as soon as it reports no signal, and
+finished as soon as the ensemble JSON is complete. Only blocks where a
+signal was seen are given more time if they haven't finished by then.
+
+eti-cmdline is only run as a subprocess so fake-eti-cmdline.py can stand in
+for it on a machine without an SDR.
+'''
+import json
+import logging
+import re
+import shlex
+import subprocess
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from queue import Empty, Queue
+from string import Template
+from threading import Event, Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+# USB vendor:product ids of RTL2832U based dongles
+RTLSDR_USB_IDS = {("0bda", "2832"), ("0bda", "2838")}
+
+# What eti-cmdline says when a block is empty, or when there's something there
+NO_SIGNAL      = re.compile(r"no (dab )?signal|does not seem to be a DAB signal", re.IGNORECASE)
+SIGNAL_PRESENT = re.compile(r"might be a DAB signal|ensemble .* (recognized|detected)|SId", re.IGNORECASE)
+
+
+def count_rtlsdr_devices(usb_devices:Path=Path("/sys/bus/usb/devices")) -> int:
+    '''
+    Number of RTL-SDR dongles plugged in, from sysfs
+    '''
+    count = 0
+    for d in usb_devices.glob("*"):
+        try:
+            usb_id = ((d / "idVendor").read_text().strip(), (d / "idProduct").read_text().strip())
+        except OSError:
+            continue
+        if usb_id in RTLSDR_USB_IDS:
+            count += 1
+    return count
+
+
+@dataclass
+class BlockResult():
+    block:str
+    device:int          = 0
+    ensemble:str        = ""
+    channel:str         = ""
+    stations:dict       = field(default_factory=dict)  # Station name -> SId
+    elapsed:float       = 0.0                          # Seconds the block took
+    outcome:str         = ""                           # Why the block finished, see ScanScheduler
+
+
+class ScanScheduler():
+    '''
+    Run eti-cmdline over blocks, one at a time per device.
+
+    cmdline:       Template with $block, $scantime and $device_opts
+    devices:       RTL-SDR device indexes to use
+    scantime:      Seconds to dwell on a block with no sign of a signal
+    max_scantime:  Seconds to dwell on a block with a weak signal. This is
+                   the $scantime eti-cmdline is given
+    device_option: eti-cmdline option to select a device. Not passed for
+                   device 0, eti-cmdline's default
+    settle:        Seconds to leave a device before its next block
+
+    A block's outcome is one of:
+        no_signal: eti-cmdline reported no signal
+        complete:  the ensemble JSON was written
+        exited:    eti-cmdline finished by itself
+        empty:     nothing seen within scantime
+        timeout:   a signal was seen but no ensemble within max_scantime
+        aborted:   abort was set, e.g. the tuner is needed to play
+    '''
+    def __init__(self,
+                 cmdline:Template,
+                 devices:list[int]=(0,),
+                 scantime:int=8,
+                 max_scantime:int=16,
+                 device_option:str="-d",
+                 settle:float=1.0):
+        self.cmdline       = cmdline
+        self.devices       = list(devices)
+        self.scantime      = scantime
+        self.max_scantime  = max(scantime, max_scantime)
+        self.device_option = device_option
+        self.settle        = settle
+
+        # Set to stop the block being scanned
+        self.abort         = Event()
+
+        # Results of the last scan, block -> BlockResult
+        self.results       = dict()
+        self.scan_time     = 0.0
+
+    def _read_output(self, stream, lines:Queue):
+        for line in iter(stream.readline, b''):
+            lines.put(line.decode(errors="replace").strip())
+        stream.close()
+        lines.put(None)
+
+    @staticmethod
+    def _ensemble_complete(ensemble_file:Path) -> dict|None:
+        '''
+        The ensemble JSON if it has been completely written
+        '''
+        try:
+            with open(ensemble_file, 'r') as jfile:
+                data = json.load(jfile)
+            if 'stations' in data:
+                return data
+        except (OSError, json.JSONDecodeError):
+            pass
+        return None
+
+    def _watch(self, proc:subprocess.Popen, ensemble_file:Path, poll:float=0.1) -> str:
+        '''
+        Follow eti-cmdline's output until there's no point carrying on.
+        Returns the outcome
+        '''
+        lines  = Queue()
+        reader = Thread(target=self._read_output, args=(proc.stdout, lines), daemon=True)
+        reader.start()
+
+        t1 = time.monotonic()
+        signal_seen = False
+        outcome = None
+        while outcome is None:
+            try:
+                line = lines.get(timeout=poll)
+                if line is None:
+                    outcome = "exited"
+                elif NO_SIGNAL.search(line):
+                    outcome = "no_signal"
+                elif not signal_seen and SIGNAL_PRESENT.search(line):
+                    logger.debug("Signal on %s: %s", ensemble_file, line)
+                    signal_seen = True
+            except Empty:
+                pass
+
+            elapsed = time.monotonic() - t1
+            if outcome is not None:
+                pass
+            elif self.abort.is_set():
+                outcome = "aborted"
+            elif self._ensemble_complete(ensemble_file) is not None:
+                outcome = "complete"
+            elif elapsed >= self.max_scantime + 5:
+                outcome = "timeout"
+            elif not signal_seen and elapsed >= self.scantime:
+                outcome = "empty"
+
+        if proc.poll() is None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        reader.join(timeout=1)
+        return outcome
+
+    def scan_block(self, block:str, device:int) -> BlockResult:
+        '''
+        Scan one block on device
+        '''
+        result = BlockResult(block=block, device=device)
+        device_opts = f'{self.device_option} {device}' if device != 0 else ""
+        cmd = shlex.split(self.cmdline.substitute({
+            "block":       block,
+            "scantime":    self.max_scantime,
+            "device_opts": device_opts,
+        }))
+
+        # Don't pick up what an earlier scan found
+        ensemble_file = Path(f'ensemble-ch-{block}.json')
+        ensemble_file.unlink(missing_ok=True)
+
+        t1 = time.monotonic()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        result.outcome = self._watch(proc, ensemble_file)
+        result.elapsed = time.monotonic() - t1
+
+        if (data := self._ensemble_complete(ensemble_file)) is not None:
+            try:
+                result.ensemble = data['ensemble']
+                result.channel  = data['channel']
+                result.stations = data['stations']
+            except KeyError as e:
+                logger.error("Bad scan results for %s: %s", block, e)
+        logger.info("Scanned %s on device %d in %0.1fs (%s): %d stations",
+                    block, device, result.elapsed, result.outcome, len(result.stations))
+        return result
+
+    def _worker(self, device:int, blocks:Queue, results:Queue):
+        while True:
+            try:
+                block = blocks.get_nowait()
+            except Empty:
+                break
+            try:
+                results.put(self.scan_block(block, device))
+            except Exception as e:
+                logger.error("Scan of %s on device %d failed: %s", block, device, e)
+                results.put(BlockResult(block=block, device=device))
+            if not blocks.empty():
+                time.sleep(self.settle)
+
+    def scan(self, blocks:list[str]):
+        '''
+        Scan blocks, yielding a BlockResult for each as it finishes
+        '''
+        todo    = Queue()
+        results = Queue()
+        for b in blocks:
+            todo.put(b)
+        self.results = dict()
+        t1 = time.monotonic()
+
+        workers = [Thread(target=self._worker, args=(d, todo, results), name=f'scan_{d}', daemon=True)
+                   for d in self.devices[0:max(1, len(blocks))]]
+        logger.info("Scanning %d blocks with %d devices", len(blocks), len(workers))
+        for w in workers:
+            w.start()
+        for _ in blocks:
+            r = results.get()
+            self.results[r.block] = r
+            yield r
+        for w in workers:
+            w.join()
+        self.scan_time = time.monotonic() - t1
+        logger.info("Scan: %s", self.summary())
+
+    def summary(self) -> str:
+        '''
+        How long the last scan took against a fixed dwell on every block
+        '''
+        outcomes = dict()
+        for r in self.results.values():
+            outcomes[r.outcome] = outcomes.get(r.outcome, 0) + 1
+        dwell = sum(r.elapsed for r in self.results.values())
+        fixed = len(self.results) * self.scantime / max(1, len(self.devices))
+        return (f'{len(self.results)} blocks in {self.scan_time:.1f}s '
+                f'(block time {dwell:.1f}s, fixed {self.scantime}s dwell ~{fixed:.0f}s) '
+                + ", ".join(f'{k}:{v}' for k, v in sorted(outcomes.items())))
+
+
+def merge_results(results:dict[str,BlockResult]) -> dict:
+    '''
+    Build the station list from block results. Blocks are merged in order
+    so names are the same however the scan was scheduled. Stations with
+    the same name in another ensemble get the ensemble added.
+    '''
+    stations = dict()
+    for block in sorted(results):
+        r = results[block]
+        for s, sid in r.stations.items():
+            if s in stations:
+                s = s + " " + r.ensemble
+            stations[s] = { 'sid':sid, 'ensemble':r.ensemble, 'channel':r.channel }
+    return stations
+
+
+def merge_block(stations:dict, result:BlockResult) -> tuple[dict, list, list]:
+    '''
+    Apply one block's result to a station list as a diff. Services are
+    matched on SId. Returns the new list and the names added and removed.
+    Blocks where no ensemble was found are left alone, it may only be
+    poor reception.
+    '''
+    if not result.stations:
+        return (stations, [], [])
+
+    found   = {sid.lower() for sid in result.stations.values()}
+    known   = {d['sid'].lower(): s for s, d in stations.items() if d['channel'] == result.block}
+    removed = [s for sid, s in known.items() if sid not in found]
+    added   = []
+
+    stations = {s: d for s, d in stations.items() if s not in removed}
+    for s, sid in result.stations.items():
+        if sid.lower() in known:
+            continue
+        if s in stations:
+            s = s + " " + result.ensemble
+        stations[s] = { 'sid':sid, 'ensemble':result.ensemble, 'channel':result.channel }
+        added.append(s)
+    return (stations, added, removed)
+
+
+class BackgroundRescan():
+    '''
+    Rescan one block at a time in the background, without stopping play.
+
+    With a spare tuner (a device other than 0, which dablin plays from)
+    blocks are scanned whenever they are due. Otherwise blocks are only
+    scanned while idle() is True, e.g. in standby, and yield_tuner() must
+    be called before playing.
+
+    Blocks that changed recently are rescanned more often.
+
+    scheduler: ScanScheduler used to scan each block
+    blocks:    Blocks to cycle through
+    on_result: Called with each BlockResult
+    idle:      Returns True when the tuner isn't needed
+    interval:  Seconds between blocks
+    '''
+    # Blocks that changed within this many seconds are rescanned this much more often
+    RECENT_CHANGE  = 24*60*60
+    CHANGED_WEIGHT = 4
+
+    def __init__(self,
+                 scheduler:ScanScheduler,
+                 blocks:list[str],
+                 on_result,
+                 idle=lambda: False,
+                 interval:float=60.0):
+        self.scheduler    = scheduler
+        self.blocks       = sorted(blocks)
+        self.on_result    = on_result
+        self.idle         = idle
+        self.interval     = interval
+        self.device       = scheduler.devices[-1]
+        self.spare_tuner  = self.device != 0
+
+        now = time.monotonic()
+        self.last_scanned = {b: now for b in self.blocks}
+        self.last_changed = dict()
+        self.blocks_scanned = 0
+
+        self._end_task    = Event()
+        self._paused      = False
+        self._tuner_free  = Event()
+        self._tuner_free.set()
+        self._thread      = None
+
+        # Held while a pass decides whether to take the tuner, so a yield,
+        # pause or stop either stops the pass starting or aborts its scan.
+        # A yield is remembered until a pass has seen it
+        self._claim           = Lock()
+        self._yield_requested = False
+
+    def block_changed(self, block:str):
+        self.last_changed[block] = time.monotonic()
+
+    def next_block(self) -> str:
+        '''
+        Block most overdue for a rescan. Recently changed blocks become due
+        sooner
+        '''
+        now = time.monotonic()
+        def priority(b):
+            weight = self.CHANGED_WEIGHT if now - self.last_changed.get(b, -self.RECENT_CHANGE) < self.RECENT_CHANGE else 1
+            return (now - self.last_scanned[b]) * weight
+        return max(self.blocks, key=priority)
+
+    def yield_tuner(self):
+        '''
+        Stop any scan using the tuner dablin plays from and wait until it
+        has finished
+        '''
+        if self.spare_tuner:
+            return
+        with self._claim:
+            self._yield_requested = True
+            self.scheduler.abort.set()
+        self._tuner_free.wait()
+
+    def pause(self):
+        '''
+        Stop rescanning until resume(), e.g. for a full scan
+        '''
+        with self._claim:
+            self._paused = True
+            self.scheduler.abort.set()
+        self._tuner_free.wait()
+
+    def resume(self):
+        self._paused = False
+
+    def start(self):
+        logger.info("Background rescan on device %d (%s)", self.device,
+                    "spare tuner" if self.spare_tuner else "when idle")
+        self._thread = Thread(target=self._run, name="rescan", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._claim:
+            self._end_task.set()
+            self.scheduler.abort.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._end_task.wait(self.interval):
+            with self._claim:
+                # The player asked for the tuner since the last pass, leave
+                # it alone this pass
+                yielded = self._yield_requested
+                self._yield_requested = False
+                if yielded or self._paused or self._end_task.is_set() or \
+                        (not self.spare_tuner and not self.idle()):
+                    continue
+                # From here a yield, pause or stop aborts the scan
+                self.scheduler.abort.clear()
+                self._tuner_free.clear()
+            block = self.next_block()
+            try:
+                result = self.scheduler.scan_block(block, self.device)
+            finally:
+                self._tuner_free.set()
+            if result.outcome == "aborted":
+                continue
+            self.last_scanned[block] = time.monotonic()
+            self.blocks_scanned += 1
+            try:
+                self.on_result(result)
+            except Exception as e:
+                logger.error("Background rescan of %s failed: %s", block, e)
@@ -0,0 +1,215 @@
+'''
+Spectrum analysis for the visualisers. The window, filter, pixel to bin
+map and band matrices are worked out once, so each chunk is one FFT and
+one gather or matrix-vector product.
+'''
+import logging
+from enum import StrEnum
+
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi
+
+logger = logging.getLogger(__name__)
+
+# FFT magnitudes are scaled down by this
+MAGNITUDE_SCALE = 1/10000
+
+
+class BandScale(StrEnum):
+    LOG = "log"
+    MEL = "mel"
+
+
+def hz_to_mel(f):
+    return 2595.0 * np.log10(1.0 + np.asarray(f) / 700.0)
+
+
+def mel_to_hz(m):
+    return 700.0 * (10.0 ** (np.asarray(m) / 2595.0) - 1.0)
+
+
+class SpectrumAnalyzer():
+    '''
+    Turn a chunk of interleaved audio into a magnitude spectrum.
+
+    sample_rate:     Sample rate of the audio
+    chunk_size:      Frames per chunk (per channel)
+    channels:        Interleaved channels in the signal. Mixed to mono
+    num_bins:        Bins of the spectrum to keep. The visualisers only
+                     look at the lower part of the spectrum
+    use_window:      Apply a Hann window to reduce spectral leakage
+    low_pass_cutoff: If >0 apply a low pass filter (Hz) so the lower
+                     frequencies have more energy
+    '''
+    def __init__(self,
+                 sample_rate:int=48000,
+                 chunk_size:int=2048,
+                 channels:int=2,
+                 num_bins:int=512,
+                 use_window:bool=False,
+                 low_pass_cutoff:float=0.0,
+                 filter_order:int=4):
+
+        self.sample_rate     = 0
+        self.channels        = channels
+        self.num_bins        = num_bins
+        self.use_window      = use_window
+        self.low_pass_cutoff = low_pass_cutoff
+        self.filter_order    = filter_order
+        self._sos            = None
+        self.chunk_size      = 0
+
+        self.set_chunk_size(chunk_size)
+        self.set_sample_rate(sample_rate)
+
+    def set_sample_rate(self, sample_rate:int):
+        '''
+        (Re)design the filter, only if the sample rate has changed
+        '''
+        sample_rate = int(sample_rate)
+        if sample_rate == self.sample_rate:
+            return
+        self.sample_rate = sample_rate
+        self._sos = None
+        if self.low_pass_cutoff > 0.0:
+            nyq_freq = float(self.sample_rate)/2.0
+            self._sos = butter(self.filter_order, self.low_pass_cutoff/nyq_freq,
+                               btype='lowpass', analog=False, output='sos')
+            # Filter state carried from chunk to chunk
+            self._zi  = sosfilt_zi(self._sos) * 0.0
+        self._band_matrices = dict()
+        logger.info("Spectrum sample rate: %d, low pass: %0.1fHz", self.sample_rate, self.low_pass_cutoff)
+
+    def set_chunk_size(self, chunk_size:int):
+        '''
+        Allocate buffers for chunks of chunk_size frames
+        '''
+        if chunk_size == self.chunk_size:
+            return
+        self.chunk_size     = chunk_size
+        self.window         = np.hanning(chunk_size).astype(np.float32)
+        self._mono          = np.zeros(chunk_size, dtype=np.float32)
+        self._fft_out       = np.zeros(chunk_size//2 + 1, dtype=np.complex64)
+        self._magnitude     = np.zeros(chunk_size//2 + 1, dtype=np.float32)
+        self.spectrum       = self._magnitude[0:min(self.num_bins, len(self._magnitude))]
+        self._columns       = dict()
+        self._bin_maps      = dict()
+        self._band_matrices = dict()
+        self._bands         = dict()
+
+    def analyse(self, signal:np.ndarray, is_mono:bool=False) -> tuple[float, np.ndarray]:
+        '''
+        Calc FFT of signal. Returns the max magnitude and the spectrum.
+        The spectrum is a view of an internal buffer, overwritten on the
+        next call.
+        '''
+        self.mix(signal, is_mono=is_mono)
+        return self.transform()
+
+    def mix(self, signal:np.ndarray, is_mono:bool=False) -> np.ndarray:
+        '''
+        Mix signal to mono into an internal float32 buffer and return it
+        '''
+        frames = len(signal) if is_mono else len(signal) // self.channels
+        self.set_chunk_size(frames)
+
+        mono = self._mono
+        if is_mono:
+            mono[:] = signal
+        else:
+            np.add(signal[0::self.channels], signal[1::self.channels], out=mono, dtype=np.float32)
+            mono *= 0.5
+        return mono
+
+    def transform(self) -> tuple[float, np.ndarray]:
+        '''
+        FFT of the last mixed chunk. The filter state is carried over so
+        call this once per chunk.
+        '''
+        mono = self._mono
+
+        # Causal single pass filter
+        if self._sos is not None:
+            (mono[:], self._zi) = sosfilt(self._sos, mono, zi=self._zi)
+
+        if self.use_window:
+            mono *= self.window
+
+        # FFT magic
+        np.fft.rfft(mono, out=self._fft_out)
+        np.abs(self._fft_out, out=self._magnitude)
+        self._magnitude *= MAGNITUDE_SCALE
+
+        max_magnitude = float(np.max(self.spectrum))
+        if max_magnitude == 0.0:
+            max_magnitude = 0.01
+        return (max_magnitude, self.spectrum)
+
+    def full_scale(self) -> float:
+        '''
+        Spectrum magnitude of a full scale int32 sine centred on a bin
+        '''
+        gain = float(self.window.sum()) if self.use_window else float(self.chunk_size)
+        return 2**31 * gain / 2 * MAGNITUDE_SCALE
+
+    def bin_map(self, width:int) -> np.ndarray:
+        '''
+        Pixel x to spectrum bin index, spread linearly over width pixels
+        '''
+        if width not in self._bin_maps:
+            num_bins = len(self.spectrum)
+            bin_index = ((np.arange(width) / width) * num_bins).astype(np.intp)
+            bin_index[bin_index >= num_bins] = num_bins - 1
+            self._bin_maps[width] = bin_index
+        return self._bin_maps[width]
+
+    def columns(self, width:int) -> np.ndarray:
+        '''
+        Gather the last spectrum into width pixel columns
+        '''
+        if width not in self._columns:
+            self._columns[width] = np.zeros(width, dtype=np.float32)
+        return np.take(self.spectrum, self.bin_map(width), out=self._columns[width])
+
+    def band_matrix(self, num_bands:int, scale:BandScale=BandScale.LOG,
+                    f_min:float=40.0, f_max:float=0.0) -> np.ndarray:
+        '''
+        (num_bands, bins) weights from the spectrum to num_bands log or mel
+        spaced bands for the current sample rate and chunk size. Each band
+        is a triangle centred on its frequency, as wide as the gap to its
+        neighbours but never narrower than a bin, so the low bands, which
+        are closer together than the bins, interpolate between bins rather
+        than repeat one. Rows sum to 1 so a band is a weighted mean.
+        f_max of 0 means the top of the kept spectrum
+        '''
+        key = (num_bands, scale, f_min, f_max)
+        if key not in self._band_matrices:
+            hz_per_bin = self.sample_rate / self.chunk_size
+            num_bins   = len(self.spectrum)
+            if f_max <= 0.0:
+                f_max = (num_bins - 1) * hz_per_bin
+            if scale == BandScale.MEL:
+                centres = mel_to_hz(np.linspace(hz_to_mel(f_min), hz_to_mel(f_max), num_bands))
+            else:
+                centres = np.geomspace(f_min, f_max, num_bands)
+            centres /= hz_per_bin
+
+            gaps  = np.diff(centres) if num_bands > 1 else np.array([float(num_bins)])
+            gaps  = np.concatenate(([gaps[0]], gaps, [gaps[-1]]))
+            width = np.maximum((gaps[:-1] + gaps[1:]) / 2, 1.0)
+            bins  = np.arange(num_bins)
+            weights = np.maximum(0.0, 1.0 - np.abs(bins - centres[:, np.newaxis]) / width[:, np.newaxis])
+            weights /= weights.sum(axis=1, keepdims=True)
+            self._band_matrices[key] = weights.astype(np.float32)
+            logger.info("Band matrix: %d %s bands over %d bins, %0.0f-%0.0fHz",
+                        num_bands, scale, num_bins, f_min, f_max)
+        return self._band_matrices[key]
+
+    def bands(self, num_bands:int, scale:BandScale=BandScale.LOG) -> np.ndarray:
+        '''
+        Band magnitudes of the last spectrum, one matrix-vector product
+        '''
+        key = (num_bands, scale)
+        if key not in self._bands:
+            self._bands[key] = np.zeros(num_bands, dtype=np.float32)
+        return np.matmul(self.band_matrix(num_bands, scale), self.spectrum, out=self._bands[key])
@@ -18,6 +18,9 @@ def load_state(state:lcd_ui.UIState):
             state.ensemble = config['ensemble']
             state.visualiser_enabled = config['enable_visualiser']
             state.visualiser = config['visualiser']
+            state.waveform_decimation = config['waveform_decimation'] if 'waveform_decimation' in config else "peak"
+            state.band_scale = config['band_scale'] if 'band_scale' in config else "log"
+            state.metrics_enabled = config['metrics_enabled'] if 'metrics_enabled' in config else False
             state.levels_enabled = config['enable_levels']
             state.pulse_left_led_encoder = config['pulse_left_led_encoder']
             state.pulse_right_led_encoder = config['pulse_right_led_encoder']
@@ -51,6 +54,9 @@ def save_state(state:lcd_ui.UIState):
         "pulse_right_led_encoder": state.pulse_right_led_encoder,
         "enable_visualiser": state.visualiser_enabled,
         "visualiser": state.visualiser,
+        "waveform_decimation": state.waveform_decimation,
+        "band_scale": state.band_scale,
+        "metrics_enabled": state.metrics_enabled,
         "enable_levels": state.levels_enabled,
         "station_enabled": state.station_enabled,
         "mode": mode,
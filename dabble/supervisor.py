@@ -0,0 +1,351 @@
+'''
+Look after a child process (dablin, eti-cmdline).
+
+The supervisor owns the process: it starts it along with any threads
+reading its output, restarts it with a backoff if it exits when it
+shouldn't, and on stop terminates it, waits for it to exit (killing it
+if it won't) and joins its threads so nothing is left behind.
+
+AsyncProcessSupervisor does the same on an asyncio loop, reading the
+process' stderr on the loop instead of in a thread.
+'''
+import asyncio
+import logging
+import os
+import subprocess
+import time
+from collections import Counter, deque
+from threading import Event, Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessSupervisor():
+    '''
+    name:         For logs and thread names
+    cmdline:      Returns the argument list to run. Called on every (re)start
+    on_start:     Called with each new Popen, returns the threads it started
+                  to read the process' output. They must end at EOF
+    popen_args:   Passed to subprocess.Popen
+    restart:      Restart the process if it exits without stop() being called
+    backoff:      First and maximum restart delay in seconds. The delay
+                  doubles on each restart until the process stays up for
+                  stable_time seconds
+    stop_timeout: Seconds to wait after terminate before kill
+    '''
+    def __init__(self,
+                 name:str,
+                 cmdline,
+                 on_start=lambda proc: [],
+                 popen_args:dict|None=None,
+                 restart:bool=True,
+                 backoff:tuple[float,float]=(0.5, 30.0),
+                 stable_time:float=30.0,
+                 stop_timeout:float=2.0):
+        self.name         = name
+        self.cmdline      = cmdline
+        self.on_start     = on_start
+        self.popen_args   = popen_args or dict()
+        self.restart      = restart
+        self.backoff      = backoff
+        self.stable_time  = stable_time
+        self.stop_timeout = stop_timeout
+
+        self.proc         = None
+        self._threads     = []
+        self._monitor     = None
+        self._stopping    = Event()
+        self._lock        = Lock()
+        self._started_at  = 0.0
+        self._failures    = 0  # Unexpected exits in a row
+
+        # Counters
+        self.starts       = 0
+        self.restarts     = 0
+        self.kills        = 0
+        self.exit_codes   = Counter()
+        self.time_to_audio = deque(maxlen=20)
+        self._audio_marked = False
+
+    @property
+    def running(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    @property
+    def active(self) -> bool:
+        '''
+        Started and not yet stopped
+        '''
+        return self._monitor is not None
+
+    def _spawn(self):
+        self.proc = subprocess.Popen(self.cmdline(), **self.popen_args)
+        self._started_at = time.monotonic()
+        self._audio_marked = False
+        self._threads = list(self.on_start(self.proc))
+        self.starts += 1
+        logger.info("%s started, pid %d", self.name, self.proc.pid)
+
+    def start(self):
+        with self._lock:
+            self._stopping.clear()
+            self._failures = 0
+            self._spawn()
+            self._monitor = Thread(target=self._watch, name=f'{self.name}_supervisor', daemon=True)
+            self._monitor.start()
+
+    def _join_threads(self, timeout:float=1.0):
+        for t in self._threads:
+            t.join(timeout=timeout)
+            if t.is_alive():
+                logger.warning("%s: %s still running", self.name, t.name)
+        self._threads = []
+
+    def _restart_delay(self, code:int) -> float|None:
+        '''
+        The process exited unexpectedly. How long to wait before restarting
+        it or None if it isn't to be restarted
+        '''
+        uptime = time.monotonic() - self._started_at
+        self._failures = 1 if uptime >= self.stable_time else self._failures + 1
+        if not self.restart:
+            logger.error("%s exited unexpectedly (%d)", self.name, code)
+            return None
+
+        delay = min(self.backoff[1], self.backoff[0] * 2**(self._failures - 1))
+        logger.error("%s exited unexpectedly (%d) after %0.1fs, restarting in %0.1fs",
+                     self.name, code, uptime, delay)
+        return delay
+
+    def _watch(self):
+        '''
+        Wait for the process to exit and restart it unless we're stopping
+        '''
+        while True:
+            code = self.proc.wait()
+            self.exit_codes[code] += 1
+            if self._stopping.is_set():
+                return
+
+            self._join_threads()
+            if (delay := self._restart_delay(code)) is None:
+                return
+            if self._stopping.wait(delay):
+                return
+            with self._lock:
+                if self._stopping.is_set():
+                    return
+                self._spawn()
+                self.restarts += 1
+
+    def stop(self):
+        '''
+        Terminate the process and return as soon as it has exited
+        '''
+        with self._lock:
+            self._stopping.set()
+            if self.proc is None:
+                return
+            if self.proc.poll() is None:
+                self.proc.terminate()
+                try:
+                    self.proc.wait(timeout=self.stop_timeout)
+                except subprocess.TimeoutExpired:
+                    logger.warning("%s didn't terminate, killing", self.name)
+                    self.proc.kill()
+                    self.proc.wait()
+                    self.kills += 1
+        if self._monitor is not None:
+            self._monitor.join()
+            self._monitor = None
+        self._join_threads()
+        logger.info("%s stopped (%s)", self.name, self.proc.returncode)
+
+    def mark_audio(self):
+        '''
+        Audio has started, record how long it took since the process started
+        '''
+        if not self._audio_marked:
+            self._audio_marked = True
+            self.time_to_audio.append(time.monotonic() - self._started_at)
+
+    def stats(self) -> dict:
+        return {
+            "starts":        self.starts,
+            "restarts":      self.restarts,
+            "kills":         self.kills,
+            "exit_codes":    dict(self.exit_codes),
+            "time_to_audio": sum(self.time_to_audio)/len(self.time_to_audio) if self.time_to_audio else None,
+        }
+
+
+class AsyncProcessSupervisor(ProcessSupervisor):
+    '''
+    A ProcessSupervisor whose process runs on an asyncio loop. Each line
+    the process writes to stderr is passed to on_line on the loop, no
+    threads are needed to read it. From another thread, or when the loop
+    isn't running, start() and stop() wait until done. Called on the loop
+    itself waiting would deadlock so they queue the work, in order, and
+    return straight away.
+
+    loop:    The event loop
+    on_line: Called on the loop with each line of stderr
+    stdin:   Called before every (re)start, returns a file descriptor for
+             the process to read (closed once the process has it) or None
+    '''
+    def __init__(self,
+                 name:str,
+                 cmdline,
+                 loop:asyncio.AbstractEventLoop,
+                 on_line,
+                 stdin=None,
+                 line_limit:int=1<<16,
+                 **kwargs):
+        super().__init__(name, cmdline, **kwargs)
+        self.loop       = loop
+        self.on_line    = on_line
+        self.stdin      = stdin
+        self.line_limit = line_limit
+        self._task      = None
+        self._queued    = None  # Last start/stop task, the next waits for it
+
+    @property
+    def running(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    @property
+    def active(self) -> bool:
+        return self._task is not None
+
+    def _on_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    async def _in_turn(self, coro):
+        '''
+        Run coro once the start/stop before it has finished
+        '''
+        previous     = self._queued
+        self._queued = asyncio.current_task()
+        if previous is not None and not previous.done():
+            await asyncio.wait({previous})
+        return await coro
+
+    def _run(self, coro):
+        if not self.loop.is_running():
+            return self.loop.run_until_complete(coro)
+        if self._on_loop():
+            # Can't block the loop waiting for itself
+            return self.loop.create_task(self._in_turn(coro), name=f'{self.name}_control')
+        return asyncio.run_coroutine_threadsafe(self._in_turn(coro), self.loop).result()
+
+    async def _spawn_async(self):
+        fd = self.stdin() if self.stdin is not None else None
+        try:
+            self.proc = await asyncio.create_subprocess_exec(
+                *self.cmdline(),
+                stdin=subprocess.DEVNULL if fd is None else fd,
+                stderr=subprocess.PIPE,
+                limit=self.line_limit)
+        finally:
+            if fd is not None:
+                os.close(fd)
+        self._started_at = time.monotonic()
+        self._audio_marked = False
+        self.starts += 1
+        logger.info("%s started, pid %d", self.name, self.proc.pid)
+
+    async def _start(self):
+        self._stopping.clear()
+        self._failures = 0
+        await self._spawn_async()
+        self._task = self.loop.create_task(self._watch_async(), name=f'{self.name}_supervisor')
+
+    def start(self):
+        '''
+        Start the process. On the loop returns the task doing it
+        '''
+        with self._lock:
+            return self._run(self._start())
+
+    async def _read(self):
+        while True:
+            try:
+                line = await self.proc.stderr.readline()
+            except ValueError:
+                # Longer than line_limit, what was read has been dropped
+                continue
+            if not line:
+                return
+            try:
+                self.on_line(line.decode(errors="replace").replace("\n",""))
+            except Exception:
+                logger.exception("%s: error handling line", self.name)
+
+    async def _exited(self, poll:float=0.25) -> int:
+        '''
+        Wait for the process to exit. Process.wait() also waits for its
+        pipes to close, which anything it started could be holding open
+        '''
+        while self.proc.returncode is None:
+            await asyncio.sleep(poll)
+        return self.proc.returncode
+
+    async def _watch_async(self):
+        '''
+        Read stderr while the process runs then restart it unless we're
+        stopping
+        '''
+        while True:
+            reader = self.loop.create_task(self._read())
+            code = await self._exited()
+            # Finish reading what was written before it exited. Anything it
+            # left running could hold stderr open so don't wait for EOF
+            await asyncio.wait({reader}, timeout=0.5)
+            reader.cancel()
+            self.exit_codes[code] += 1
+            if self._stopping.is_set():
+                return
+            if (delay := self._restart_delay(code)) is None:
+                return
+            await asyncio.sleep(delay)
+            if self._stopping.is_set():
+                return
+            await self._spawn_async()
+            self.restarts += 1
+
+    async def _stop(self):
+        self._stopping.set()
+        if self.proc is None:
+            return
+        if self.proc.returncode is None:
+            self.proc.terminate()
+            try:
+                await asyncio.wait_for(self._exited(poll=0.01), timeout=self.stop_timeout)
+            except TimeoutError:
+                logger.warning("%s didn't terminate, killing", self.name)
+                self.proc.kill()
+                await self._exited(poll=0.01)
+                self.kills += 1
+        if self._task is not None:
+            # Gives the watcher a moment to read to EOF and count the exit.
+            # It may be waiting to restart, there's nothing left to read then
+            (done, _) = await asyncio.wait({self._task}, timeout=0.5)
+            if not done:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            self._task = None
+        logger.info("%s stopped (%s)", self.name, self.proc.returncode)
+
+    def stop(self):
+        '''
+        Terminate the process and return as soon as it has exited. On
+        the loop returns straight away with the task doing it
+        '''
+        with self._lock:
+            return self._run(self._stop())
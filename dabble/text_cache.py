@@ -0,0 +1,113 @@
+'''
+Pre-rendered text for the LCD. Each (text, font, colour, anchor) is
+rendered once to an RGBA strip and pasted from then on, kept in an LRU
+bounded by memory. Clear it when the fonts are reloaded.
+'''
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from PIL import Image, ImageDraw
+
+from . import rasteriser
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TextStrip():
+    image:Image.Image | None   # RGBA, None if nothing is drawn e.g. " "
+    bbox:tuple                 # (x1,y1,x2,y2) relative to the anchor point
+    length:float               # Advance width, as ImageDraw.textlength
+
+    @property
+    def height(self) -> int:
+        return abs(self.bbox[3] - self.bbox[1])
+
+    @property
+    def nbytes(self) -> int:
+        return 0 if self.image is None else self.image.width * self.image.height * 4
+
+
+class TextCache():
+    '''
+    max_bytes: Memory the strips may use before the least recently used
+               are evicted
+    '''
+    def __init__(self, max_bytes:int=1<<20):
+        self.max_bytes = max_bytes
+        self._strips   = OrderedDict()
+        self._measures = OrderedDict()
+        self.nbytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    def _render(self, text:str, font, colour, anchor:str) -> TextStrip:
+        bbox   = font.getbbox(text, anchor=anchor)
+        length = font.getlength(text)
+        (w, h) = (bbox[2] - bbox[0], bbox[3] - bbox[1])
+        if w <= 0 or h <= 0:
+            return TextStrip(None, bbox, length)
+
+        mask = Image.new("L", (w, h), 0)
+        ImageDraw.Draw(mask).text((-bbox[0], -bbox[1]), text, font=font, fill=255, anchor=anchor)
+        strip = Image.new("RGBA", (w, h), rasteriser.rgb(colour) + (0,))
+        strip.putalpha(mask)
+        return TextStrip(strip, bbox, length)
+
+    def strip(self, text:str, font, colour, anchor:str="la") -> TextStrip:
+        key = (text, font, colour, anchor)
+        if (s := self._strips.get(key)) is not None:
+            self._strips.move_to_end(key)
+            self.hits += 1
+            return s
+
+        self.misses += 1
+        s = self._render(text, font, colour, anchor)
+        self._strips[key] = s
+        self.nbytes += s.nbytes
+        while self.nbytes > self.max_bytes and len(self._strips) > 1:
+            (_, old) = self._strips.popitem(last=False)
+            self.nbytes -= old.nbytes
+            self.evictions += 1
+        return s
+
+    def measure(self, text:str, font, anchor:str="la") -> tuple[tuple, float]:
+        '''
+        (bbox, length) without rendering, as font.getbbox and
+        ImageDraw.textlength give them
+        '''
+        key = (text, font, anchor)
+        if (m := self._measures.get(key)) is not None:
+            self._measures.move_to_end(key)
+            return m
+        m = (font.getbbox(text, anchor=anchor), font.getlength(text))
+        self._measures[key] = m
+        if len(self._measures) > 256:
+            self._measures.popitem(last=False)
+        return m
+
+    def draw(self, img:Image.Image, xy:tuple, text:str, font, colour, anchor:str="la") -> tuple:
+        '''
+        Paste text into img at xy as ImageDraw.text would draw it.
+        Returns its bounding box in img
+        '''
+        s = self.strip(text, font, colour, anchor)
+        (x, y) = (int(xy[0]), int(xy[1]))
+        if s.image is not None:
+            img.paste(s.image, (x + s.bbox[0], y + s.bbox[1]), s.image)
+        return (x + s.bbox[0], y + s.bbox[1], x + s.bbox[2], y + s.bbox[3])
+
+    def clear(self):
+        self._strips.clear()
+        self._measures.clear()
+        self.nbytes = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self) -> str:
+        return (f'{len(self._strips)} strips {self.nbytes/1024:.0f}KiB '
+                f'hit rate {100*self.hit_rate():.1f}% evictions {self.evictions}')
@@ -0,0 +1,212 @@
+'''
+One scheduler for all the UI's timeouts.
+
+Menu and station selection timeouts are reset on every detent of an
+encoder, so a fast spin resets them dozens of times a second. A hashed
+timer wheel makes schedule, reset and cancel O(1): time is cut into ticks,
+a timer lives in the slot for the tick it is due and only the slot for the
+current tick is looked at. Timers due more than a lap away wait in their
+slot until their lap comes round.
+
+The wheel is driven either by the radio's event loop (attach()), when
+callbacks run on the loop, or by one thread of its own started the first
+time a timer is scheduled.
+'''
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class WheelTimer():
+    __slots__ = ("callback", "name", "delay", "due", "active")
+
+    def __init__(self, callback, name:str="", delay:float=0.0):
+        self.callback = callback
+        self.name     = name
+        self.delay    = delay
+        self.due      = 0      # Tick
+        self.active   = False
+
+
+class TimerWheel():
+    '''
+    tick:  Resolution in seconds
+    slots: Slots in the wheel. A lap is tick*slots seconds
+    '''
+    def __init__(self, tick:float=0.05, slots:int=512):
+        self.tick     = tick
+        self.slots    = slots
+        self._wheel   = [set() for _ in range(slots)]
+        self._lock    = threading.Lock()
+        self._wake    = threading.Condition(self._lock)
+        self._epoch   = time.monotonic()
+        self._current = 0      # Last tick processed
+        self._count   = 0      # Timers waiting
+        self._thread  = None
+        self._stopping= threading.Event()
+        self._loop    = None
+        self._ticking = False  # A loop tick is pending
+
+        # Stats
+        self.threads_created = 0
+        self.fired    = 0
+        self.resets   = 0
+        self.reset_ns = deque(maxlen=1000)
+
+    def _ticks(self, now:float) -> int:
+        return int((now - self._epoch) / self.tick)
+
+    def _insert(self, timer:WheelTimer, delay:float):
+        due = math.ceil((time.monotonic() + delay - self._epoch) / self.tick)
+        timer.due    = max(due, self._current + 1)
+        timer.delay  = delay
+        timer.active = True
+        self._wheel[timer.due % self.slots].add(timer)
+        self._count += 1
+
+    def _remove(self, timer:WheelTimer):
+        if timer.active:
+            self._wheel[timer.due % self.slots].discard(timer)
+            timer.active = False
+            self._count -= 1
+
+    def _kick(self):
+        '''
+        Make sure something will advance the wheel. Called with the lock held
+        '''
+        if self._loop is not None:
+            if not self._ticking:
+                self._ticking = True
+                self._loop.call_soon_threadsafe(self._loop_tick)
+        elif self._stopping.is_set():
+            return  # Stopped, or the thread is handing over to a loop
+        elif self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="timer_wheel", daemon=True)
+            self.threads_created += 1
+            self._thread.start()
+        else:
+            self._wake.notify()
+
+    def schedule(self, delay:float, callback, name:str="") -> WheelTimer:
+        '''
+        Call callback in delay seconds
+        '''
+        timer = WheelTimer(callback, name)
+        with self._lock:
+            self._insert(timer, delay)
+            self._kick()
+        return timer
+
+    def reset(self, timer:WheelTimer, delay:float|None=None) -> WheelTimer:
+        '''
+        Start timer counting again from now, for delay seconds or what it
+        was last scheduled for. Rearms a timer that has fired or been
+        cancelled
+        '''
+        t1 = time.perf_counter_ns()
+        with self._lock:
+            self._remove(timer)
+            self._insert(timer, timer.delay if delay is None else delay)
+            self._kick()
+            self.resets += 1
+        self.reset_ns.append(time.perf_counter_ns() - t1)
+        return timer
+
+    def cancel(self, timer:WheelTimer):
+        with self._lock:
+            self._remove(timer)
+
+    def advance(self, now:float|None=None) -> int:
+        '''
+        Fire everything due by now. Returns the number fired
+        '''
+        due = []
+        with self._lock:
+            target = self._ticks(time.monotonic() if now is None else now)
+            if self._count == 0:
+                self._current = max(self._current, target)
+            # Never more than a lap, every slot has been looked at by then
+            for tick in range(self._current + 1, min(target, self._current + self.slots) + 1):
+                bucket = self._wheel[tick % self.slots]
+                if not bucket:
+                    continue
+                for timer in [t for t in bucket if t.due <= target]:
+                    bucket.discard(timer)
+                    timer.active = False
+                    due.append(timer)
+            self._current = max(self._current, target)
+            self._count -= len(due)
+
+        for timer in due:
+            try:
+                timer.callback()
+            except Exception:
+                logger.exception("Timer %s failed", timer.name)
+        self.fired += len(due)
+        return len(due)
+
+    def _run(self):
+        # Until stopped, attach() stops it before handing over to a loop
+        while not self._stopping.is_set():
+            with self._wake:
+                while self._count == 0 and not self._stopping.is_set():
+                    self._wake.wait()
+            if self._stopping.wait(self.tick):
+                return
+            self.advance()
+
+    def attach(self, loop:asyncio.AbstractEventLoop):
+        '''
+        Advance the wheel on loop, callbacks then run on the loop. Only
+        while there are timers waiting. Waits for the wheel's own thread,
+        if running, to finish its tick and exit so nothing fires off the loop
+        once this returns
+        '''
+        self.stop()
+        with self._lock:
+            self._loop = loop
+            self._stopping.clear()
+            if self._count:
+                self._kick()
+
+    def _loop_tick(self):
+        self.advance()
+        with self._lock:
+            if self._count:
+                self._loop.call_later(self.tick, self._loop_tick)
+            else:
+                self._ticking = False
+
+    def stop(self):
+        self._stopping.set()
+        with self._wake:
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        '''
+        Counts and reset latency percentiles (microseconds)
+        '''
+        p = (np.percentile(np.fromiter(self.reset_ns, dtype=float), (50, 99)) / 1000
+             if self.reset_ns else (0.0, 0.0))
+        return {
+            "timers":          self._count,
+            "fired":           self.fired,
+            "resets":          self.resets,
+            "reset_us_p50":    float(p[0]),
+            "reset_us_p99":    float(p[1]),
+            "threads_created": self.threads_created,
+        }
+
+
+# Shared by every timer in the UI
+WHEEL = TimerWheel()
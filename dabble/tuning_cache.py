@@ -0,0 +1,73 @@
+'''
+What we last saw for each station, kept between runs.
+
+dablin has to rediscover the ensemble every time it starts so the DAB type,
+genre and audio format take a few seconds to arrive. The cache keeps the
+last values seen for each (channel, SId) so the UI can show them as soon
+as a station is tuned, plus tuning hints such as the gain that worked.
+'''
+import json
+import logging
+from pathlib import Path
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+# What is kept for each station
+CACHED_KEYS = ("dab_type", "prog_type", "media_fmt", "label", "gain")
+
+
+class TuningCache():
+    def __init__(self, path:Path=Path("tuning-cache.json")):
+        self.path    = Path(path)
+        self._lock   = Lock()
+        self._cache  = dict()
+        self._dirty  = False
+        self.load()
+
+    @staticmethod
+    def _key(channel:str, sid:str) -> str:
+        return f'{channel}/{sid.lower()}'
+
+    def load(self):
+        try:
+            with open(self.path) as j:
+                self._cache = json.load(j)
+            logger.info("Tuning cache: %d stations", len(self._cache))
+        except FileNotFoundError:
+            self._cache = dict()
+        except json.JSONDecodeError as e:
+            logger.error("Tuning cache %s is corrupt, ignoring: %s", self.path, e)
+            self._cache = dict()
+
+    def save(self):
+        '''
+        Write the cache if anything has changed
+        '''
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w") as j:
+                json.dump(self._cache, j)
+            tmp.replace(self.path)
+            self._dirty = False
+
+    def get(self, channel:str, sid:str) -> dict:
+        with self._lock:
+            return dict(self._cache.get(self._key(channel, sid), {}))
+
+    def update(self, channel:str, sid:str, **values) -> bool:
+        '''
+        Store values for a station, ignoring empty values and keys not in
+        CACHED_KEYS. Returns True if anything changed
+        '''
+        with self._lock:
+            entry = self._cache.setdefault(self._key(channel, sid), dict())
+            changed = False
+            for k, v in values.items():
+                if k in CACHED_KEYS and v not in (None, "") and entry.get(k) != v:
+                    entry[k] = v
+                    changed = True
+            self._dirty |= changed
+            return changed
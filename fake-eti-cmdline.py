@@ -0,0 +1,58 @@
+'''
+Stand in for eti-cmdline-rtlsdr when scanning on a machine without an SDR.
+
+Takes the same scan options (-C block, -D scantime, -d device), waits a
+while as if tuning and writes ensemble-ch-<block>.json for the blocks
+below. Other blocks report no signal after a quarter of the dwell. The
+blocks in WEAK take three times as long to find their ensemble. To scan
+with it:
+
+    player.scan_cmdline = Template('python fake-eti-cmdline.py -J -x -C $block -D $scantime -Q $device_opts')
+
+FAKE_ETI_DWELL sets how long a block with an ensemble takes in seconds
+(default 0.5)
+'''
+import argparse
+import json
+import os
+import sys
+import time
+
+ENSEMBLES = {
+    "11A": ("Sound Digital",  {"Magic Radio": "0xC0C6", "Jazz FM": "0xC2A5", "Union Jack": "0xC7D1"}),
+    "11D": ("D1 National",    {"Radio X": "0xC4CD", "Heart Dance": "0xCFE8", "Absolute Radio": "0xC1D8"}),
+    "12B": ("BBC National",   {"BBC Radio 1": "0xC221", "BBC Radio 2": "0xC222", "BBC Radio 4": "0xC224"}),
+    "12C": ("Bauer Local",    {"Magic Radio": "0xC3A1", "Kiss": "0xC3A2"}),
+}
+WEAK = {"12C"}
+
+p = argparse.ArgumentParser()
+p.add_argument("-C", dest="block", required=True)
+p.add_argument("-D", dest="scantime", type=float, default=8)
+p.add_argument("-d", dest="device", type=int, default=0)
+p.add_argument("-J", action="store_true")
+p.add_argument("-x", action="store_true")
+p.add_argument("-Q", action="store_true")
+args = p.parse_args()
+
+print(f'fake-eti-cmdline: device {args.device} scanning {args.block}', flush=True)
+dwell = float(os.environ.get("FAKE_ETI_DWELL", "0.5"))
+
+if args.block not in ENSEMBLES:
+    time.sleep(min(args.scantime, dwell / 4))
+    print("no DAB signal detected", flush=True)
+    sys.exit(0)
+
+(ensemble, stations) = ENSEMBLES[args.block]
+print("there might be a DAB signal here", flush=True)
+if args.block in WEAK:
+    dwell *= 3
+if dwell > args.scantime:
+    time.sleep(args.scantime)
+    sys.exit(0)
+time.sleep(dwell)
+print(f'ensemble {ensemble} is recognized', flush=True)
+with open(f'ensemble-ch-{args.block}.json', "w") as f:
+    json.dump({"ensemble": ensemble, "channel": args.block, "stations": stations}, f)
+# eti-cmdline keeps going until the end of its dwell
+time.sleep(args.scantime - dwell)
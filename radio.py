@@ -16,8 +16,8 @@ from pathlib import Path
 import paho.mqtt.client as mqtt
 from systemd.journal import JournalHandler
 
-from dabble import (audio_processing, encoder, exceptions, keyboard, lcd_ui,
-                    radio_player, radio_stations, menus, state, callbacks)
+from dabble import (audio_processing, core, encoder, exceptions, frame_rate, keyboard, lcd_ui,
+                    metrics, profiler, radio_player, radio_stations, menus, state, callbacks, timer_wheel)
 
 def shutdown(ui=None,kb=None,player=None, mqttc=None):
     if mqttc:
@@ -31,6 +31,8 @@ def shutdown(ui=None,kb=None,player=None, mqttc=None):
         ui.update()
         
     if player:
+        if player.background_rescan is not None:
+            player.background_rescan.stop()
         player.stop()
         time.sleep(1)
         
@@ -45,6 +47,19 @@ def shutdown(ui=None,kb=None,player=None, mqttc=None):
         ui.disp.display_off()
         ui.disp.set_backlight(0)
 
+async def render(ui, governor):
+    '''
+    Render loop
+    Frame rate depends on what's displayed. State changes wake
+    the loop early, see UIState.changed(). Callbacks run while
+    it waits for the next frame
+    '''
+    while True:
+        governor.frame_start()
+        ui.draw_interface()
+        governor.frame_end()
+        await governor.wait_async(ui.render_mode())
+
 #########################################################
 # MAIN
 #########################################################
@@ -73,6 +88,11 @@ except exceptions.FontException:
 # Set up state machine
 ui.state.radio_state = menus.RadioMachine()
 
+# Encoders, MQTT, timers and dablin's output are all handled on this loop
+event_loop = core.Core()
+ui.state.core = event_loop
+timer_wheel.WHEEL.attach(event_loop.loop)
+
 # Initialise stations and player
 logger.info("Loading radio stations")
 stations=radio_stations.RadioStations()
@@ -80,7 +100,9 @@ stations=radio_stations.RadioStations()
 logger.info("Initialising player")
 player=radio_player.RadioPlayer(
         radio_stations=stations, 
-        pad_update_handler = lambda updates: callbacks.pad_update_handler(ui,updates))
+        pad_update_handler = event_loop.bridge(lambda updates: callbacks.pad_update_handler(ui,updates)),
+        cached_metadata_handler = event_loop.bridge(lambda cached: callbacks.cached_metadata_handler(ui,cached)),
+        core=event_loop)
 
 # Load stations. If none then initiate scan
 try:
@@ -111,13 +133,13 @@ ui.state.left_encoder  = encoder.Encoder(
         device_type=encoder.EncoderTypes.FERMION_EC11_BREAKOUT, 
         pin_a=17, pin_b=27, pin_c=23, 
         bounce_time=0.1,
-        button_press_callback=lambda:callbacks.activate_or_run_menu(encoder.EncoderPosition.LEFT, ui, player, audio_processor))
+        button_press_callback=event_loop.bridge(lambda:callbacks.activate_or_run_menu(encoder.EncoderPosition.LEFT, ui, player, audio_processor)))
 
 ui.state.right_encoder = encoder.Encoder(
         device_type=encoder.EncoderTypes.FERMION_EC11_BREAKOUT, 
         pin_a=24, pin_b=25, pin_c=22, 
         bounce_time=0.1,
-        button_press_callback=lambda:callbacks.activate_or_run_menu(encoder.EncoderPosition.RIGHT, ui, player, audio_processor))
+        button_press_callback=event_loop.bridge(lambda:callbacks.activate_or_run_menu(encoder.EncoderPosition.RIGHT, ui, player, audio_processor)))
 
 logger.info("Setting colour of left encoder")
 ui.state.left_encoder.set_colour_by_rgb(ui.state.left_led_rgb)
@@ -141,7 +163,9 @@ ui.update()
 
 logger.info("Audio processing initialising")
 try:
-    audio_processor = audio_processing.AudioProcessing() 
+    audio_processor = audio_processing.AudioProcessing(columns=ui.WIDTH,
+                                                        decimation=ui.state.waveform_decimation,
+                                                        band_scale=ui.state.band_scale)
 except Exception as e:
     shutdown(ui=ui, player=player)
     sys.exit()
@@ -156,18 +180,18 @@ logger.info(f'Volume set to {audio_processor.volume()}%, adjust by {ui.state.vol
 audio_processor.start()
 audio_processor.stream.start_stream()
 
-# Set encoder twiddling callbacks
+# Set encoder twiddling callbacks. gpiozero calls them on its own threads
 if ui.state.radio_state.mode == menus.PlayerMode.RADIO:
-    ui.state.left_encoder.device.when_rotated_clockwise          = lambda: callbacks.change_station(ui,player,audio_processor)
-    ui.state.left_encoder.device.when_rotated_counter_clockwise  = lambda: callbacks.change_station(ui,player,audio_processor)
+    ui.state.left_encoder.device.when_rotated_clockwise          = event_loop.bridge(lambda: callbacks.change_station(ui,player,audio_processor))
+    ui.state.left_encoder.device.when_rotated_counter_clockwise  = event_loop.bridge(lambda: callbacks.change_station(ui,player,audio_processor))
 
-ui.state.right_encoder.device.when_rotated_clockwise         = lambda: ui.state.update("volume",audio_processor.vol_up(ui.state.volume_change_step))
-ui.state.right_encoder.device.when_rotated_counter_clockwise = lambda: ui.state.update("volume",audio_processor.vol_down(ui.state.volume_change_step))
+ui.state.right_encoder.device.when_rotated_clockwise         = event_loop.bridge(lambda: ui.state.update("volume",audio_processor.vol_up(ui.state.volume_change_step)))
+ui.state.right_encoder.device.when_rotated_counter_clockwise = event_loop.bridge(lambda: ui.state.update("volume",audio_processor.vol_down(ui.state.volume_change_step)))
 
-# Start MQTT event loop
+# Start MQTT event loop. Messages arrive on paho's thread and are handled on ours
 mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
 mqttc.on_connect = callbacks.on_connect
-mqttc.on_message = lambda client,userdata,msg: callbacks.on_message(client, userdata, msg, ui=ui, audio_processor=audio_processor, player=player)
+mqttc.on_message = event_loop.bridge(lambda client,userdata,msg: callbacks.on_message(client, userdata, msg, ui=ui, audio_processor=audio_processor, player=player))
 try:
     mqttc.connect("localhost", 1883, 60)
 except ConnectionRefusedError as e:
@@ -175,6 +199,14 @@ except ConnectionRefusedError as e:
 else:
     mqttc.loop_start()
 
+# Summarise the metrics to the journal and MQTT every minute, when enabled
+# in the state file or over MQTT (dabble-radio/metrics_enabled)
+metrics.METRICS.gauge("text_cache.hit_rate", ui.text_cache.hit_rate)
+metrics.METRICS.gauge("timers.waiting", lambda: timer_wheel.WHEEL.stats()["timers"])
+ui.state.metrics_reporter = metrics.Reporter(metrics.METRICS, interval=60,
+                                             publish=lambda summary: mqttc.publish("dabble-radio/metrics", summary))
+callbacks.enable_metrics(ui, ui.state.metrics_enabled)
+
 # Set up menus and callbacks
 ui.state.lm = menus.Menu()
 ui.state.current_menu_item=""
@@ -213,39 +245,35 @@ ui.state.rm.add_menu("Airplay Mode", init_state="On" if ui.state.radio_state.mod
         .change_state(lambda: "On" if ui.state.radio_state.mode == menus.PlayerMode.AIRPLAY else "Off")
 ui.state.rm.add_menu("Scan Channels").action(lambda: callbacks.initiate_scan(ui, player, audio_processor))
 ui.state.rm.add_menu("Standby").action(lambda: callbacks.enter_standby(ui, player, audio_processor))
+ui.state.rm.add_menu("Profile", init_state="Off")\
+        .action(lambda: callbacks.start_profile(ui, seconds=30))\
+        .change_state(lambda: "On" if profiler.PROFILER.running else "Off")
 ui.state.rm.add_menu("Exit").action(lambda: callbacks.exit_menu(encoder.EncoderPosition.RIGHT, ui, player, audio_processor))
 
+# Keep the station list fresh. Uses a spare tuner if there is one,
+# otherwise only when the radio isn't using it
+player.start_background_rescan(
+    idle=lambda: ui.state.radio_state.standby.is_active or ui.state.radio_state.mode == menus.PlayerMode.AIRPLAY)
+
 # Lets get this party started ...
 logger.info("Radio starting")
 ui.reset_station_name_scroll()
 
 try:
-    # Render loop
-    # TODO: Use callbacks perhaps? Will add complexity
-    # Calc FPS and Render times
-    fps=0
-    fps_st=time.time()
-    while True:
-        # TODO: Move FPS calc to draw_interface
-        t1=time.time_ns()
-        ui.draw_interface()
-        t2=time.time_ns()
-        render_time = ((t2-t1)/1000000)
-        fps_et=time.time()
-        if fps_et-fps_st>=1:
-            fps_st=time.time()
-            ui.state.fps = fps
-            ui.state.render_time = render_time
-            #logging.debug("FPS: %d %dms", fps, render_time)
-            fps=0
-        fps+=1
-        time.sleep(0.005)
-    # end while
+    governor = frame_rate.FrameRateGovernor()
+    governor.use_loop(event_loop.loop)
+    ui.state.frame_governor = governor
+    metrics.METRICS.gauge("render.fps", lambda: governor.achieved_fps)
+    metrics.METRICS.gauge("render.idle_pct", lambda: governor.idle_pct)
+    event_loop.run(render(ui, governor))
 
 except (KeyboardInterrupt,SystemExit):
+    audio_processor.stop()
     audio_processor.stream.close()
     audio_processor.p.terminate()
 
     logging.info("Shutting down")
+    ui.state.metrics_reporter.stop()
     shutdown(ui=ui,player=player)
+    event_loop.close()
     logger.info("Radio Hard Stop")